@@ -0,0 +1,125 @@
+"""
+Reference counts of the content-addressed media blobs (see
+ghandyStore.storage.ContentAddressedStorage).
+
+Every file field of any model whose storage is content-addressed counts as
+a reference to the blob it names. The signals in base.signals move the
+references with F() updates inside the saving transaction; bulk writes
+(``bulk_create``, ``update()``, fixtures) bypass them and call ``recount()``
+instead. A blob whose count drops to zero is kept on disk: a concurrent
+upload of the same bytes may be about to reference it again.
+"""
+from collections import Counter
+from functools import cache
+
+from django.apps import apps
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, FileField
+from django.utils import timezone
+
+from ghandyStore.storage import ContentAddressedStorage, blob_digest, blob_storage
+
+from .models import MediaBlob
+from .utils import stored_values
+
+RECOUNT_BATCH = 500
+
+
+@cache
+def blob_fields(model):
+    """Names of the file fields of ``model`` stored as blobs."""
+    return tuple(
+        field.attname for field in model._meta.concrete_fields
+        if isinstance(field, FileField) and isinstance(field.storage, ContentAddressedStorage)
+    )
+
+
+def all_blob_fields():
+    return [(model, field) for model in apps.get_models() for field in blob_fields(model)]
+
+
+def referenced_names(instance, fields):
+    return Counter(name for name in (getattr(instance, field).name for field in fields) if blob_digest(name))
+
+
+def stored_names(instance, fields):
+    """Blob names of the stored row of ``instance``, empty for new rows."""
+    return Counter(name for name in stored_values(instance, fields) or () if blob_digest(name))
+
+
+def mark_stored(name, size):
+    """
+    Record that an upload stored the blob ``name`` (again), which keeps
+    gc_media and the delete jobs off it for their grace period. The row is
+    created if needed, and the UPDATE waits for a delete holding its lock
+    (see item.orphans.delete_orphan), so the file is checked only after it.
+    """
+    now = timezone.now()
+    blobs = MediaBlob.objects.filter(name=name)
+    if blobs.update(stored_at=now):
+        return
+    try:
+        with transaction.atomic():
+            MediaBlob.objects.create(name=name, digest=blob_digest(name), size=size, stored_at=now)
+    except IntegrityError:
+        # Created by a concurrent upload in the meantime.
+        blobs.update(stored_at=now)
+
+
+def add_reference(name, delta):
+    if not delta or not blob_digest(name):
+        return
+    blobs = MediaBlob.objects.filter(name=name)
+    if delta < 0:
+        # Never below zero, even if the count drifted.
+        blobs.filter(refcount__gte=-delta).update(refcount=F('refcount') + delta)
+        return
+    if blobs.update(refcount=F('refcount') + delta):
+        return
+    try:
+        with transaction.atomic():
+            MediaBlob.objects.create(name=name, digest=blob_digest(name), size=blob_storage().size(name), refcount=delta)
+    except IntegrityError:
+        # Created by a concurrent save in the meantime.
+        blobs.update(refcount=F('refcount') + delta)
+
+
+def move_references(previous, current):
+    """Apply the change from one Counter of referenced names to another."""
+    for name in previous.keys() | current.keys():
+        add_reference(name, current[name] - previous[name])
+
+
+def recount(names=None):
+    """
+    Recompute the reference counts from the rows, for ``names`` or all
+    blobs. Returns the number of blobs whose count changed.
+    """
+    counts = Counter()
+    for model, field in all_blob_fields():
+        rows = model._base_manager.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+        if names is not None:
+            rows = rows.filter(**{f'{field}__in': names})
+        for name, references in rows.values(field).annotate(references=Count('pk')).values_list(field, 'references'):
+            if blob_digest(name):
+                counts[name] += references
+
+    existing = MediaBlob.objects.all() if names is None else MediaBlob.objects.filter(name__in=names)
+    changed = []
+    for blob in existing.only('pk', 'name', 'refcount').iterator():
+        refcount = counts.pop(blob.name, 0)
+        if blob.refcount != refcount:
+            blob.refcount = refcount
+            changed.append(blob)
+    MediaBlob.objects.bulk_update(changed, ['refcount'], batch_size=RECOUNT_BATCH)
+
+    storage = blob_storage()
+    missing = [name for name in counts if storage.exists(name)]
+    MediaBlob.objects.bulk_create(
+        [
+            MediaBlob(name=name, digest=blob_digest(name), size=storage.size(name), refcount=counts[name])
+            for name in missing
+        ],
+        batch_size=RECOUNT_BATCH, ignore_conflicts=True,
+    )
+    return len(changed) + len(missing)
@@ -0,0 +1,158 @@
+"""
+Background jobs queued in a database table and run by ``manage.py
+run_worker``; no broker is needed.
+
+    @jobs.register('item.generate_variants')
+    def generate_image_variants(source): ...
+
+    jobs.enqueue('item.generate_variants', {'source': name}, dedup_key=f'item.variants:{name}')
+
+Handlers live in a ``tasks`` module of an installed app and get the payload
+as keyword arguments. The job row is written in the caller's transaction,
+so work is only queued for changes that commit.
+
+A worker claims a job with one conditional UPDATE that marks it running
+and leases it for JOBS_VISIBILITY_TIMEOUT seconds (``run_at`` becomes the
+lease expiry); a job whose worker died is claimed again once the lease runs
+out, so handlers must be idempotent. Failures are retried with exponential
+backoff until ``max_attempts``, then the job is left ``failed`` with its
+traceback.
+"""
+import logging
+import random
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+JOBS_VISIBILITY_TIMEOUT = getattr(settings, 'JOBS_VISIBILITY_TIMEOUT', 60 * 5)
+JOBS_MAX_ATTEMPTS = getattr(settings, 'JOBS_MAX_ATTEMPTS', 5)
+# Retry n waits about JOBS_BACKOFF_BASE * 2**(n - 1) seconds, at most JOBS_BACKOFF_MAX.
+JOBS_BACKOFF_BASE = getattr(settings, 'JOBS_BACKOFF_BASE', 10)
+JOBS_BACKOFF_MAX = getattr(settings, 'JOBS_BACKOFF_MAX', 60 * 60)
+# Finished jobs are purged after this many seconds; failed ones are kept.
+JOBS_KEEP_DONE = getattr(settings, 'JOBS_KEEP_DONE', 60 * 60 * 24 * 7)
+
+# Jobs read per claim; concurrent workers race for them row by row.
+CLAIM_BATCH = 10
+
+_handlers = {}
+
+
+def register(name):
+    """Register the decorated function as the handler of jobs called ``name``."""
+    def decorator(func):
+        _handlers[name] = func
+        return func
+    return decorator
+
+
+def load_handlers():
+    autodiscover_modules('tasks')
+
+
+def enqueue(name, payload=None, dedup_key=None, delay=0, max_attempts=JOBS_MAX_ATTEMPTS):
+    """
+    Queue job ``name`` to run ``delay`` seconds from now. When a job with
+    ``dedup_key`` is already queued nothing is added and None is returned.
+    """
+    if dedup_key and Job.objects.filter(dedup_key=dedup_key).exists():
+        return None
+    job = Job(
+        name=name, payload=payload or {}, dedup_key=dedup_key or None,
+        run_at=timezone.now() + timedelta(seconds=delay), max_attempts=max_attempts,
+    )
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        if not dedup_key:
+            raise
+        # Queued by a concurrent request in the meantime.
+        return None
+    return job
+
+
+def claim(names=None, visibility=JOBS_VISIBILITY_TIMEOUT):
+    """
+    Lease the next due job (of ``names``, default any) to the caller, or
+    return None. The job's ``locked_by`` is the claim's token.
+    """
+    now = timezone.now()
+    # Running jobs are due again once their lease (run_at) has expired.
+    due = Job.objects.filter(status__in=(Job.QUEUED, Job.RUNNING), run_at__lte=now)
+    if names:
+        due = due.filter(name__in=names)
+    for pk in due.order_by('run_at', 'pk').values_list('pk', flat=True)[:CLAIM_BATCH]:
+        token = uuid.uuid4().hex
+        # The dedup key is released: changes from now on need a new run.
+        claimed = due.filter(pk=pk).update(
+            status=Job.RUNNING, run_at=now + timedelta(seconds=visibility), locked_by=token,
+            attempts=F('attempts') + 1, dedup_key=None,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def backoff(attempts):
+    delay = min(JOBS_BACKOFF_BASE * 2 ** (attempts - 1), JOBS_BACKOFF_MAX)
+    # Jitter keeps jobs that failed together from retrying together.
+    return delay * random.uniform(0.5, 1)
+
+
+def _record(job, **fields):
+    # Only the current claim may record an outcome; a worker whose lease
+    # expired and was taken over updates nothing.
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by).update(locked_by='', **fields)
+
+
+def run(job):
+    """Run a claimed job and record the outcome. Returns True on success."""
+    handler = _handlers.get(job.name)
+    try:
+        if job.attempts > job.max_attempts:
+            raise RuntimeError(f'Lease expired after {job.max_attempts} attempts')
+        if handler is None:
+            raise LookupError(f'No handler registered for {job.name!r}')
+        handler(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        now = timezone.now()
+        if job.attempts >= job.max_attempts:
+            logger.error('Job %s failed after %s attempts', job, job.attempts, exc_info=True)
+            _record(job, status=Job.FAILED, last_error=error, finished_at=now)
+        else:
+            logger.warning('Job %s failed, attempt %s of %s', job, job.attempts, job.max_attempts, exc_info=True)
+            _record(job, status=Job.QUEUED, last_error=error, run_at=now + timedelta(seconds=backoff(job.attempts)))
+        return False
+    _record(job, status=Job.DONE, finished_at=timezone.now())
+    return True
+
+
+def run_pending(names=None, limit=None):
+    """Run due jobs in this thread until none is left. Returns (ran, failed)."""
+    load_handlers()
+    ran = failed = 0
+    while limit is None or ran < limit:
+        job = claim(names)
+        if job is None:
+            break
+        ran += 1
+        failed += not run(job)
+    return ran, failed
+
+
+def purge(keep=JOBS_KEEP_DONE):
+    """Delete jobs that finished more than ``keep`` seconds ago."""
+    cutoff = timezone.now() - timedelta(seconds=keep)
+    return Job.objects.filter(status=Job.DONE, finished_at__lt=cutoff).delete()[0]
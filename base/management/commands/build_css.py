@@ -0,0 +1,44 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from base.stylesheet import OUTPUT, build, collect
+
+
+class Command(BaseCommand):
+    help = (
+        'Build base/static/css/site.css from the utility classes used by the templates; '
+        'fails on classes it cannot resolve'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only verify that the stylesheet on disk is up to date',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        classes = collect()
+        css, unresolved = build(classes)
+        if unresolved:
+            lines = [f"  {name}: {', '.join(map(str, classes[name]))}" for name in unresolved]
+            raise CommandError('Unknown CSS classes:\n' + '\n'.join(lines))
+
+        current = OUTPUT.read_text(encoding='utf-8') if OUTPUT.exists() else None
+        relative = OUTPUT.relative_to(settings.BASE_DIR)
+        if options['check']:
+            if current != css:
+                raise CommandError(f'{relative} is out of date, run manage.py build_css')
+        elif current != css:
+            OUTPUT.parent.mkdir(parents=True, exist_ok=True)
+            OUTPUT.write_text(css, encoding='utf-8')
+
+        # The same hash collectstatic puts in the name (ManifestStaticFilesStorage).
+        digest = hashlib.md5(css.encode(), usedforsecurity=False).hexdigest()[:12]
+        self.stdout.write(self.style.SUCCESS(
+            f'{relative}: {len(classes)} classes, {len(css.encode())} bytes, '
+            f'site.{digest}.css, in {time.monotonic() - started:.2f}s'
+        ))
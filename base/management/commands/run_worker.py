@@ -0,0 +1,92 @@
+import signal
+import threading
+import time
+from collections import Counter
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from base import jobs
+
+# Seconds between purges of old finished jobs.
+PURGE_INTERVAL = 60 * 10
+
+
+class Command(BaseCommand):
+    help = (
+        'Run queued background jobs (base.jobs) with a pool of threads until stopped; '
+        'start more processes to scale out'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2, help='Jobs run at the same time')
+        parser.add_argument('--name', nargs='+', dest='names', metavar='NAME', help='Only run jobs with these names')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is due')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument(
+            '--visibility', type=int, default=jobs.JOBS_VISIBILITY_TIMEOUT,
+            help='Seconds a claimed job is leased before another worker may retry it',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if isinstance(caches['default'], LocMemCache):
+            # Jobs warm and invalidate cached pages and images; a cache
+            # private to this process hides all of it from the web servers.
+            self.stderr.write(self.style.WARNING(
+                'The default cache is local to this process: pages warmed and invalidated by jobs '
+                'never reach the web servers. Set CACHE_LOCATION to a cache they share.'
+            ))
+        jobs.load_handlers()
+        stop = threading.Event()
+        counts = Counter()
+        lock = threading.Lock()
+
+        def shutdown(signum, frame):
+            # Running jobs finish; nothing new is claimed.
+            stop.set()
+
+        previous = {signum: signal.signal(signum, shutdown) for signum in (signal.SIGINT, signal.SIGTERM)}
+
+        def work():
+            try:
+                while not stop.is_set():
+                    job = jobs.claim(options['names'], options['visibility'])
+                    if job is None:
+                        if options['once']:
+                            return
+                        stop.wait(options['poll'])
+                        continue
+                    succeeded = jobs.run(job)
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f"{job} {'done' if succeeded else 'failed'}")
+                    with lock:
+                        counts['ran'] += 1
+                        counts['failed'] += not succeeded
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=work, name=f'worker-{n}') for n in range(max(options['threads'], 1))]
+        for thread in threads:
+            thread.start()
+
+        try:
+            purged = jobs.purge()
+            last_purge = time.monotonic()
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=1)
+                if time.monotonic() - last_purge > PURGE_INTERVAL:
+                    purged += jobs.purge()
+                    last_purge = time.monotonic()
+        finally:
+            stop.set()
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Ran {counts['ran']} jobs ({counts['failed']} failed), purged {purged} "
+            f'in {time.monotonic() - started:.2f}s'
+        ))
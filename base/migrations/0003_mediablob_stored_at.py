@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0002_mediablob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediablob',
+            name='stored_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
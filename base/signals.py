@@ -0,0 +1,35 @@
+from collections import Counter
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import blobs
+from .utils import STORED_ROW_ATTR
+
+
+# Connected before every other pre_save receiver (base is installed before
+# item), so a save never sees the row loaded for an earlier one.
+@receiver(pre_save)
+def forget_stored_row(sender, instance, **kwargs):
+    instance.__dict__.pop(STORED_ROW_ATTR, None)
+
+
+@receiver(pre_save)
+def remember_blob_names(sender, instance, raw=False, **kwargs):
+    fields = blobs.blob_fields(sender)
+    if fields:
+        instance._stored_blob_names = None if raw else blobs.stored_names(instance, fields)
+
+
+@receiver(post_save)
+def count_blob_references(sender, instance, raw=False, **kwargs):
+    fields = blobs.blob_fields(sender)
+    if fields and not raw:
+        blobs.move_references(getattr(instance, '_stored_blob_names', None) or Counter(), blobs.referenced_names(instance, fields))
+
+
+@receiver(post_delete)
+def uncount_blob_references(sender, instance, **kwargs):
+    fields = blobs.blob_fields(sender)
+    if fields:
+        blobs.move_references(blobs.referenced_names(instance, fields), Counter())
@@ -0,0 +1,495 @@
+"""
+Stylesheet of the site, built offline by ``manage.py build_css``.
+
+The templates are styled with Tailwind-style utility classes. ``collect()``
+finds every class the pages can render: ``class`` attributes of the base and
+item templates, class arguments of template tags (``css_class='...'``),
+``classList`` calls of their inline scripts and the widget classes of the
+forms. ``build()`` resolves each one with the rules below into a minimal
+stylesheet, in Tailwind's cascade order; a class no rule resolves is
+reported, and the command fails, rather than rendering unstyled.
+
+The result is written to ``base/static/css/site.css``. collectstatic gives
+it a content hash in production (CompressedManifestStaticFilesStorage) and
+WhiteNoise serves it compressed with far-future caching.
+"""
+import re
+from collections import namedtuple
+from pathlib import Path
+
+from django.apps import apps
+
+APPS = ('base', 'item')
+OUTPUT = Path(__file__).resolve().parent / 'static' / 'css' / 'site.css'
+
+# Classes without styles of their own, used as JavaScript hooks.
+HOOK_CLASSES = frozenset({'image-thumbnail', 'load-more'})
+
+SCREENS = {'sm': 640, 'md': 768, 'lg': 1024, 'xl': 1280, '2xl': 1536}
+STATES = {'hover': ':hover', 'focus': ':focus', 'active': ':active', 'disabled': ':disabled'}
+
+SPACING_KEYS = frozenset(
+    ['0', '0.5', '1', '1.5', '2', '2.5', '3', '3.5']
+    + [str(n) for n in range(4, 13)]
+    + [str(n) for n in (14, 16, 20, 24, 28, 32, 36, 40, 44, 48, 52, 56, 60, 64, 72, 80, 96)]
+)
+
+PALETTE = {
+    'gray': ('#f9fafb', '#f3f4f6', '#e5e7eb', '#d1d5db', '#9ca3af', '#6b7280', '#4b5563', '#374151', '#1f2937', '#111827', '#030712'),
+    'red': ('#fef2f2', '#fee2e2', '#fecaca', '#fca5a5', '#f87171', '#ef4444', '#dc2626', '#b91c1c', '#991b1b', '#7f1d1d', '#450a0a'),
+    'yellow': ('#fefce8', '#fef9c3', '#fef08a', '#fde047', '#facc15', '#eab308', '#ca8a04', '#a16207', '#854d0e', '#713f12', '#422006'),
+    'green': ('#f0fdf4', '#dcfce7', '#bbf7d0', '#86efac', '#4ade80', '#22c55e', '#16a34a', '#15803d', '#166534', '#14532d', '#052e16'),
+    'teal': ('#f0fdfa', '#ccfbf1', '#99f6e4', '#5eead4', '#2dd4bf', '#14b8a6', '#0d9488', '#0f766e', '#115e59', '#134e4a', '#042f2e'),
+    'blue': ('#eff6ff', '#dbeafe', '#bfdbfe', '#93c5fd', '#60a5fa', '#3b82f6', '#2563eb', '#1d4ed8', '#1e40af', '#1e3a8a', '#172554'),
+}
+SHADES = ('50', '100', '200', '300', '400', '500', '600', '700', '800', '900', '950')
+
+FONT_SIZES = {
+    'xs': ('0.75rem', '1rem'), 'sm': ('0.875rem', '1.25rem'), 'base': ('1rem', '1.5rem'),
+    'lg': ('1.125rem', '1.75rem'), 'xl': ('1.25rem', '1.75rem'), '2xl': ('1.5rem', '2rem'),
+    '3xl': ('1.875rem', '2.25rem'), '4xl': ('2.25rem', '2.5rem'),
+}
+RADII = {
+    '': '0.25rem', 'none': '0px', 'sm': '0.125rem', 'md': '0.375rem', 'lg': '0.5rem',
+    'xl': '0.75rem', '2xl': '1rem', '3xl': '1.5rem', 'full': '9999px',
+}
+CORNERS = {'t': ('top-left', 'top-right'), 'r': ('top-right', 'bottom-right'), 'b': ('bottom-right', 'bottom-left'), 'l': ('top-left', 'bottom-left')}
+SIDES = {'t': ('top',), 'r': ('right',), 'b': ('bottom',), 'l': ('left',), 'x': ('left', 'right'), 'y': ('top', 'bottom'), '': ('',)}
+MAX_WIDTHS = {
+    'none': 'none', 'xs': '20rem', 'sm': '24rem', 'md': '28rem', 'lg': '32rem', 'xl': '36rem',
+    '2xl': '42rem', '3xl': '48rem', '4xl': '56rem', '5xl': '64rem', '6xl': '72rem', '7xl': '80rem',
+    'full': '100%', **{f'screen-{name}': f'{width}px' for name, width in SCREENS.items()},
+}
+SHADOWS = {
+    'sm': '0 1px 2px 0 rgb(0 0 0 / 0.05)',
+    '': '0 1px 3px 0 rgb(0 0 0 / 0.1), 0 1px 2px -1px rgb(0 0 0 / 0.1)',
+    'md': '0 4px 6px -1px rgb(0 0 0 / 0.1), 0 2px 4px -2px rgb(0 0 0 / 0.1)',
+    'lg': '0 10px 15px -3px rgb(0 0 0 / 0.1), 0 4px 6px -4px rgb(0 0 0 / 0.1)',
+    'xl': '0 20px 25px -5px rgb(0 0 0 / 0.1), 0 8px 10px -6px rgb(0 0 0 / 0.1)',
+    'none': '0 0 #0000',
+}
+TRANSITIONS = {
+    '': 'color, background-color, border-color, text-decoration-color, fill, stroke, opacity, box-shadow, transform, filter, backdrop-filter',
+    'all': 'all',
+    'colors': 'color, background-color, border-color, text-decoration-color, fill, stroke',
+    'opacity': 'opacity',
+    'shadow': 'box-shadow',
+    'transform': 'transform',
+}
+TRANSFORM = 'transform:translate(var(--tw-translate-x), var(--tw-translate-y))'
+
+# Condensed Tailwind preflight: the reset the utilities are designed against.
+PREFLIGHT = """\
+*,::before,::after{box-sizing:border-box;border-width:0;border-style:solid;border-color:#e5e7eb;--tw-translate-x:0;--tw-translate-y:0}
+html{line-height:1.5;-webkit-text-size-adjust:100%;tab-size:4;font-family:ui-sans-serif,system-ui,sans-serif,"Apple Color Emoji","Segoe UI Emoji","Segoe UI Symbol","Noto Color Emoji"}
+body{margin:0;line-height:inherit}
+hr{height:0;color:inherit;border-top-width:1px}
+h1,h2,h3,h4,h5,h6{font-size:inherit;font-weight:inherit}
+a{color:inherit;text-decoration:inherit}
+b,strong{font-weight:bolder}
+small{font-size:80%}
+button,input,optgroup,select,textarea{font-family:inherit;font-size:100%;font-weight:inherit;line-height:inherit;color:inherit;margin:0;padding:0}
+button,select{text-transform:none}
+button,[type='button'],[type='reset'],[type='submit']{-webkit-appearance:button;background-color:transparent;background-image:none}
+blockquote,dl,dd,h1,h2,h3,h4,h5,h6,hr,figure,p,pre{margin:0}
+fieldset{margin:0;padding:0}
+legend{padding:0}
+ol,ul,menu{list-style:none;margin:0;padding:0}
+textarea{resize:vertical}
+input::placeholder,textarea::placeholder{opacity:1;color:#9ca3af}
+button,[role="button"]{cursor:pointer}
+:disabled{cursor:default}
+img,svg,video,canvas,audio,iframe,embed,object{display:block;vertical-align:middle}
+img,video{max-width:100%;height:auto}
+[hidden]{display:none}
+"""
+
+# (pattern, resolve, selector suffix): resolve(match) returns the
+# declarations, or None when the value is not on the scale.
+Rule = namedtuple('Rule', 'pattern resolve suffix')
+
+Class = namedtuple('Class', 'name utility screen state rule order declarations')
+
+
+def _fraction(value):
+    numerator, _, denominator = value.partition('/')
+    if not (numerator.isdigit() and denominator.isdigit()) or not 0 < int(numerator) < int(denominator):
+        return None
+    return f'{int(numerator) / int(denominator) * 100:.6f}'.rstrip('0').rstrip('.') + '%'
+
+
+def spacing(value, negative=False):
+    if value == 'px':
+        size = '1px'
+    elif value in SPACING_KEYS:
+        size = f'{float(value) / 4:g}rem' if value != '0' else '0px'
+    else:
+        return None
+    return f'-{size}' if negative and size != '0px' else size
+
+
+def _length(value, extra=None, negative=False):
+    if extra and value in extra:
+        return extra[value]
+    if '/' in value:
+        size = _fraction(value)
+        return size and (f'-{size}' if negative else size)
+    return spacing(value, negative)
+
+
+def color(value):
+    """``(r, g, b)`` of a palette color such as ``teal-500``, or None."""
+    if value == 'white':
+        return (255, 255, 255)
+    if value == 'black':
+        return (0, 0, 0)
+    family, _, shade = value.rpartition('-')
+    if family not in PALETTE or shade not in SHADES:
+        return None
+    hex_value = PALETTE[family][SHADES.index(shade)]
+    return tuple(int(hex_value[i:i + 2], 16) for i in (1, 3, 5))
+
+
+def _color(prop, variable):
+    def resolve(match):
+        value = match.group(1)
+        if value in ('transparent', 'current'):
+            return [f"{prop}:{'currentColor' if value == 'current' else value}"]
+        rgb = color(value)
+        if rgb is None:
+            return None
+        return [f'{variable}:1', f"{prop}:rgb({' '.join(map(str, rgb))} / var({variable}))"]
+    return resolve
+
+
+def _opacity(variable):
+    def resolve(match):
+        value = int(match.group(1))
+        if value > 100 or value % 5:
+            return None
+        return [f'{variable}:{value / 100:g}']
+    return resolve
+
+
+def _sides(prefix, prop):
+    def resolve(match):
+        negative, side, value = match.group(1), match.group(2), match.group(3)
+        size = 'auto' if value == 'auto' and not negative else spacing(value, bool(negative))
+        if size is None:
+            return None
+        return [f'{prop}-{name}:{size}' if name else f'{prop}:{size}' for name in SIDES[side]]
+    return Rule(re.compile(rf'(-?){prefix}(x|y|t|r|b|l|)-(.+)'), resolve, '')
+
+
+def _static(classes):
+    """Rule for a fixed set of classes; they keep their order in ``classes``."""
+    return Rule(classes, None, '')
+
+
+def _inset(match):
+    negative, side, value = match.groups()
+    size = _length(value, {'auto': 'auto', 'full': '100%'}, bool(negative))
+    if size is None:
+        return None
+    names = {'inset': ('top', 'right', 'bottom', 'left'), 'inset-x': ('left', 'right'), 'inset-y': ('top', 'bottom')}
+    return [f'{name}:{size}' for name in names.get(side, (side,))]
+
+
+def _span(match):
+    value = match.group(1)
+    if value == 'full':
+        return ['grid-column:1 / -1']
+    return [f'grid-column:span {value} / span {value}']
+
+
+def _size(prop, extra):
+    def resolve(match):
+        size = _length(match.group(1), extra)
+        return size and [f'{prop}:{size}']
+    return resolve
+
+
+def _translate(match):
+    negative, axis, value = match.groups()
+    size = _length(value, {'full': '100%'}, bool(negative))
+    return size and [f'--tw-translate-{axis}:{size}', TRANSFORM]
+
+
+def _gap(match):
+    axis, value = match.groups()
+    size = spacing(value)
+    return size and [f"{ {None: 'gap', 'x': 'column-gap', 'y': 'row-gap'}[axis]}:{size}"]
+
+
+def _space(match):
+    axis, value = match.groups()
+    size = spacing(value)
+    return size and [f"margin-{'left' if axis == 'x' else 'top'}:{size}"]
+
+
+def _rounded(match):
+    side, size = match.group(1) or '', match.group(2) or ''
+    if size not in RADII:
+        return None
+    if not side:
+        return [f'border-radius:{RADII[size]}']
+    return [f'border-{corner}-radius:{RADII[size]}' for corner in CORNERS[side]]
+
+
+def _border_width(match):
+    side, width = match.group(1) or '', match.group(2)
+    width = f'{width}px' if width else '1px'
+    if not side:
+        return [f'border-width:{width}']
+    return [f"border-{ {'t': 'top', 'r': 'right', 'b': 'bottom', 'l': 'left'}[side]}-width:{width}"]
+
+
+def _font_size(match):
+    size, line_height = FONT_SIZES[match.group(1)]
+    return [f'font-size:{size}', f'line-height:{line_height}']
+
+
+def _keyed(prop, values):
+    def resolve(match):
+        value = values.get(match.group(1))
+        return value and [f'{prop}:{value}']
+    return resolve
+
+
+def _shadow(match):
+    shadow = SHADOWS.get(match.group(1) or '')
+    return shadow and [f'box-shadow:{shadow}']
+
+
+def _transition(match):
+    properties = TRANSITIONS.get(match.group(1) or '')
+    if properties is None:
+        return None
+    return [
+        f'transition-property:{properties}',
+        'transition-timing-function:cubic-bezier(0.4, 0, 0.2, 1)',
+        'transition-duration:150ms',
+    ]
+
+
+# In Tailwind's order: a later rule wins over an earlier one on the same element.
+RULES = (
+    _static({
+        'scrollbar-hide': ['-ms-overflow-style:none', 'scrollbar-width:none'],
+    }),
+    _static({
+        'pointer-events-none': ['pointer-events:none'],
+        'pointer-events-auto': ['pointer-events:auto'],
+    }),
+    _static({name: [f'position:{name}'] for name in ('static', 'fixed', 'absolute', 'relative', 'sticky')}),
+    Rule(re.compile(r'(-?)(inset-x|inset-y|inset|top|right|bottom|left)-(.+)'), _inset, ''),
+    Rule(re.compile(r'col-span-(\d+|full)'), _span, ''),
+    _sides('m', 'margin'),
+    _static({
+        'block': ['display:block'],
+        'inline-block': ['display:inline-block'],
+        'inline': ['display:inline'],
+        'flex': ['display:flex'],
+        'inline-flex': ['display:inline-flex'],
+        'grid': ['display:grid'],
+        'contents': ['display:contents'],
+        'hidden': ['display:none'],
+    }),
+    Rule(re.compile(r'h-(.+)'), _size('height', {'auto': 'auto', 'full': '100%', 'screen': '100vh'}), ''),
+    Rule(re.compile(r'max-h-(.+)'), _size('max-height', {'none': 'none', 'full': '100%', 'screen': '100vh'}), ''),
+    Rule(re.compile(r'min-h-(.+)'), _size('min-height', {'full': '100%', 'screen': '100vh'}), ''),
+    Rule(re.compile(r'w-(.+)'), _size('width', {'auto': 'auto', 'full': '100%', 'screen': '100vw'}), ''),
+    Rule(re.compile(r'max-w-(.+)'), _keyed('max-width', MAX_WIDTHS), ''),
+    _static({
+        'flex-1': ['flex:1 1 0%'],
+        'flex-auto': ['flex:1 1 auto'],
+        'flex-none': ['flex:none'],
+        'flex-shrink-0': ['flex-shrink:0'],
+        'shrink-0': ['flex-shrink:0'],
+        'flex-grow': ['flex-grow:1'],
+        'grow': ['flex-grow:1'],
+    }),
+    Rule(re.compile(r'(-?)translate-(x|y)-(.+)'), _translate, ''),
+    _static({'transform': [TRANSFORM]}),
+    _static({
+        'cursor-pointer': ['cursor:pointer'],
+        'cursor-default': ['cursor:default'],
+        'cursor-not-allowed': ['cursor:not-allowed'],
+    }),
+    Rule(re.compile(r'grid-cols-(\d+)'), lambda match: [f'grid-template-columns:repeat({match.group(1)}, minmax(0, 1fr))'], ''),
+    _static({
+        'flex-row': ['flex-direction:row'],
+        'flex-row-reverse': ['flex-direction:row-reverse'],
+        'flex-col': ['flex-direction:column'],
+        'flex-col-reverse': ['flex-direction:column-reverse'],
+        'flex-wrap': ['flex-wrap:wrap'],
+        'flex-nowrap': ['flex-wrap:nowrap'],
+    }),
+    _static({
+        f'items-{name}': [f'align-items:{value}']
+        for name, value in (('start', 'flex-start'), ('end', 'flex-end'), ('center', 'center'), ('baseline', 'baseline'), ('stretch', 'stretch'))
+    }),
+    _static({
+        f'justify-{name}': [f'justify-content:{value}']
+        for name, value in (
+            ('start', 'flex-start'), ('end', 'flex-end'), ('center', 'center'),
+            ('between', 'space-between'), ('around', 'space-around'), ('evenly', 'space-evenly'),
+        )
+    }),
+    Rule(re.compile(r'gap-(?:([xy])-)?(.+)'), _gap, ''),
+    Rule(re.compile(r'space-(x|y)-(.+)'), _space, ' > :not([hidden]) ~ :not([hidden])'),
+    _static({
+        f'overflow-{axis}{value}': [f"overflow{'-' + axis[:-1] if axis else ''}:{value}"]
+        for axis in ('', 'x-', 'y-') for value in ('auto', 'hidden', 'scroll', 'visible')
+    }),
+    _static({'truncate': ['overflow:hidden', 'text-overflow:ellipsis', 'white-space:nowrap']}),
+    Rule(re.compile(r'rounded(?:-([trbl]))?(?:-(.+))?'), _rounded, ''),
+    Rule(re.compile(r'border(?:-([trbl]))?(?:-(\d))?'), _border_width, ''),
+    Rule(re.compile(r'border-(.+)'), _color('border-color', '--tw-border-opacity'), ''),
+    Rule(re.compile(r'bg-(.+)'), _color('background-color', '--tw-bg-opacity'), ''),
+    Rule(re.compile(r'bg-opacity-(\d+)'), _opacity('--tw-bg-opacity'), ''),
+    _static({'object-cover': ['object-fit:cover'], 'object-contain': ['object-fit:contain']}),
+    _sides('p', 'padding'),
+    _static({f'text-{name}': [f'text-align:{name}'] for name in ('left', 'center', 'right', 'justify')}),
+    Rule(re.compile(rf"text-({'|'.join(FONT_SIZES)})"), _font_size, ''),
+    _static({
+        f'font-{name}': [f'font-weight:{weight}']
+        for name, weight in (('normal', 400), ('medium', 500), ('semibold', 600), ('bold', 700))
+    }),
+    Rule(re.compile(r'text-(.+)'), _color('color', '--tw-text-opacity'), ''),
+    Rule(re.compile(r'text-opacity-(\d+)'), _opacity('--tw-text-opacity'), ''),
+    _static({'underline': ['text-decoration-line:underline'], 'no-underline': ['text-decoration-line:none']}),
+    Rule(re.compile(r'opacity-(\d+)'), _opacity('opacity'), ''),
+    Rule(re.compile(r'shadow(?:-(.+))?'), _shadow, ''),
+    Rule(re.compile(r'transition(?:-(.+))?'), _transition, ''),
+)
+
+# Extra rule emitted after a class: (selector suffix, declarations).
+EXTRA_RULES = {
+    'scrollbar-hide': ('::-webkit-scrollbar', ['display:none']),
+}
+
+
+def resolve(name):
+    """Parse a class such as ``sm:hover:bg-teal-700`` into a ``Class``, or None."""
+    *variants, utility = name.split(':')
+    screen = state = None
+    for variant in variants:
+        # Screen first, then state, each at most once.
+        if variant in SCREENS and screen is None and state is None:
+            screen = variant
+        elif variant in STATES and state is None:
+            state = variant
+        else:
+            return None
+    for index, rule in enumerate(RULES):
+        if rule.resolve is None:
+            if utility in rule.pattern:
+                order = list(rule.pattern).index(utility)
+                return Class(name, utility, screen, state, index, order, rule.pattern[utility])
+            continue
+        match = rule.pattern.fullmatch(utility)
+        if match:
+            declarations = rule.resolve(match)
+            if declarations:
+                return Class(name, utility, screen, state, index, 0, declarations)
+    return None
+
+
+def escape(name):
+    return re.sub(r'([^\w-])', r'\\\1', name)
+
+
+def build(classes):
+    """
+    Return ``(css, unresolved)`` for an iterable of class names; hook
+    classes are accepted and produce no rules.
+    """
+    resolved = []
+    unresolved = []
+    for name in sorted(set(classes)):
+        if name in HOOK_CLASSES:
+            continue
+        parsed = resolve(name)
+        if parsed is None:
+            unresolved.append(name)
+        else:
+            resolved.append(parsed)
+
+    # Base classes, then each screen upwards; states after plain classes.
+    screens = list(SCREENS)
+    resolved.sort(key=lambda parsed: (
+        -1 if parsed.screen is None else screens.index(parsed.screen),
+        parsed.state is not None, parsed.rule, parsed.order, parsed.name,
+    ))
+
+    lines = ['/* Generated by manage.py build_css from the templates; do not edit. */', PREFLIGHT.rstrip('\n')]
+    current = None
+    for parsed in resolved:
+        if parsed.screen != current:
+            if current is not None:
+                lines.append('}')
+            lines.append(f'@media (min-width:{SCREENS[parsed.screen]}px){{')
+            current = parsed.screen
+        selector = '.' + escape(parsed.name) + (STATES[parsed.state] if parsed.state else '')
+        lines.append(f"{selector}{RULES[parsed.rule].suffix}{{{';'.join(parsed.declarations)}}}")
+        if parsed.utility in EXTRA_RULES:
+            suffix, declarations = EXTRA_RULES[parsed.utility]
+            lines.append(f"{selector}{suffix}{{{';'.join(declarations)}}}")
+    if current is not None:
+        lines.append('}')
+    return '\n'.join(lines) + '\n', unresolved
+
+
+TAG = re.compile(r'\{%.*?%\}|\{\{.*?\}\}|\{#.*?#\}', re.S)
+CLASS_ATTRIBUTE = re.compile(r'''\bclass\s*=\s*(?:"([^"]*)"|'([^']*)')''')
+TAG_CLASS_ARGUMENT = re.compile(r'''\b\w*class=((?:'[^']*'|"[^"]*"|[^\s'"])+)''')
+SCRIPT_CLASS_LIST = re.compile(r'classList\.(?:add|remove|toggle|contains|replace)\(([^)]*)\)')
+PYTHON_CLASS = re.compile(r'''(?:['"]class['"]\s*:\s*|^\s*\w*CLASS(?:ES)?\s*=\s*)(?:'([^']*)'|"([^"]*)")''', re.M)
+LITERAL = re.compile(r''''([^']*)'|"([^"]*)"''')
+
+
+def _add(found, value, offset, text, path):
+    for token in re.finditer(r'\S+', value):
+        line = text.count('\n', 0, offset + token.start()) + 1
+        found.setdefault(token.group(), []).append(f'{path}:{line}')
+
+
+def scan_template(text, path, found):
+    # Tags are blanked out, not removed, so offsets still give line numbers.
+    blanked = TAG.sub(lambda match: re.sub(r'\S', ' ', match.group()), text)
+    for match in CLASS_ATTRIBUTE.finditer(blanked):
+        group = 1 if match.group(1) is not None else 2
+        _add(found, match.group(group), match.start(group), text, path)
+    for tag in TAG.finditer(text):
+        for argument in TAG_CLASS_ARGUMENT.finditer(tag.group()):
+            _scan_literals(argument.group(1), tag.start() + argument.start(1), text, path, found)
+    for call in SCRIPT_CLASS_LIST.finditer(text):
+        _scan_literals(call.group(1), call.start(1), text, path, found)
+
+
+def _scan_literals(source, offset, text, path, found):
+    for literal in LITERAL.finditer(source):
+        group = 1 if literal.group(1) is not None else 2
+        _add(found, literal.group(group), offset + literal.start(group), text, path)
+
+
+def scan_python(text, path, found):
+    for match in PYTHON_CLASS.finditer(text):
+        group = 1 if match.group(1) is not None else 2
+        _add(found, match.group(group), match.start(group), text, path)
+
+
+def collect(app_labels=APPS):
+    """Return ``{class: [location, ...]}`` for every class the apps can render."""
+    found = {}
+    for label in app_labels:
+        root = Path(apps.get_app_config(label).path)
+        for path in sorted((root / 'templates').rglob('*.html')):
+            scan_template(path.read_text(encoding='utf-8'), path.relative_to(root.parent), found)
+        for path in sorted(root.rglob('*.py')):
+            relative = path.relative_to(root)
+            if relative.parts[0] in ('migrations', 'management') or relative.name == 'tests.py':
+                continue
+            scan_python(path.read_text(encoding='utf-8'), path.relative_to(root.parent), found)
+    return found
@@ -1,3 +1,176 @@
-from django.test import TestCase
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from base import blobs, jobs
+from base.models import Job, MediaBlob
+from base.stylesheet import build, scan_python, scan_template
+from ghandyStore.media import is_hashed
+from item.models import Category, Item, ItemColor, ItemColorImage
+
+calls = []
+
+
+@jobs.register('test.record')
+def record(value):
+    calls.append(value)
+
+
+@jobs.register('test.fail')
+def fail():
+    raise ValueError('broken')
+
+
+class BuildCSSTests(SimpleTestCase):
+    def test_stylesheet_is_up_to_date(self):
+        # Fails when a template uses a class that was not built or cannot be resolved.
+        call_command('build_css', check=True, stdout=StringIO())
+
+    def test_scans_attributes_tag_arguments_and_scripts(self):
+        found = {}
+        scan_template(
+            '<div class="p-4 {% if a == "b" %}bg-white{% endif %}">\n'
+            "{% responsive_image image css_class='w-full '|add:extra_class %}\n"
+            "{% with image_class=image_class|default:'max-h-60' %}{% endwith %}\n"
+            "<script>el.classList.add('hidden', 'opacity-50');</script>",
+            'page.html', found,
+        )
+        scan_python("INPUT_CLASSES = 'rounded-xl border'\nattrs = {'class': 'py-4'}", 'forms.py', found)
+        self.assertEqual(
+            set(found),
+            {'p-4', 'bg-white', 'w-full', 'max-h-60', 'hidden', 'opacity-50', 'rounded-xl', 'border', 'py-4'},
+        )
+        self.assertEqual(found['max-h-60'], ['page.html:3'])
+
+    def test_build(self):
+        css, unresolved = build(['sm:hover:bg-teal-700', 'p-4', 'px-6', '-translate-y-1/2', 'load-more', 'bg-tael-500', 'sm:p-13'])
+        self.assertEqual(unresolved, ['bg-tael-500', 'sm:p-13'])
+        self.assertIn('.p-4{padding:1rem}', css)
+        self.assertIn('.-translate-y-1\\/2{--tw-translate-y:-50%;', css)
+        self.assertIn(
+            '@media (min-width:640px){\n.sm\\:hover\\:bg-teal-700:hover{--tw-bg-opacity:1;'
+            'background-color:rgb(15 118 110 / var(--tw-bg-opacity))}\n}',
+            css,
+        )
+        # Later rules win: px-* comes after p-*.
+        self.assertLess(css.index('.p-4{'), css.index('.px-6{'))
+        self.assertNotIn('load-more', css)
+
+
+class JobTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_dedup_key_merges_queued_jobs(self):
+        self.assertIsNotNone(jobs.enqueue('test.record', {'value': 1}, dedup_key='one'))
+        self.assertIsNone(jobs.enqueue('test.record', {'value': 2}, dedup_key='one'))
+        self.assertEqual(Job.objects.filter(name='test.record').count(), 1)
+
+        job = jobs.claim(['test.record'])
+        # Once the job has started, changes need another run.
+        self.assertIsNotNone(jobs.enqueue('test.record', {'value': 3}, dedup_key='one'))
+        self.assertTrue(jobs.run(job))
+        self.assertEqual(calls, [1])
+        self.assertEqual(jobs.run_pending(['test.record']), (1, 0))
+        self.assertEqual(calls, [1, 3])
+
+    def test_failures_are_retried_with_backoff(self):
+        job = jobs.enqueue('test.fail', max_attempts=2)
+        with self.assertLogs('base.jobs', 'WARNING'):
+            self.assertEqual(jobs.run_pending(['test.fail']), (1, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('ValueError: broken', job.last_error)
+        # Not due yet.
+        self.assertEqual(jobs.run_pending(['test.fail']), (0, 0))
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('base.jobs', 'ERROR'):
+            self.assertEqual(jobs.run_pending(['test.fail']), (1, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_expired_lease_is_claimed_again(self):
+        jobs.enqueue('test.record', {'value': 1})
+        first = jobs.claim(['test.record'])
+        self.assertIsNone(jobs.claim(['test.record']))
+
+        Job.objects.filter(pk=first.pk).update(run_at=timezone.now() - timedelta(seconds=1))
+        second = jobs.claim(['test.record'])
+        self.assertEqual((second.pk, second.attempts), (first.pk, 2))
+        # The first worker lost its lease and cannot record the outcome.
+        jobs.run(first)
+        self.assertEqual(Job.objects.get(pk=first.pk).status, Job.RUNNING)
+        self.assertTrue(jobs.run(second))
+        self.assertEqual(Job.objects.get(pk=first.pk).status, Job.DONE)
+
+    def test_catalog_edits_queue_one_warm_job(self):
+        Category.objects.create(name='Shirts')
+        Category.objects.create(name='Shoes')
+        self.assertEqual(Job.objects.filter(name='item.warm_catalog', status=Job.QUEUED).count(), 1)
+        Job.objects.update(run_at=timezone.now())
+        self.assertEqual(jobs.run_pending(['item.warm_catalog']), (1, 0))
+        self.assertEqual(self.client.get('/items/')['X-Page-Cache'], 'hit')
+
+
+class RunWorkerTests(TransactionTestCase):
+    def test_runs_due_jobs_and_exits(self):
+        calls.clear()
+        for value in range(5):
+            jobs.enqueue('test.record', {'value': value})
+        jobs.enqueue('test.record', {'value': 'later'}, delay=60)
+        out, err = StringIO(), StringIO()
+        call_command('run_worker', once=True, threads=2, names=['test.record'], stdout=out, stderr=err)
+        self.assertIn('Ran 5 jobs (0 failed)', out.getvalue())
+        self.assertIn('CACHE_LOCATION', err.getvalue())
+        self.assertEqual(sorted(calls), [0, 1, 2, 3, 4])
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 5)
+
+
+class MediaBlobTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.media_root = media_root.name
+        user = User.objects.create_user('staff')
+        self.item = Item.objects.create(category=Category.objects.create(name='Shirts'), name='Shirt', price=10, created_by=user)
+        self.color = ItemColor.objects.create(item=self.item, name='red')
+
+    def refcounts(self):
+        return dict(MediaBlob.objects.values_list('name', 'refcount'))
+
+    def test_identical_uploads_share_one_blob(self):
+        self.item.image = SimpleUploadedFile('shirt.jpg', b'same bytes')
+        self.item.save()
+        image = ItemColorImage.objects.create(color=self.color, image=SimpleUploadedFile('IMG_001.JPG', b'same bytes'))
+        name = self.item.image.name
+        self.assertEqual(image.image.name, name)
+        self.assertTrue(is_hashed(name))
+        self.assertEqual(self.refcounts(), {name: 2})
+        self.assertEqual(
+            [files for _, _, files in os.walk(os.path.join(self.media_root, 'blobs')) if files], [[os.path.basename(name)]],
+        )
+
+        image.delete()
+        self.assertEqual(self.refcounts(), {name: 1})
+        self.item.image = SimpleUploadedFile('shirt.jpg', b'other bytes')
+        self.item.save()
+        self.item.save()
+        self.assertEqual(self.refcounts(), {name: 0, self.item.image.name: 1})
+
+    def test_recount_repairs_drift(self):
+        image = ItemColorImage.objects.create(color=self.color, image=SimpleUploadedFile('a.png', b'png'))
+        ItemColorImage.objects.bulk_create([ItemColorImage(color=self.color, image=image.image.name)] * 2)
+        MediaBlob.objects.all().delete()
+        self.assertEqual(blobs.recount(), 1)
+        self.assertEqual(self.refcounts(), {image.image.name: 3})
+        self.assertEqual(blobs.recount(), 0)
@@ -0,0 +1,32 @@
+from itertools import islice
+
+STORED_ROW_ATTR = '_stored_row'
+
+
+def batched(iterable, size):
+    """Yield lists of ``size`` items of ``iterable`` (the last one shorter), lazily."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def stored_values(instance, fields):
+    """
+    Stored values of ``fields`` (attnames) of the row of ``instance``, None
+    for new or vanished rows. Every pre_save receiver of one save shares a
+    single query: the first call loads the whole row and keeps it on the
+    instance until base.signals forgets it at the next save.
+    """
+    if instance._state.adding or instance.pk is None:
+        return None
+    row = getattr(instance, STORED_ROW_ATTR, None)
+    if row is None:
+        attnames = [field.attname for field in instance._meta.concrete_fields]
+        row = type(instance)._base_manager.filter(pk=instance.pk).values(*attnames).first() or {}
+        setattr(instance, STORED_ROW_ATTR, row)
+        # The receivers read the fields of a deferred instance (.only())
+        # too; fill them from the row instead of one query per field. save()
+        # has already limited its UPDATE to the loaded fields by now.
+        for attname in instance.get_deferred_fields() & row.keys():
+            instance.__dict__[attname] = row[attname]
+    return tuple(row[field] for field in fields) if row else None
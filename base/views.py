@@ -1,14 +1,19 @@
 from django.shortcuts import render, redirect
-from item.models import Category, Item
+from item.caching import cache_catalog_page
+from item import counters, refdata
+from item.views import catalog_page, more_url, page_variants
 from .forms import SignupForm
 
+@cache_catalog_page
 def index(request):
-    items = Item.objects.filter(is_sold=False)[0:9]
-    categories = Category.objects.all()
+    page = catalog_page(request, page_size=9)
+    categories = counters.with_items_count(refdata.categories())
 
     return render(request, 'base/index.html', {
         'categories': categories,
-        'items': items,
+        'items': page,
+        'image_variants': page_variants(*(item.image for item in page)),
+        'more_url': more_url(request, page),
     })
 
 def signup(request):
@@ -0,0 +1,117 @@
+"""
+Order contention benchmark: many threads submit orders for the same color
+through the in-process WSGI application, and the run checks that exactly
+``--stock`` orders succeed, the stock ends at zero and the color is sold out.
+
+    python benchmarks/contention.py --threads 16 --orders 20 --stock 100
+
+SQLite serializes writers on the whole database, so the numbers measure the
+reservation path rather than row-lock scalability; run against MySQL
+(DB_ENGINE=mysql, with an empty database) for that.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from run import WSGIRunner, percentile, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--orders', type=int, default=20, help='Orders submitted per thread')
+    parser.add_argument('--stock', type=int, default=100)
+    parser.add_argument('--debug', action='store_true')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(args, os.path.join(tmp, 'contention.sqlite3'))
+
+        from django.contrib.auth.models import User
+        from django.core.management import call_command
+        from django.db import connections
+        from django.urls import reverse
+
+        from item.models import Category, City, Item, ItemColor, ItemRequest, Place
+
+        call_command('migrate', verbosity=0)
+        user = User.objects.create_superuser('bench', 'bench@example.com', None)
+        item = Item.objects.create(category=Category.objects.create(name='Bench'), name='Contended', price=10, created_by=user)
+        color = ItemColor.objects.create(item=item, name='red', stock_quantity=args.stock)
+        place = Place.objects.create(city=City.objects.create(name='Damascus'), name='Center')
+        connections.close_all()
+
+        runner = WSGIRunner(user)
+        path = reverse('item:detail', args=[item.id])
+        data = {
+            'color': color.id, 'customer_name': 'Buyer', 'customer_phone': '0999999999',
+            'city': place.city_id, 'place': place.id,
+        }
+        results = []
+        lock = threading.Lock()
+        start = threading.Barrier(args.threads)
+
+        def buyer():
+            start.wait()
+            local = []
+            for _ in range(args.orders):
+                started = time.perf_counter()
+                try:
+                    status = runner('POST', path, data, False)
+                except Exception as exc:
+                    status = repr(exc)
+                local.append((status, (time.perf_counter() - started) * 1000))
+            connections.close_all()
+            with lock:
+                results.extend(local)
+
+        threads = [threading.Thread(target=buyer) for _ in range(args.threads)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        color.refresh_from_db()
+        item.refresh_from_db()
+        statuses = [status for status, _ms in results]
+        latencies = [ms for _status, ms in results]
+        report = {
+            'threads': args.threads,
+            'attempts': len(results),
+            'stock': args.stock,
+            'sold': statuses.count(302),
+            'rejected': statuses.count(200),
+            'errors': sorted({str(status) for status in statuses if status not in (200, 302)}),
+            'requests_saved': ItemRequest.objects.filter(color=color).count(),
+            'stock_left': color.stock_quantity,
+            'sold_out': color.is_sold_out,
+            'available_colors_count': item.available_colors_count,
+            'rps': round(len(results) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+        }
+
+    expected_sold = min(args.stock, report['attempts'])
+    report['correct'] = (
+        report['sold'] == expected_sold == report['requests_saved']
+        and report['stock_left'] == args.stock - expected_sold
+        and report['sold_out'] == (expected_sold == args.stock)
+        and not report['errors']
+    )
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+    sys.exit(0 if report['correct'] else 1)
+
+
+if __name__ == '__main__':
+    main()
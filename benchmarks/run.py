@@ -0,0 +1,311 @@
+"""
+Latency and throughput benchmarks of the main pages.
+
+Seeds a deterministic catalog (``seed_catalog``) into a fresh SQLite
+database, then requests every scenario through the Django test client and
+through the WSGI application called in-process, and writes a JSON report
+with p50/p95/p99 latency, throughput and query counts per scenario.
+
+    python benchmarks/run.py --items 2000 --output before.json
+    python benchmarks/run.py --compare before.json after.json
+
+Settings run in production mode (DEBUG off) against SQLite; pass --debug
+to benchmark the development settings instead.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+from urllib.parse import urlencode
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+HOST = 'ghandy.cloud'
+
+
+def setup_django(args, db_path):
+    os.environ['DB_ENGINE'] = 'sqlite'
+    os.environ['SQLITE_PATH'] = db_path
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'ghandyStore.settings'
+    os.environ['DJANGO_ENV'] = 'development' if args.debug else 'production'
+    # Production static files need a manifest; collect them next to the database.
+    os.environ['STATIC_ROOT'] = os.path.join(os.path.dirname(db_path), 'static')
+    # The benchmark counts queries itself; keep the sampling middleware out of the numbers.
+    os.environ.setdefault('REQUEST_METRICS_SAMPLE_RATE', '0')
+    sys.path.insert(0, str(BASE_DIR))
+    import django
+    django.setup()
+    if not args.debug:
+        from django.core.management import call_command
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def build_scenarios():
+    from django.urls import reverse
+
+    from item.models import Category, City, Item, ItemColor
+
+    item = Item.objects.filter(is_sold=False, colors__is_sold_out=False).order_by('id').first()
+    color = ItemColor.objects.filter(item=item, is_sold_out=False).order_by('id').first()
+    city = City.objects.filter(places__isnull=False).order_by('id').first()
+    place = city.places.order_by('id').first()
+    category = Category.objects.order_by('id').first()
+    word = item.name.split()[0]
+
+    order = {
+        'color': color.id, 'customer_name': 'Benchmark Customer', 'customer_phone': '0999999999',
+        'city': city.id, 'place': place.id,
+    }
+    scenarios = {
+        'index': ('GET', reverse('base:index'), None, False),
+        'items': ('GET', reverse('item:items'), None, False),
+        'items_query': ('GET', f"{reverse('item:items')}?{urlencode({'query': word})}", None, False),
+        'items_category': ('GET', f"{reverse('item:items')}?category={category.id}", None, False),
+        'items_query_category': ('GET', f"{reverse('item:items')}?{urlencode({'query': word, 'category': category.id})}", None, False),
+        'detail': ('GET', reverse('item:detail', args=[item.id]), None, False),
+        'detail_order': ('POST', reverse('item:detail', args=[item.id]), order, False),
+        'places': ('GET', reverse('item:get_places_by_city', args=[city.id]), None, False),
+    }
+    for model in ('item', 'itemcolor', 'itemcolorimage', 'itemrequest', 'city', 'place', 'category'):
+        scenarios[f'admin_{model}'] = ('GET', reverse(f'admin:item_{model}_changelist'), None, True)
+    return scenarios
+
+
+class ClientRunner:
+    name = 'client'
+
+    def __init__(self, user):
+        from django.test import Client
+        self.anonymous = Client(HTTP_HOST=HOST, HTTP_X_FORWARDED_PROTO='https')
+        self.staff = Client(HTTP_HOST=HOST, HTTP_X_FORWARDED_PROTO='https')
+        self.staff.force_login(user)
+
+    def __call__(self, method, path, data, staff):
+        client = self.staff if staff else self.anonymous
+        response = client.post(path, data) if method == 'POST' else client.get(path)
+        return response.status_code
+
+
+class WSGIRunner:
+    """Calls the WSGI application directly, the way a server would."""
+    name = 'wsgi'
+
+    def __init__(self, user):
+        from django.core.wsgi import get_wsgi_application
+        from django.test import Client
+        from django.utils.crypto import get_random_string
+
+        self.application = get_wsgi_application()
+        client = Client()
+        client.force_login(user)
+        self.session = client.cookies['sessionid'].value
+        self.csrf = get_random_string(32)
+
+    def __call__(self, method, path, data, staff):
+        path, _, query = path.partition('?')
+        body = urlencode(data).encode() if data else b''
+        cookies = [f'csrftoken={self.csrf}']
+        if staff:
+            cookies.append(f'sessionid={self.session}')
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'SERVER_NAME': HOST,
+            'SERVER_PORT': '443',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': HOST,
+            'HTTP_X_FORWARDED_PROTO': 'https',
+            'HTTP_ORIGIN': f'https://{HOST}',
+            'HTTP_COOKIE': '; '.join(cookies),
+            'HTTP_X_CSRFTOKEN': self.csrf,
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': 'https',
+            'wsgi.version': (1, 0),
+            'wsgi.multithread': False,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        status = []
+        result = self.application(environ, lambda s, headers, exc_info=None: status.append(s))
+        try:
+            for _chunk in result:
+                pass
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return int(status[0].split()[0])
+
+
+def measure(runner, scenario, iterations, warmup, cold_cache):
+    from django.core.cache import cache
+    from django.db import connection
+
+    method, path, data, staff = scenario
+    for _ in range(warmup):
+        runner(method, path, data, staff)
+
+    latencies = []
+    queries = []
+    statuses = set()
+    total = 0.0
+    for _ in range(iterations):
+        if cold_cache:
+            cache.clear()
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            started = time.perf_counter()
+            statuses.add(runner(method, path, data, staff))
+            elapsed = time.perf_counter() - started
+        total += elapsed
+        latencies.append(elapsed * 1000)
+        queries.append(counter.count)
+
+    return {
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'rps': round(iterations / total, 1) if total else None,
+        'queries': round(statistics.fmean(queries), 2),
+        'max_queries': max(queries),
+        'status': sorted(statuses),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(args, os.path.join(tmp, 'bench.sqlite3'))
+
+        import django
+        from django.contrib.auth.models import User
+        from django.core.management import call_command
+
+        call_command('migrate', verbosity=0)
+        sizes = {
+            'categories': args.categories, 'items': args.items, 'colors': args.colors, 'images': args.images,
+            'cities': args.cities, 'places': args.places, 'requests': args.requests,
+        }
+        call_command('seed_catalog', seed=args.seed, **sizes)
+
+        user = User.objects.get(username='seed')
+        scenarios = build_scenarios()
+        if args.only:
+            scenarios = {name: scenario for name, scenario in scenarios.items() if name in args.only}
+
+        results = {}
+        for runner_class in (ClientRunner, WSGIRunner):
+            if args.mode not in ('both', runner_class.name):
+                continue
+            runner = runner_class(user)
+            results[runner.name] = {}
+            for name, scenario in scenarios.items():
+                stats = measure(runner, scenario, args.iterations, args.warmup, args.cold_cache)
+                results[runner.name][name] = stats
+                print(
+                    f"{runner.name:6} {name:22} p50 {stats['p50_ms']:8.2f}ms  p95 {stats['p95_ms']:8.2f}ms  "
+                    f"p99 {stats['p99_ms']:8.2f}ms  {stats['rps']:8.1f} req/s  {stats['queries']:6.1f} queries"
+                )
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'debug': args.debug,
+            'cold_cache': args.cold_cache,
+            'iterations': args.iterations,
+            'warmup': args.warmup,
+            'seed': args.seed,
+            'sizes': sizes,
+        },
+        'results': results,
+    }
+
+
+def compare(old_path, new_path):
+    with open(old_path) as fh:
+        old = json.load(fh)
+    with open(new_path) as fh:
+        new = json.load(fh)
+    print(f"{old['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    for mode, scenarios in new['results'].items():
+        for name, stats in scenarios.items():
+            before = old['results'].get(mode, {}).get(name)
+            if before is None:
+                continue
+            change = (stats['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+            print(
+                f"{mode:6} {name:22} p50 {before['p50_ms']:8.2f} -> {stats['p50_ms']:8.2f}ms ({change:+6.1f}%)  "
+                f"p95 {before['p95_ms']:8.2f} -> {stats['p95_ms']:8.2f}ms  "
+                f"queries {before['queries']:.1f} -> {stats['queries']:.1f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two reports and exit')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    parser.add_argument('--mode', choices=('client', 'wsgi', 'both'), default='both')
+    parser.add_argument('--only', nargs='+', metavar='SCENARIO', help='Run only these scenarios')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--cold-cache', action='store_true', help='Clear the cache before every measured request')
+    parser.add_argument('--debug', action='store_true', help='Use the development settings (DEBUG on)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--colors', type=int, default=3)
+    parser.add_argument('--images', type=int, default=2)
+    parser.add_argument('--cities', type=int, default=14)
+    parser.add_argument('--places', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+        print(f'Report written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,8 @@
+from django.db.backends.mysql import base
+
+from ghandyStore.db.pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    def pool_check(self, connection):
+        connection.ping()
@@ -0,0 +1,180 @@
+"""
+A small thread-safe pool of raw DB-API connections, used by the pooled
+database backends in ghandyStore.db.backends.
+
+Django's request handling runs database code in threads (also under ASGI,
+where sync views run in a thread pool), so a lock and a condition variable
+are enough to share connections safely.
+"""
+import threading
+import time
+from collections import deque
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, connect, check=None, max_size=10, timeout=5.0, max_lifetime=600, check_after=30):
+        self.connect = connect
+        self.check = check
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+        self._idle = deque()  # (connection, created, released)
+        self._created = {}  # id(connection) -> created
+        self._size = 0
+        self._condition = threading.Condition()
+        self._stats = {'opened': 0, 'reused': 0, 'waited': 0, 'failed': 0, 'closed': 0}
+
+    def _open(self):
+        try:
+            connection = self.connect()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._stats['failed'] += 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._created[id(connection)] = time.monotonic()
+            self._stats['opened'] += 1
+        return connection
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        with self._condition:
+            self._created.pop(id(connection), None)
+            self._size -= 1
+            self._stats['closed'] += 1
+            self._condition.notify()
+
+    def _healthy(self, connection, created, released):
+        now = time.monotonic()
+        if self.max_lifetime and now - created > self.max_lifetime:
+            return False
+        if self.check and now - released > self.check_after:
+            try:
+                self.check(connection)
+            except Exception:
+                return False
+        return True
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        while True:
+            with self._condition:
+                if self._idle:
+                    connection, created, released = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                    connection = None
+                else:
+                    remaining = deadline - time.monotonic()
+                    if not waited:
+                        waited = True
+                        self._stats['waited'] += 1
+                    if remaining <= 0 or not self._condition.wait(remaining):
+                        if time.monotonic() >= deadline:
+                            self._stats['failed'] += 1
+                            raise PoolTimeout(f'No database connection available after {self.timeout}s')
+                    continue
+
+            if connection is None:
+                return self._open()
+            if self._healthy(connection, created, released):
+                with self._condition:
+                    self._stats['reused'] += 1
+                return connection
+            self._discard(connection)
+
+    def release(self, connection, discard=False):
+        if discard:
+            self._discard(connection)
+            return
+        with self._condition:
+            created = self._created.get(id(connection), time.monotonic())
+            self._idle.append((connection, created, time.monotonic()))
+            self._condition.notify()
+
+    def close_all(self):
+        with self._condition:
+            idle, self._idle = list(self._idle), deque()
+        for connection, _created, _released in idle:
+            self._discard(connection)
+
+    def stats(self):
+        with self._condition:
+            return dict(self._stats, size=self._size, idle=len(self._idle), in_use=self._size - len(self._idle))
+
+
+def get_pool(alias, factory):
+    """Return the pool of a database alias, creating it with ``factory()`` once."""
+    pool = _pools.get(alias)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(alias)
+            if pool is None:
+                pool = _pools[alias] = factory()
+    return pool
+
+
+def pool_stats():
+    """Counters of every pool in this process, keyed by database alias."""
+    return {alias: pool.stats() for alias, pool in _pools.items()}
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Mixin for a DatabaseWrapper that takes raw connections from a
+    ConnectionPool instead of opening one per request, and gives them back
+    when Django closes the connection (at the end of each request with
+    CONN_MAX_AGE = 0). Configured by the ``POOL`` key of the database
+    settings: MAX_SIZE, TIMEOUT, MAX_LIFETIME and CHECK_AFTER.
+    """
+
+    def pool_check(self, connection):
+        cursor = connection.cursor()
+        try:
+            cursor.execute('SELECT 1')
+        finally:
+            cursor.close()
+
+    @property
+    def pool(self):
+        def factory():
+            options = self.settings_dict.get('POOL') or {}
+            return ConnectionPool(
+                connect=lambda: super(PooledDatabaseWrapperMixin, self).get_new_connection(self.get_connection_params()),
+                check=self.pool_check,
+                max_size=options.get('MAX_SIZE', 10),
+                timeout=options.get('TIMEOUT', 5.0),
+                max_lifetime=options.get('MAX_LIFETIME', 600),
+                check_after=options.get('CHECK_AFTER', 30),
+            )
+        return get_pool(self.alias, factory)
+
+    def get_new_connection(self, conn_params):
+        return self.pool.acquire()
+
+    def _close(self):
+        if self.connection is None:
+            return
+        connection = self.connection
+        discard = self.errors_occurred
+        if not discard:
+            # Never hand over a connection with an open transaction.
+            try:
+                connection.rollback()
+            except Exception:
+                discard = True
+        self.pool.release(connection, discard=discard)
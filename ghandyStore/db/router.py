@@ -0,0 +1,193 @@
+"""
+Read replicas for the catalog (DATABASE_ROUTERS), with read-your-writes
+stickiness.
+
+Only requests use the replicas: ReplicaRoutingMiddleware marks each request,
+and while it runs, reads of the catalog models (REPLICA_APPS, except
+PRIMARY_MODELS) go to one healthy replica picked for the whole request.
+Everything else uses the primary (``default``): all writes, jobs and
+management commands, admin pages and requests with unsafe methods. Once a
+request has written, its later reads stay on the primary too.
+
+Replication lag is hidden in two ways. A visitor whose request wrote gets a
+cookie that keeps them on the primary for DB_STICKY_SECONDS, and a catalog
+edit (bump_catalog_version) holds every request on the primary for as long,
+so caches are not filled from a replica that has not seen the edit yet.
+
+A replica is checked with ``SELECT 1`` (and on MySQL its lag behind the
+source against DB_REPLICA_MAX_LAG) at most every CHECK_INTERVAL seconds per
+process; one that fails is skipped for DB_REPLICA_RETRY_AFTER seconds.
+"""
+import logging
+import random
+import time
+from contextvars import ContextVar
+from functools import cache
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections as default_connections
+from django.urls import reverse
+
+logger = logging.getLogger(__name__)
+
+DB_REPLICAS = getattr(settings, 'DB_REPLICAS', [])
+DB_STICKY_SECONDS = getattr(settings, 'DB_STICKY_SECONDS', 5)
+# Seconds a MySQL replica may lag behind its source; None skips the check.
+DB_REPLICA_MAX_LAG = getattr(settings, 'DB_REPLICA_MAX_LAG', None)
+DB_REPLICA_RETRY_AFTER = getattr(settings, 'DB_REPLICA_RETRY_AFTER', 30)
+
+CHECK_INTERVAL = 5
+STICKY_COOKIE = 'db_primary_until'
+HOLD_KEY = 'db:replicas:held'
+
+REPLICA_APPS = {'item'}
+# Read on the primary even by catalog requests.
+PRIMARY_MODELS = {'item.itemrequest'}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_current = ContextVar('db_routing', default=None)
+
+
+class RoutingState:
+    __slots__ = ('primary', 'replica', 'wrote')
+
+    def __init__(self, primary=False):
+        self.primary = primary
+        self.replica = None
+        self.wrote = False
+
+
+def hold_replicas(seconds=DB_STICKY_SECONDS):
+    """Send the reads of every request to the primary for ``seconds``."""
+    default_cache.set(HOLD_KEY, True, timeout=seconds)
+
+
+def replication_lag(cursor):
+    """
+    Seconds the MySQL replica behind ``cursor`` lags its source, or None
+    when replication is not running.
+    """
+    for statement, column in (
+        ('SHOW REPLICA STATUS', 'Seconds_Behind_Source'),
+        ('SHOW SLAVE STATUS', 'Seconds_Behind_Master'),  # before MySQL 8.0.22
+    ):
+        try:
+            cursor.execute(statement)
+        except DatabaseError:
+            continue
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip((col[0] for col in cursor.description), row)).get(column)
+    return None
+
+
+class ReplicaHealth:
+    """The health of the replicas, shared by the threads of a process."""
+
+    def __init__(self, connections=None, max_lag=DB_REPLICA_MAX_LAG, retry_after=DB_REPLICA_RETRY_AFTER,
+                 interval=CHECK_INTERVAL):
+        self.connections = connections or default_connections
+        self.max_lag = max_lag
+        self.retry_after = retry_after
+        self.interval = interval
+        self._checked = {}  # alias -> (checked, healthy)
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        checked = self._checked.get(alias)
+        if checked is not None:
+            at, healthy = checked
+            if now - at < (self.interval if healthy else self.retry_after):
+                return healthy
+        healthy = self.check(alias)
+        if not healthy and (checked is None or checked[1]):
+            logger.warning('Replica %s failed its health check, skipped for %ss', alias, self.retry_after)
+        self._checked[alias] = (now, healthy)
+        return healthy
+
+    def check(self, alias):
+        connection = self.connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                if self.max_lag is not None and connection.vendor == 'mysql':
+                    lag = replication_lag(cursor)
+                    return lag is not None and lag <= self.max_lag
+        except DatabaseError:
+            # Dropped so the next check connects again.
+            try:
+                connection.close()
+            except DatabaseError:
+                pass
+            return False
+        return True
+
+
+class PrimaryReplicaRouter:
+    def __init__(self, replicas=None, health=None):
+        self.replicas = list(DB_REPLICAS if replicas is None else replicas)
+        self.health = health or ReplicaHealth()
+
+    def db_for_read(self, model, **hints):
+        state = _current.get()
+        if state is None or state.primary or not self.replicas:
+            return DEFAULT_DB_ALIAS
+        if model._meta.app_label not in REPLICA_APPS or model._meta.label_lower in PRIMARY_MODELS:
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            # One replica per request, so its reads see one point in time.
+            healthy = [alias for alias in self.replicas if self.health.is_healthy(alias)]
+            state.replica = random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _current.get()
+        if state is not None:
+            # Later reads of the request must see the write.
+            state.primary = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias holds the same data.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema through replication.
+        return db == DEFAULT_DB_ALIAS
+
+
+@cache
+def admin_prefix():
+    return reverse('admin:index')
+
+
+class ReplicaRoutingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = RoutingState(primary=self.needs_primary(request))
+        token = _current.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        if state.wrote:
+            response.set_cookie(
+                STICKY_COOKIE, str(int(time.time() + DB_STICKY_SECONDS)), max_age=DB_STICKY_SECONDS,
+                secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax',
+            )
+        return response
+
+    def needs_primary(self, request):
+        if request.method not in SAFE_METHODS or request.path.startswith(admin_prefix()):
+            return True
+        try:
+            if int(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time():
+                return True
+        except ValueError:
+            pass
+        return bool(default_cache.get(HOLD_KEY))
@@ -0,0 +1,193 @@
+"""
+Per-request performance instrumentation.
+
+RequestMetricsMiddleware measures a sample of the requests (the
+REQUEST_METRICS_SAMPLE_RATE setting): wall time, SQL query count and time
+(connection.execute_wrapper), template render time (the TimedTemplates
+backend) and cache hits/misses (the cache backends of this module).
+Measured responses carry a ``Server-Timing`` header when DEBUG is on or the
+visitor is staff, and requests slower than SLOW_REQUEST_MS or running more
+than SLOW_REQUEST_QUERIES queries are logged as one JSON record to the
+``ghandyStore.slow_requests`` logger, with the most repeated queries so N+1
+patterns show up by view name.
+
+Requests that are not sampled only pay for one random() call: the template
+and cache backends check a context variable and return straight away.
+"""
+import json
+import logging
+import random
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache.backends import filebased, locmem
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+from ghandyStore.db.pool import pool_stats
+
+logger = logging.getLogger('ghandyStore.slow_requests')
+
+_current = ContextVar('request_metrics', default=None)
+
+TOP_DUPLICATES = 5
+
+
+class RequestMetrics:
+    __slots__ = ('started', 'queries', 'sql_time', 'statements', 'template_time', 'template_depth', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Installed with connection.execute_wrapper(); ``sql`` still has its
+        # placeholders, so repeated queries with other params count together.
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def duplicates(self):
+        return [
+            {'count': count, 'sql': sql}
+            for sql, count in self.statements.most_common(TOP_DUPLICATES)
+            if count > 1
+        ]
+
+
+class TimedTemplate:
+    """A template of TimedTemplates; its render() counts as template time."""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return self.template.render(context, request)
+        # Only the outermost render is timed; includes are part of it.
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - started
+
+
+class TimedTemplates(DjangoTemplates):
+    """The Django template backend, timing renders for RequestMetricsMiddleware."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class MeteredCache:
+    """Cache backend mixin counting the hits and misses of measured requests."""
+
+    _missing = object()
+
+    def get(self, key, default=None, version=None):
+        # get_many() of the built-in backends goes through get().
+        metrics = _current.get()
+        if metrics is None:
+            return super().get(key, default, version)
+        value = super().get(key, self._missing, version)
+        if value is self._missing:
+            metrics.cache_misses += 1
+            return default
+        metrics.cache_hits += 1
+        return value
+
+
+class LocMemCache(MeteredCache, locmem.LocMemCache):
+    pass
+
+
+class FileBasedCache(MeteredCache, filebased.FileBasedCache):
+    pass
+
+
+def show_timing(request):
+    """Server-Timing reveals the queries, so only developers and staff get it."""
+    if settings.DEBUG:
+        return True
+    # Read after the response went through SessionMiddleware, so anonymous
+    # responses do not get Vary: Cookie.
+    user = getattr(request, 'user', None)
+    return settings.SESSION_COOKIE_NAME in request.COOKIES and user is not None and user.is_staff
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'REQUEST_METRICS_SAMPLE_RATE', 1.0)
+        self.slow_ms = getattr(settings, 'SLOW_REQUEST_MS', 500)
+        self.slow_queries = getattr(settings, 'SLOW_REQUEST_QUERIES', 50)
+
+    def __call__(self, request):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        wrappers = [connection.execute_wrapper(metrics) for connection in connections.all()]
+        try:
+            for wrapper in wrappers:
+                wrapper.__enter__()
+            response = self.get_response(request)
+        finally:
+            for wrapper in reversed(wrappers):
+                wrapper.__exit__(None, None, None)
+            _current.reset(token)
+
+        total = time.perf_counter() - metrics.started
+        if show_timing(request):
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={metrics.sql_time * 1000:.1f};desc="{metrics.queries} queries"',
+                f'tpl;dur={metrics.template_time * 1000:.1f}',
+                f'cache;desc="{metrics.cache_hits} hits, {metrics.cache_misses} misses"',
+                f'total;dur={total * 1000:.1f}',
+            ])
+        if total * 1000 >= self.slow_ms or metrics.queries >= self.slow_queries:
+            self.log_slow(request, response, metrics, total)
+        return response
+
+    def log_slow(self, request, response, metrics, total):
+        match = request.resolver_match
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'queries': metrics.queries,
+            'sql_ms': round(metrics.sql_time * 1000, 1),
+            'template_ms': round(metrics.template_time * 1000, 1),
+            'cache_hits': metrics.cache_hits,
+            'cache_misses': metrics.cache_misses,
+            'duplicates': metrics.duplicates(),
+        }
+        pools = pool_stats()
+        if pools:
+            record['db_pool'] = pools
+        logger.warning(json.dumps(record, ensure_ascii=False))
@@ -0,0 +1,150 @@
+"""
+Serving of uploaded media (MEDIA_ROOT) in three modes, chosen by the
+MEDIA_SERVE_MODE setting:
+
+- ``django``: streamed by Django with ETag, Last-Modified and Range support.
+- ``accel``: Django only checks the path and answers with an
+  ``X-Accel-Redirect`` header; nginx sends the file from an internal
+  location mapped to MEDIA_ACCEL_PREFIX.
+- ``sendfile``: same with an ``X-Sendfile`` header (Apache mod_xsendfile,
+  lighttpd).
+
+Files whose name carries a content hash, and the content-addressed blobs
+(see ghandyStore.storage), never change, so they are served with a
+far-future immutable Cache-Control.
+"""
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from .storage import BLOB_TMP_DIR, blob_digest
+
+HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{16}\.[A-Za-z0-9]+$')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+CHUNK_SIZE = 64 * 1024
+
+
+def is_hashed(path):
+    return bool(HASHED_NAME_RE.search(path)) or blob_digest(path) is not None
+
+
+def _etag(st):
+    return quote_etag(f'{st.st_mtime_ns:x}-{st.st_size:x}')
+
+
+def _not_modified(request, etag, mtime):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+    since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return since is not None and int(mtime) <= since
+
+
+def _parse_range(header, size):
+    """
+    Return (start, end) inclusive for a single byte range, None if the
+    header is absent or invalid (RFC 7233: ignored, the full file is sent),
+    False if it is valid but unsatisfiable.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            return False
+        return start, min(int(last), size - 1) if last else size - 1
+    if last:
+        if not int(last) or not size:
+            return False
+        return max(size - int(last), 0), size - 1
+    return None
+
+
+def _read_range(path, start, end):
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = fh.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _set_headers(response, path, st, etag, content_type):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(st.st_mtime)
+    response['Accept-Ranges'] = 'bytes'
+    if content_type:
+        response['Content-Type'] = content_type
+    if is_hashed(path):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=settings.MEDIA_CACHE_MAX_AGE)
+    return response
+
+
+def serve_media(request, path):
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        st = os.stat(fullpath)
+    except (ValueError, OSError):
+        raise Http404('File not found')
+    if fullpath.startswith(safe_join(settings.MEDIA_ROOT, BLOB_TMP_DIR) + os.sep):
+        # Uploads still being written.
+        raise Http404('File not found')
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404('File not found')
+
+    etag = _etag(st)
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+
+    if _not_modified(request, etag, st.st_mtime):
+        return _set_headers(HttpResponseNotModified(), path, st, etag, None)
+
+    mode = settings.MEDIA_SERVE_MODE
+    if mode in ('accel', 'sendfile'):
+        # The front proxy sends the bytes and handles Range itself.
+        response = HttpResponse(content_type=content_type)
+        if mode == 'accel':
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + path.lstrip('/')
+        else:
+            response['X-Sendfile'] = fullpath
+        return _set_headers(response, path, st, etag, content_type)
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if range_header and (not if_range or if_range in (etag, http_date(st.st_mtime))):
+        byte_range = _parse_range(range_header, st.st_size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{st.st_size}'
+        return response
+
+    if byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(_read_range(fullpath, start, end), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{st.st_size}'
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        response = FileResponse(open(fullpath, 'rb'), content_type=content_type)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return _set_headers(response, path, st, etag, content_type)
@@ -32,6 +32,7 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'ghandyStore.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware', 
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -48,7 +49,9 @@ ROOT_URLCONF = 'ghandyStore.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for RequestMetricsMiddleware
+        'BACKEND': 'ghandyStore.instrumentation.TimedTemplates',
+        'NAME': 'django',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -66,19 +69,123 @@ TEMPLATES = [
 WSGI_APPLICATION = 'ghandyStore.wsgi.application'
 
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.mysql',
-        'NAME': os.environ.get('MYSQL_DATABASE', 'ghandystore'),
-        'USER': os.environ.get('MYSQL_USER', 'ghandy'),
-        'PASSWORD': os.environ.get('MYSQL_PASSWORD', 'ghandyStore1'),
-        'HOST': os.environ.get('MYSQL_HOST', '127.0.0.1'),
-        'PORT': os.environ.get('MYSQL_PORT', '3306'),
-        'OPTIONS': {
-            'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
-        },
+# MySQL by default; DB_ENGINE=sqlite uses a local SQLite file (tests,
+# benchmarks, development without a MySQL server).
+DB_ENGINE = os.environ.get('DB_ENGINE', 'mysql')
+
+if DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            # Write transactions take the lock up front instead of failing
+            # with "database is locked" when two of them race to upgrade.
+            'OPTIONS': {
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+            # A file rather than the shared in-memory database, which fails
+            # with "database table is locked" instead of waiting when the
+            # threads of uploads and imports write at the same time.
+            'TEST': {'NAME': os.environ.get('SQLITE_TEST_PATH', BASE_DIR / 'test_db.sqlite3')},
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.mysql',
+            'NAME': os.environ.get('MYSQL_DATABASE', 'ghandystore'),
+            'USER': os.environ.get('MYSQL_USER', 'ghandy'),
+            'PASSWORD': os.environ.get('MYSQL_PASSWORD', 'ghandyStore1'),
+            'HOST': os.environ.get('MYSQL_HOST', '127.0.0.1'),
+            'PORT': os.environ.get('MYSQL_PORT', '3306'),
+            'OPTIONS': {
+                'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
+            },
+        }
     }
-}
+
+# Persistent connections: kept open for DB_CONN_MAX_AGE seconds and checked
+# before reuse, instead of one connect per request.
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = os.environ.get('DB_CONN_HEALTH_CHECKS', 'true').lower() in ('1', 'true', 'yes')
+
+# DB_POOL=true shares a bounded pool of connections between the threads of
+# a worker (WSGI threads, ASGI thread pool) instead: each request borrows a
+# connection and gives it back when it finishes. See ghandyStore.db.pool.
+if os.environ.get('DB_POOL', '').lower() in ('1', 'true', 'yes'):
+    DATABASES['default']['ENGINE'] = (
+        'ghandyStore.db.backends.sqlite3' if DB_ENGINE == 'sqlite' else 'ghandyStore.db.backends.mysql'
+    )
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['POOL'] = {
+        'MAX_SIZE': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+        'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+        'MAX_LIFETIME': int(os.environ.get('DB_POOL_MAX_LIFETIME', 600)),
+        'CHECK_AFTER': int(os.environ.get('DB_POOL_CHECK_AFTER', 30)),
+    }
+
+# DB_REPLICAS: comma separated read replicas of the default database, as
+# MySQL host[:port] or, with DB_ENGINE=sqlite, file paths. Catalog reads of
+# requests go to them; see ghandyStore.db.router.
+DB_REPLICAS = []
+for number, location in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), 1):
+    replica = {**DATABASES['default'], 'OPTIONS': dict(DATABASES['default']['OPTIONS'])}
+    if DB_ENGINE == 'sqlite':
+        replica['NAME'] = location.strip()
+    else:
+        host, _, port = location.strip().partition(':')
+        replica.update(HOST=host, PORT=port or replica['PORT'])
+    # Tests read the test database through the replica aliases.
+    replica['TEST'] = {'MIRROR': 'default'}
+    DATABASES[f'replica{number}'] = replica
+    DB_REPLICAS.append(f'replica{number}')
+
+if DB_REPLICAS:
+    DATABASE_ROUTERS = ['ghandyStore.db.router.PrimaryReplicaRouter']
+    MIDDLEWARE.insert(1, 'ghandyStore.db.router.ReplicaRoutingMiddleware')
+# Seconds a visitor's requests stay on the primary after they wrote, and
+# every request after a catalog edit, to hide replication lag
+DB_STICKY_SECONDS = int(os.environ.get('DB_STICKY_SECONDS', 5))
+# Replicas lagging more seconds behind (MySQL) are skipped, as are ones
+# failing their health check, for DB_REPLICA_RETRY_AFTER seconds
+DB_REPLICA_MAX_LAG = int(os.environ['DB_REPLICA_MAX_LAG']) if os.environ.get('DB_REPLICA_MAX_LAG') else None
+DB_REPLICA_RETRY_AFTER = int(os.environ.get('DB_REPLICA_RETRY_AFTER', 30))
+
+
+# The workers of one server share the cache through the file backend in
+# CACHE_LOCATION (the cache/ directory by default in production), so
+# catalog and reference data edits reach every worker and run_worker. Only
+# development without CACHE_LOCATION uses a per-process memory cache. The
+# backends of ghandyStore.instrumentation count hits and misses for the
+# request metrics.
+CACHE_LOCATION = os.environ.get('CACHE_LOCATION') or (None if DEBUG else str(BASE_DIR / 'cache'))
+if CACHE_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': 'ghandyStore.instrumentation.FileBasedCache',
+            'LOCATION': CACHE_LOCATION,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'ghandyStore.instrumentation.LocMemCache',
+        }
+    }
+
+# Anonymous catalog pages: seconds fresh, then seconds served stale while
+# one request re-renders them
+PAGE_CACHE_TIMEOUT = int(os.environ.get('PAGE_CACHE_TIMEOUT', 300))
+PAGE_CACHE_STALE = int(os.environ.get('PAGE_CACHE_STALE', 3600))
+# max-age of the item detail pages marked public for shared caches/proxies
+SHARED_CACHE_MAX_AGE = int(os.environ.get('SHARED_CACHE_MAX_AGE', 60))
+
+# Share of requests measured by RequestMetricsMiddleware (Server-Timing
+# header), and the limits above which a measured request is logged as slow
+REQUEST_METRICS_SAMPLE_RATE = float(os.environ.get('REQUEST_METRICS_SAMPLE_RATE', 1.0 if DEBUG else 0.05))
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 500))
+SLOW_REQUEST_QUERIES = int(os.environ.get('SLOW_REQUEST_QUERIES', 50))
 
 
 LANGUAGE_CODE = 'en-us'
@@ -87,12 +194,49 @@ USE_I18N = True
 USE_TZ = True
 
 STATIC_URL = '/static/'
-STATIC_ROOT = os.path.join(BASE_DIR, 'static')
+STATIC_ROOT = os.environ.get('STATIC_ROOT', os.path.join(BASE_DIR, 'static'))
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+STORAGES = {
+    # Uploads get a content hash in their name so they can be cached forever
+    'default': {
+        'BACKEND': 'ghandyStore.storage.HashedMediaStorage',
+    },
+    # Product images: one file per distinct content, shared by every row
+    # that uploads the same bytes
+    'blobs': {
+        'BACKEND': 'ghandyStore.storage.ContentAddressedStorage',
+    },
+    # Production serves collectstatic output with content-hashed names
+    # (run build_css first); development serves the app directories
+    'staticfiles': {
+        'BACKEND': (
+            'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+            else 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+        ),
+    },
+}
+
+# How uploaded media is served by ghandyStore.media.serve_media:
+# 'django' streams files from Python (Range/ETag aware), 'accel' hands them
+# to nginx with X-Accel-Redirect, 'sendfile' to Apache/lighttpd with X-Sendfile
+MEDIA_SERVE_MODE = os.environ.get('MEDIA_SERVE_MODE', 'django')
+# Internal nginx location that aliases MEDIA_ROOT (accel mode)
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/')
+# Browser cache lifetime for media files without a content hash in their name
+MEDIA_CACHE_MAX_AGE = int(os.environ.get('MEDIA_CACHE_MAX_AGE', 60 * 60 * 24))
+# gc_media leaves files modified within this many seconds (in-flight uploads)
+MEDIA_GC_GRACE = int(os.environ.get('MEDIA_GC_GRACE', 60 * 60 * 24))
+# Queue the removal of images released by deleted or edited catalog rows
+# (background job, after MEDIA_DELETE_DELAY seconds) instead of waiting for gc_media
+MEDIA_DELETE_ON_RELEASE = os.environ.get('MEDIA_DELETE_ON_RELEASE', '').lower() in ('1', 'true', 'yes')
+MEDIA_DELETE_DELAY = int(os.environ.get('MEDIA_DELETE_DELAY', 60 * 10))
+# Bulk upload of color images (admin and upload_color_images): threads that
+# validate and store files, and the largest accepted file in bytes
+BULK_UPLOAD_WORKERS = int(os.environ.get('BULK_UPLOAD_WORKERS', 4))
+BULK_UPLOAD_MAX_SIZE = int(os.environ.get('BULK_UPLOAD_MAX_SIZE', 20 * 1024 * 1024))
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -0,0 +1,112 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, storages
+
+HASH_LENGTH = 16
+
+BLOB_DIR = 'blobs'
+BLOB_NAME_RE = re.compile(r'^blobs/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(?:\.[a-z0-9]{1,10})?$')
+# Uploads are written here first, on the same file system as the blobs.
+BLOB_TMP_DIR = 'blobs/tmp'
+
+
+class HashedMediaStorage(FileSystemStorage):
+    """
+    File system storage that adds a digest of the content to every saved
+    name (``item_images/shirt.jpg`` -> ``item_images/shirt.3f2a9c0d1b7e4a65.jpg``).
+    A given URL therefore always refers to the same bytes and can be cached
+    forever by browsers and proxies; saving the same bytes under the same
+    name again returns the existing file.
+    """
+
+    def content_hash(self, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        return digest.hexdigest()[:HASH_LENGTH]
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        dirname, filename = os.path.split(name)
+        stem, ext = os.path.splitext(filename)
+        name = os.path.join(dirname, f'{stem}.{self.content_hash(content)}{ext}')
+        if self.exists(name):
+            # A suffix from get_available_name would hide the hash.
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+def blob_digest(name):
+    """The SHA-256 digest in a blob name, None for other names."""
+    match = BLOB_NAME_RE.match(name or '')
+    return match.group(1) if match else None
+
+
+def blob_name(digest, ext):
+    ext = ext.lower()
+    if not re.fullmatch(r'\.[a-z0-9]{1,10}', ext):
+        ext = ''
+    return f'{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+
+def blob_storage():
+    # Callable for the ``storage`` of file fields, so migrations do not
+    # record the settings.
+    return storages['blobs']
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that keeps every distinct content once, named after
+    its SHA-256 digest whatever the upload's name
+    (``blobs/3f/2a/3f2a9c...e4a6.jpg``); saving the same bytes again returns
+    the existing name. The digest is computed while the upload is written to
+    a temporary file, which is then moved in place atomically.
+
+    References are counted per blob by base.blobs.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # _save picks the name from the content; an existing blob is reused.
+        return name
+
+    def _save(self, name, content):
+        from base.blobs import mark_stored
+
+        tmp_dir = self.path(BLOB_TMP_DIR)
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix='.part')
+        try:
+            digest = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as fh:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    fh.write(chunk)
+            name = blob_name(digest.hexdigest(), os.path.splitext(name)[1])
+            path = self.path(name)
+            # Recorded before the file is looked at: a reused blob counts as
+            # a fresh upload for gc_media, without touching the file and its
+            # Last-Modified.
+            mark_stored(name, os.path.getsize(tmp_path))
+            if os.path.exists(path):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.chmod(tmp_path, self.file_permissions_mode or 0o644)
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return name
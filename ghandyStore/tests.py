@@ -0,0 +1,335 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db.utils import ConnectionHandler
+from django.http import HttpResponse
+from django.template import engines
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from base.models import Job, MediaBlob
+from ghandyStore.db.pool import ConnectionPool, PoolTimeout, pool_stats
+from ghandyStore.db.router import (
+    HOLD_KEY, STICKY_COOKIE, PrimaryReplicaRouter, ReplicaHealth, ReplicaRoutingMiddleware,
+)
+from ghandyStore.instrumentation import RequestMetricsMiddleware
+from ghandyStore.storage import ContentAddressedStorage, HashedMediaStorage
+from item.caching import bump_catalog_version
+from item.models import Item, ItemRequest
+
+
+class CacheSettingsTests(SimpleTestCase):
+    def backend(self, **env):
+        environ = {key: value for key, value in os.environ.items() if key not in ('DJANGO_ENV', 'CACHE_LOCATION')}
+        code = 'from ghandyStore import settings; print(settings.CACHES["default"]["BACKEND"], settings.CACHE_LOCATION)'
+        return subprocess.run(
+            [sys.executable, '-c', code], env={**environ, **env}, cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.split()
+
+    def test_production_always_shares_the_cache(self):
+        self.assertEqual(self.backend(DJANGO_ENV='production'), [
+            'ghandyStore.instrumentation.FileBasedCache', str(settings.BASE_DIR / 'cache'),
+        ])
+        self.assertEqual(
+            self.backend(DJANGO_ENV='production', CACHE_LOCATION='/var/cache/ghandy'),
+            ['ghandyStore.instrumentation.FileBasedCache', '/var/cache/ghandy'],
+        )
+        self.assertEqual(self.backend(), ['ghandyStore.instrumentation.LocMemCache', 'None'])
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def make_pool(self, **kwargs):
+        pool = ConnectionPool(
+            connect=lambda: sqlite3.connect(self.path, check_same_thread=False),
+            check=lambda connection: connection.execute('SELECT 1'),
+            **kwargs,
+        )
+        self.addCleanup(pool.close_all)
+        return pool
+
+    def test_reuses_released_connections(self):
+        pool = self.make_pool()
+        first = pool.acquire()
+        pool.release(first)
+        self.assertIs(pool.acquire(), first)
+        stats = pool.stats()
+        self.assertEqual((stats['opened'], stats['reused'], stats['in_use']), (1, 1, 1))
+
+    def test_waits_then_fails_when_exhausted(self):
+        pool = self.make_pool(max_size=1, timeout=0.05)
+        pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        stats = pool.stats()
+        self.assertEqual((stats['waited'], stats['failed']), (1, 1))
+
+    def test_waiter_gets_released_connection(self):
+        pool = self.make_pool(max_size=1, timeout=2)
+        connection = pool.acquire()
+        timer = threading.Timer(0.05, pool.release, (connection,))
+        timer.start()
+        self.assertIs(pool.acquire(), connection)
+        timer.join()
+        self.assertEqual(pool.stats()['waited'], 1)
+
+    def test_broken_connection_is_replaced(self):
+        pool = self.make_pool(check_after=0)
+        connection = pool.acquire()
+        connection.close()
+        pool.release(connection)
+        replacement = pool.acquire()
+        self.assertIsNot(replacement, connection)
+        stats = pool.stats()
+        self.assertEqual((stats['opened'], stats['closed'], stats['size']), (2, 1, 1))
+
+    def test_failed_connect_frees_slot(self):
+        pool = ConnectionPool(connect=lambda: sqlite3.connect('/nonexistent/dir/db.sqlite3'), max_size=1, timeout=0.05)
+        for _ in range(2):
+            with self.assertRaises(sqlite3.OperationalError):
+                pool.acquire()
+        self.assertEqual((pool.stats()['failed'], pool.stats()['size']), (2, 0))
+
+
+class PooledBackendTests(SimpleTestCase):
+    """The pooled SQLite backend shared by concurrent threads."""
+
+    def setUp(self):
+        fd, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        self.connections = ConnectionHandler({
+            'default': {},
+            'pooled': {
+                'ENGINE': 'ghandyStore.db.backends.sqlite3',
+                'NAME': path,
+                'CONN_MAX_AGE': 0,
+                'POOL': {'MAX_SIZE': 2, 'TIMEOUT': 5},
+            },
+        })
+
+    def tearDown(self):
+        self.connections['pooled'].pool.close_all()
+
+    def test_threads_share_bounded_pool(self):
+        errors = []
+
+        def work():
+            try:
+                for _ in range(5):
+                    connection = self.connections['pooled']
+                    with connection.cursor() as cursor:
+                        cursor.execute('SELECT 1')
+                        self.assertEqual(cursor.fetchone(), (1,))
+                    connection.close()
+            except Exception as exc:  # pragma: no cover - reported below
+                errors.append(exc)
+
+        threads = [threading.Thread(target=work) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        stats = pool_stats()['pooled']
+        self.assertLessEqual(stats['opened'], 2)
+        self.assertEqual(stats['opened'] + stats['reused'], 30)
+        self.assertEqual(stats['in_use'], 0)
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    """Routing between a primary and a lagging replica, two SQLite files."""
+
+    # The primary of the test is called 'default' too.
+    databases = {'default'}
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        paths = {alias: os.path.join(self.dir.name, f'{alias}.sqlite3') for alias in ('default', 'replica')}
+        for alias, rows in (('default', 2), ('replica', 1)):
+            with sqlite3.connect(paths[alias]) as db:
+                db.execute('CREATE TABLE t (id INTEGER)')
+                db.executemany('INSERT INTO t VALUES (?)', [(n,) for n in range(rows)])
+            db.close()
+        self.down = os.path.join(self.dir.name, 'down')
+        self.connections = ConnectionHandler({
+            'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': paths['default']},
+            'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': paths['replica']},
+            'broken': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(self.down, 'db.sqlite3')},
+        })
+        self.addCleanup(self.connections.close_all)
+        self.router = PrimaryReplicaRouter(['replica'], ReplicaHealth(self.connections))
+        cache.delete(HOLD_KEY)
+
+    def request(self, method='get', path='/items/', cookies=None, write=False):
+        """Run a request; returns the response and the aliases its reads used."""
+        used = {}
+
+        def view(request):
+            if write:
+                self.router.db_for_write(ItemRequest)
+            for model in (Item, ItemRequest, Job):
+                used[model] = self.router.db_for_read(model)
+            with self.connections[used[Item]].cursor() as cursor:
+                cursor.execute('SELECT COUNT(*) FROM t')
+                used['rows'] = cursor.fetchone()[0]
+            return HttpResponse()
+
+        request = getattr(RequestFactory(), method)(path)
+        request.COOKIES.update(cookies or {})
+        return ReplicaRoutingMiddleware(view)(request), used
+
+    def test_catalog_reads_of_requests_use_replica(self):
+        # Commands and jobs always use the primary.
+        self.assertEqual(self.router.db_for_read(Item), 'default')
+        response, used = self.request()
+        self.assertEqual((used[Item], used[ItemRequest], used[Job]), ('replica', 'default', 'default'))
+        self.assertEqual(used['rows'], 1)
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    def test_admin_and_unsafe_methods_use_primary(self):
+        self.assertEqual(self.request(path='/admin/item/item/')[1][Item], 'default')
+        self.assertEqual(self.request(method='post', path='/items/1/')[1][Item], 'default')
+
+    def test_writes_stick_to_primary(self):
+        response, used = self.request(write=True)
+        self.assertEqual((used[Item], used['rows']), ('default', 2))
+        cookie = response.cookies[STICKY_COOKIE]
+        self.assertEqual(self.request(cookies={STICKY_COOKIE: cookie.value})[1][Item], 'default')
+        self.assertEqual(self.request(cookies={STICKY_COOKIE: str(int(time.time()) - 1)})[1][Item], 'replica')
+
+    def test_catalog_edits_hold_replicas(self):
+        bump_catalog_version()
+        self.assertEqual(self.request()[1][Item], 'default')
+        cache.delete(HOLD_KEY)
+        self.assertEqual(self.request()[1][Item], 'replica')
+
+    def test_failing_replica_is_skipped(self):
+        self.router.replicas = ['broken', 'replica']
+        with self.assertLogs('ghandyStore.db.router', 'WARNING'):
+            self.assertEqual({self.request()[1][Item] for _ in range(10)}, {'replica'})
+
+        self.router.replicas = ['broken']
+        self.assertEqual(self.request()[1][Item], 'default')
+        # Not checked again before DB_REPLICA_RETRY_AFTER.
+        os.mkdir(self.down)
+        with sqlite3.connect(os.path.join(self.down, 'db.sqlite3')) as db:
+            db.execute('CREATE TABLE t (id INTEGER)')
+        db.close()
+        self.assertEqual(self.request()[1][Item], 'default')
+        self.router.health.retry_after = 0
+        self.assertEqual(self.request()[1][Item], 'broken')
+
+
+class MediaTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name, MEDIA_SERVE_MODE='django'))
+        self.media_root = media_root.name
+        self.name = HashedMediaStorage().save('item_images/shirt.jpg', ContentFile(b'0123456789'))
+
+    def get(self, name, **headers):
+        return self.client.get(f'/media/{name}', headers=headers)
+
+    def test_hashed_names_are_immutable_and_conditional(self):
+        self.assertRegex(self.name, r'^item_images/shirt\.[0-9a-f]{16}\.jpg$')
+        response = self.get(self.name)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.get(self.name, if_none_match=response['ETag']).status_code, 304)
+
+        with override_settings(MEDIA_SERVE_MODE='accel', MEDIA_ACCEL_PREFIX='/protected/'):
+            self.assertEqual(self.get(self.name)['X-Accel-Redirect'], f'/protected/{self.name}')
+
+    def test_ranges(self):
+        response = self.get(self.name, range='bytes=2-4')
+        self.assertEqual((response.status_code, response['Content-Range']), (206, 'bytes 2-4/10'))
+        self.assertEqual(b''.join(response.streaming_content), b'234')
+        self.assertEqual(b''.join(self.get(self.name, range='bytes=-3').streaming_content), b'789')
+
+        # Invalid ranges are ignored, unsatisfiable ones refused.
+        for header in ('bytes=5-2', 'bytes=x-1', 'items=0-1'):
+            response = self.get(self.name, range=header)
+            self.assertEqual((response.status_code, b''.join(response.streaming_content)), (200, b'0123456789'))
+        for header in ('bytes=10-', 'bytes=-0'):
+            response = self.get(self.name, range=header)
+            self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */10'))
+
+    def test_uploads_in_progress_are_not_served(self):
+        os.makedirs(os.path.join(self.media_root, 'blobs/tmp'))
+        with open(os.path.join(self.media_root, 'blobs/tmp/upload.part'), 'wb') as fh:
+            fh.write(b'partial')
+        self.assertEqual(self.get('blobs/tmp/upload.part').status_code, 404)
+        self.assertEqual(self.get('blobs/../blobs/tmp/upload.part').status_code, 404)
+
+    def test_same_content_keeps_its_name_and_file(self):
+        self.assertEqual(HashedMediaStorage().save('item_images/shirt.jpg', ContentFile(b'0123456789')), self.name)
+
+        storage = ContentAddressedStorage()
+        blob = storage.save('item_images/shirt.jpg', ContentFile(b'0123456789'))
+        self.assertEqual(MediaBlob.objects.filter(name=blob, size=10, refcount=0).count(), 1)
+        old = time.time() - 60 * 60
+        os.utime(storage.path(blob), (old, old))
+        first = MediaBlob.objects.get(name=blob).stored_at
+
+        self.assertEqual(storage.save('item_color_images/other.jpg', ContentFile(b'0123456789')), blob)
+        self.assertEqual(os.path.getmtime(storage.path(blob)), old)
+        self.assertGreater(MediaBlob.objects.get(name=blob).stored_at, first)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'blobs/tmp')), [])
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def request(self, user=None):
+        """Run a measured request; returns the response and the slow request record."""
+        def view(request):
+            list(Item.objects.all())
+            list(Item.objects.all())
+            cache.get('missing')
+            cache.set('present', 1)
+            cache.get_many(['present'])
+            return HttpResponse(engines['django'].from_string('{{ value }}').render({'value': 'x'}))
+
+        middleware = RequestMetricsMiddleware(view)
+        middleware.sample_rate, middleware.slow_queries = 1, 2
+        request = RequestFactory().get('/items/')
+        if user is not None:
+            request.COOKIES[settings.SESSION_COOKIE_NAME] = 'session'
+        request.user = user or AnonymousUser()
+        with self.assertLogs('ghandyStore.slow_requests', 'WARNING') as logs:
+            response = middleware(request)
+        return response, json.loads(logs.records[0].getMessage())
+
+    def test_slow_requests_are_logged(self):
+        response, record = self.request()
+        self.assertEqual((record['queries'], record['cache_hits'], record['cache_misses']), (2, 1, 1))
+        self.assertEqual(record['duplicates'][0]['count'], 2)
+        self.assertEqual(response.content, b'x')
+
+    def test_server_timing_only_for_staff_and_debug(self):
+        self.assertFalse(self.request()[0].has_header('Server-Timing'))
+        self.assertFalse(self.request(User.objects.create_user('customer'))[0].has_header('Server-Timing'))
+        timing = self.request(User.objects.create_user('staff', is_staff=True))[0]['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="1 hits, 1 misses"', timing)
+        with override_settings(DEBUG=True):
+            self.assertTrue(self.request()[0].has_header('Server-Timing'))
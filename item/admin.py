@@ -1,12 +1,40 @@
+import json
+import os
+
 from django.contrib import admin
+from django.contrib.admin.utils import unquote
+from django.core.exceptions import PermissionDenied
+from django.core.files.storage import default_storage
+from django.db.models import Count, Prefetch
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.urls import path
+from django.utils import timezone
+from django.utils.decorators import method_decorator
 from django.utils.html import format_html
+from django.views.decorators.http import require_http_methods, require_POST
 
 # Register your models here.
 
+from . import uploads
+from .exports import FORMATS
+from .images import with_thumbnails
 from .models import Category, Item, ItemRequest, City, Place, ItemColor, ItemColorImage
 
 admin.site.register(Category)
 
+def thumbnail_url(obj):
+    """Thumbnail of an image row annotated by ``with_thumbnails``, or the original."""
+    thumb_name = getattr(obj, 'thumb_name', None)
+    return default_storage.url(thumb_name) if thumb_name else obj.image.url
+
+class ColorListFilter(admin.RelatedFieldListFilter):
+    """Color filter whose labels (item - color) are loaded in one query."""
+
+    def field_choices(self, field, request, model_admin):
+        ordering = self.field_admin_ordering(field, request, model_admin) or ItemColor._meta.ordering
+        colors = ItemColor.objects.select_related('item').order_by(*ordering)
+        return [(color.pk, str(color)) for color in colors]
+
 class ItemColorImageInline(admin.TabularInline):
     model = ItemColorImage
     extra = 3
@@ -17,16 +45,21 @@ class ItemColorImageInline(admin.TabularInline):
 class ItemColorInline(admin.StackedInline):
     model = ItemColor
     extra = 1
-    fields = ('name', 'is_sold_out', 'images_info', 'edit_link')
+    fields = ('name', 'stock_quantity', 'is_sold_out', 'images_info', 'edit_link')
     readonly_fields = ('images_info', 'edit_link')
     
+    def get_queryset(self, request):
+        images = with_thumbnails(ItemColorImage.objects.all())
+        # select_related: each inline is titled with str(color), which includes the item name
+        return super().get_queryset(request).select_related('item').prefetch_related(Prefetch('images', queryset=images))
+    
     def images_info(self, obj):
         if obj.pk:
             images = obj.images.all()
             if images:
-                html = '<div style="margin: 10px 0;"><strong>Images ({})</strong><div style="display: flex; gap: 10px; flex-wrap: wrap; margin-top: 10px;">'.format(images.count())
+                html = '<div style="margin: 10px 0;"><strong>Images ({})</strong><div style="display: flex; gap: 10px; flex-wrap: wrap; margin-top: 10px;">'.format(len(images))
                 for img in images:
-                    html += f'<img src="{img.image.url}" style="max-height: 80px; max-width: 80px; border: 1px solid #ddd; padding: 5px; border-radius: 4px;" />'
+                    html += f'<img src="{thumbnail_url(img)}" style="max-height: 80px; max-width: 80px; border: 1px solid #ddd; padding: 5px; border-radius: 4px;" />'
                 html += '</div></div>'
                 return format_html(html)
             return format_html('<p style="color: #999; font-style: italic; margin: 10px 0;">No images yet. Click "Edit Color" below to add images.</p>')
@@ -42,7 +75,8 @@ class ItemColorInline(admin.StackedInline):
 
 @admin.register(Item)
 class ItemAdmin(admin.ModelAdmin):
-    list_display = ('name', 'category', 'price', 'is_sold', 'created_by', 'created_at')
+    list_display = ('name', 'category', 'price', 'is_sold', 'available_colors_count', 'images_count', 'created_by', 'created_at')
+    list_select_related = ('category', 'created_by')
     list_filter = ('category', 'is_sold', 'created_at')
     search_fields = ('name', 'description')
     inlines = [ItemColorInline]
@@ -51,10 +85,10 @@ class ItemAdmin(admin.ModelAdmin):
             'fields': ('category', 'name', 'description', 'price', 'image')
         }),
         ('Status', {
-            'fields': ('is_sold',)
+            'fields': ('is_sold', 'stock_quantity')
         }),
         ('Metadata', {
-            'fields': ('created_by', 'created_at'),
+            'fields': ('external_id', 'created_by', 'created_at'),
             'classes': ('collapse',)
         }),
     )
@@ -67,26 +101,111 @@ class ItemAdmin(admin.ModelAdmin):
 
 @admin.register(ItemColor)
 class ItemColorAdmin(admin.ModelAdmin):
-    list_display = ('name', 'item', 'is_sold_out', 'images_count', 'created_at')
+    list_display = ('name', 'item', 'stock_quantity', 'is_sold_out', 'images_count', 'created_at')
+    list_select_related = ('item',)
     list_filter = ('is_sold_out', 'created_at', 'item__category')
     search_fields = ('name', 'item__name')
     readonly_fields = ('created_at',)
     inlines = [ItemColorImageInline]
+    change_form_template = 'admin/item/itemcolor/change_form.html'
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(images_total=Count('images', distinct=True))
     
     def images_count(self, obj):
-        return obj.images.count()
+        return obj.images_total
     images_count.short_description = 'Images'
+    images_count.admin_order_field = 'images_total'
+
+    def get_urls(self):
+        # Before the default URLs: '<path:object_id>/' would match these too.
+        return [
+            path('<path:object_id>/upload/', self.admin_site.admin_view(self.upload_chunk_view), name='item_itemcolor_upload'),
+            path(
+                '<path:object_id>/upload/finish/', self.admin_site.admin_view(self.upload_finish_view),
+                name='item_itemcolor_upload_finish',
+            ),
+        ] + super().get_urls()
+
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        extra_context = {**(extra_context or {}), 'upload_chunk_size': uploads.CHUNK_SIZE}
+        return super().change_view(request, object_id, form_url, extra_context)
+
+    def get_upload_color(self, request, object_id):
+        color = self.get_object(request, unquote(object_id))
+        if color is None:
+            raise Http404('Color not found')
+        if not self.has_change_permission(request, color):
+            raise PermissionDenied
+        return color
+
+    @method_decorator(require_http_methods(['GET', 'POST']))
+    def upload_chunk_view(self, request, object_id):
+        """
+        GET returns the offset an upload continues at; POST appends the
+        request body at ``offset`` and returns the new one.
+        """
+        self.get_upload_color(request, object_id)
+        try:
+            part = uploads.part_path(request.user.pk, request.GET.get('upload'))
+        except uploads.UploadError as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+        if request.method == 'POST':
+            try:
+                offset = int(request.GET['offset'])
+                length = int(request.headers['Content-Length'])
+            except (KeyError, ValueError):
+                return JsonResponse({'error': 'Invalid offset or length'}, status=400)
+            try:
+                return JsonResponse({'offset': uploads.append_chunk(part, offset, request, length)})
+            except uploads.OffsetMismatch as exc:
+                # The client resumes from the stored offset.
+                return JsonResponse({'error': str(exc), 'offset': exc.offset}, status=409)
+            except uploads.UploadError as exc:
+                return JsonResponse({'error': str(exc)}, status=413)
+        return JsonResponse({'offset': uploads.received(part)})
+
+    @method_decorator(require_POST)
+    def upload_finish_view(self, request, object_id):
+        """Store the uploaded files and add them to the color; reports every file."""
+        color = self.get_upload_color(request, object_id)
+        try:
+            files = [
+                (str(upload['name']), uploads.part_path(request.user.pk, upload['upload']))
+                for upload in json.loads(request.body)['files']
+            ]
+        except (KeyError, TypeError, ValueError, uploads.UploadError):
+            return JsonResponse({'error': 'Invalid request'}, status=400)
+        try:
+            results = uploads.upload_color_images(color, files)
+        finally:
+            for _, part in files:
+                if os.path.exists(part):
+                    os.remove(part)
+        return JsonResponse({
+            'files': [result._asdict() for result in results],
+            'created': sum(1 for result in results if result.image),
+        })
 
 @admin.register(ItemColorImage)
 class ItemColorImageAdmin(admin.ModelAdmin):
     list_display = ('color', 'image_preview', 'created_at')
+    list_select_related = ('color__item',)
     list_filter = ('created_at', 'color__item__category')
     search_fields = ('color__name', 'color__item__name')
     readonly_fields = ('created_at', 'image_preview')
     
+    def get_queryset(self, request):
+        return with_thumbnails(super().get_queryset(request))
+    
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'color':
+            kwargs['queryset'] = ItemColor.objects.select_related('item')
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+    
     def image_preview(self, obj):
         if obj.image:
-            return format_html('<img src="{}" style="max-height: 100px; max-width: 100px;" />', obj.image.url)
+            return format_html('<img src="{}" style="max-height: 100px; max-width: 100px;" />', thumbnail_url(obj))
         return 'No image'
     image_preview.short_description = 'Preview'
 
@@ -95,20 +214,26 @@ class CityAdmin(admin.ModelAdmin):
     list_display = ('name', 'places_count')
     search_fields = ('name',)
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(places_total=Count('places'))
+    
     def places_count(self, obj):
-        return obj.places.count()
+        return obj.places_total
     places_count.short_description = 'Number of Places'
+    places_count.admin_order_field = 'places_total'
 
 @admin.register(Place)
 class PlaceAdmin(admin.ModelAdmin):
     list_display = ('name', 'city')
+    list_select_related = ('city',)
     list_filter = ('city',)
     search_fields = ('name', 'city__name')
 
 @admin.register(ItemRequest)
 class ItemRequestAdmin(admin.ModelAdmin):
     list_display = ('customer_name', 'customer_phone', 'item', 'color', 'item_price', 'delivery_location', 'created_at', 'is_contacted')
-    list_filter = ('is_contacted', 'created_at', 'item__category', 'city', 'color')
+    list_select_related = ('item', 'color__item', 'city', 'place')
+    list_filter = ('is_contacted', 'created_at', 'item__category', 'city', ('color', ColorListFilter))
     search_fields = ('customer_name', 'customer_phone', 'item__name', 'color__name', 'city__name', 'place__name')
     readonly_fields = ('created_at',)
     date_hierarchy = 'created_at'
@@ -129,9 +254,18 @@ class ItemRequestAdmin(admin.ModelAdmin):
         }),
     )
     
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        # Color and place labels include their parent's name
+        if db_field.name == 'color':
+            kwargs['queryset'] = ItemColor.objects.select_related('item')
+        elif db_field.name == 'place':
+            kwargs['queryset'] = Place.objects.select_related('city')
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+    
     def item_price(self, obj):
         return f"{obj.item.price} SYP"
     item_price.short_description = 'Item Price'
+    item_price.admin_order_field = 'item__price'
     
     def delivery_location(self, obj):
         if obj.city and obj.place:
@@ -140,8 +274,9 @@ class ItemRequestAdmin(admin.ModelAdmin):
             return obj.city.name
         return '-'
     delivery_location.short_description = 'Delivery Location'
+    delivery_location.admin_order_field = 'city__name'
     
-    actions = ['mark_as_contacted', 'mark_as_not_contacted']
+    actions = ['mark_as_contacted', 'mark_as_not_contacted', 'export_csv', 'export_jsonl']
     
     def mark_as_contacted(self, request, queryset):
         queryset.update(is_contacted=True)
@@ -151,4 +286,19 @@ class ItemRequestAdmin(admin.ModelAdmin):
     def mark_as_not_contacted(self, request, queryset):
         queryset.update(is_contacted=False)
         self.message_user(request, f'{queryset.count()} requests marked as not contacted.')
-    mark_as_not_contacted.short_description = 'Mark selected as not contacted'
\ No newline at end of file
+    mark_as_not_contacted.short_description = 'Mark selected as not contacted'
+    
+    def export(self, queryset, file_format):
+        rows, content_type = FORMATS[file_format]
+        response = StreamingHttpResponse(rows(queryset), content_type=content_type)
+        filename = f"requests-{timezone.now():%Y%m%d-%H%M%S}.{file_format}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    
+    def export_csv(self, request, queryset):
+        return self.export(queryset, 'csv')
+    export_csv.short_description = 'Export selected as CSV'
+    
+    def export_jsonl(self, request, queryset):
+        return self.export(queryset, 'jsonl')
+    export_jsonl.short_description = 'Export selected as JSONL'
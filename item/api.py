@@ -0,0 +1,240 @@
+"""
+Read-only JSON API of the catalog for the mobile front-end.
+
+- ``api/categories/``: categories with their live item counts.
+- ``api/items/``: unsold items, with the ``query``, facet filters
+  (item.facets), ``sort``, ``cursor`` and ``page_size`` parameters of the
+  catalog pages.
+- ``api/items/<pk>/``: one item with its colors and gallery images.
+
+``fields=id,name,price`` limits the keys of each item (``id`` is always
+included); list calls leave the description out unless asked. Rows are read
+with ``values()``, never as model instances. Responses carry an ETag derived
+from the catalog version, so unchanged resources revalidate with a 304, and
+are gzip or, when the optional ``brotli`` package is installed, brotli
+compressed for clients that accept it.
+"""
+import hashlib
+from functools import wraps
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_safe
+
+from ghandyStore.storage import blob_storage
+
+from . import counters, refdata
+from .caching import get_catalog_version
+from .facets import filter_queryset, get_filters
+from .gallery import get_manifest
+from .images import VARIANTS, get_variants_many
+from .models import Item
+from .pagination import SORT_ORDERS, get_sort, paginate
+from .search import search
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# API field -> values() field
+ITEM_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'price': 'price',
+    'category': 'category_id',
+    'description': 'description',
+    'image': 'image',
+    'available_colors': 'available_colors_count',
+    'images_count': 'images_count',
+    'created_at': 'created_at',
+}
+LIST_FIELDS = ('id', 'name', 'price', 'category', 'image', 'available_colors')
+# Detail only, read from the gallery manifest
+GALLERY_FIELDS = ('colors', 'images')
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+
+# Bodies smaller than this are sent as they are.
+MIN_COMPRESS_SIZE = 200
+BROTLI_QUALITY = 5
+
+
+class FieldsError(ValueError):
+    pass
+
+
+def error(message, status=400):
+    return JsonResponse({'error': message}, status=status)
+
+
+def json_response(data):
+    return JsonResponse(data, encoder=DjangoJSONEncoder, json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+
+
+def get_fields(value, allowed, default):
+    if not value:
+        return default
+    fields = ['id'] + [field.strip() for field in value.split(',') if field.strip() and field.strip() != 'id']
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise FieldsError(f"Unknown fields: {', '.join(unknown)}")
+    return tuple(dict.fromkeys(fields))
+
+
+def _accepted_encoding(request):
+    accepted = {}
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    if brotli is not None and accepted.get('br', 0) > 0:
+        return 'br'
+    if accepted.get('gzip', 0) > 0:
+        return 'gzip'
+    return None
+
+
+def compress(view):
+    """Compress the JSON body with the best encoding the client accepts."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if response.status_code != 200 or response.has_header('Content-Encoding') or len(response.content) < MIN_COMPRESS_SIZE:
+            return response
+        encoding = _accepted_encoding(request)
+        if encoding == 'br':
+            content = brotli.compress(response.content, quality=BROTLI_QUALITY)
+        elif encoding == 'gzip':
+            content = compress_string(response.content)
+        else:
+            return response
+        if len(content) >= len(response.content):
+            return response
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        response['Content-Encoding'] = encoding
+        # The body is no longer byte-identical across encodings.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
+    return wrapper
+
+
+def _catalog_etag(request, *args, **kwargs):
+    return hashlib.md5(f'{get_catalog_version()}:{request.get_full_path()}'.encode()).hexdigest()
+
+
+def api_view(view):
+    """GET/HEAD only, revalidated on every use against the catalog version ETag."""
+    return require_safe(cache_control(no_cache=True)(compress(condition(etag_func=_catalog_etag)(view))))
+
+
+def _image(name, variants):
+    if not name:
+        return None
+    found = variants.get(name, {})
+    image = {variant: found[variant][0] for variant in VARIANTS if variant in found}
+    image['original'] = blob_storage().url(name)
+    return image
+
+
+def serialize(rows, fields):
+    variants = get_variants_many(row['image'] for row in rows) if 'image' in fields else {}
+    results = []
+    for row in rows:
+        data = {}
+        for field in fields:
+            if field == 'image':
+                data[field] = _image(row['image'], variants)
+            elif field in ITEM_FIELDS:
+                data[field] = row[ITEM_FIELDS[field]]
+        results.append(data)
+    return results
+
+
+@api_view
+def categories(request):
+    return json_response({
+        'results': [
+            {'id': category.id, 'name': category.name, 'items_count': category.items_count}
+            for category in counters.with_items_count(refdata.categories())
+        ],
+    })
+
+
+@api_view
+def items(request):
+    try:
+        fields = get_fields(request.GET.get('fields'), ITEM_FIELDS, LIST_FIELDS)
+    except FieldsError as exc:
+        return error(str(exc))
+    try:
+        page_size = min(max(int(request.GET.get('page_size', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return error('page_size must be a number')
+
+    query = request.GET.get('query', '')
+    queryset = filter_queryset(Item.objects.filter(is_sold=False), get_filters(request.GET))
+    if query:
+        queryset = search(queryset, query)
+    sort = get_sort(request.GET.get('sort'), allow_relevance=bool(query))
+
+    # The sort keys are read too, to build the next cursor.
+    columns = dict.fromkeys([ITEM_FIELDS[field] for field in fields] + [name for name, _desc in SORT_ORDERS[sort]])
+    page = paginate(queryset.values(*columns), sort=sort, cursor=request.GET.get('cursor'), page_size=page_size)
+
+    next_url = None
+    if page.has_next:
+        params = request.GET.copy()
+        params['cursor'] = page.next_cursor
+        params['sort'] = page.sort
+        next_url = f"{reverse('item:api_items')}?{params.urlencode()}"
+
+    return json_response({
+        'results': serialize(page.items, fields),
+        'sort': page.sort,
+        'next': next_url,
+    })
+
+
+@api_view
+def item(request, pk):
+    try:
+        fields = get_fields(request.GET.get('fields'), (*ITEM_FIELDS, *GALLERY_FIELDS), (*ITEM_FIELDS, *GALLERY_FIELDS))
+    except FieldsError as exc:
+        return error(str(exc))
+
+    columns = dict.fromkeys([ITEM_FIELDS[field] for field in fields if field in ITEM_FIELDS] + ['id', 'name', 'image'])
+    row = Item.objects.filter(pk=pk).values(*columns).first()
+    if row is None:
+        return error('Not found', status=404)
+
+    data = serialize([row], fields)[0]
+    if any(field in fields for field in GALLERY_FIELDS):
+        # The manifest is cached; the instance is only built, never loaded.
+        manifest = get_manifest(Item(id=row['id'], name=row['name'], image=row['image']))
+        if 'colors' in fields:
+            data['colors'] = [
+                {'id': color['id'], 'name': color['name'], 'is_sold_out': color['is_sold_out']}
+                for color in manifest['colors']
+            ]
+        if 'images' in fields:
+            variants = get_variants_many(image['name'] for image in manifest['images'])
+            data['images'] = [
+                dict(_image(image['name'], variants), type=image['type'], color_id=image['color_id'])
+                for image in manifest['images']
+            ]
+    return json_response(data)
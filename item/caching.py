@@ -0,0 +1,156 @@
+import hashlib
+import time
+from functools import partial, wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control
+
+from ghandyStore.db.router import hold_replicas
+
+CATALOG_VERSION_KEY = 'item:catalog:version'
+
+# Pages are fresh for PAGE_CACHE_TIMEOUT seconds and may then be served
+# stale for PAGE_CACHE_STALE more seconds while a single request renders
+# the replacement. Catalog edits bump the catalog version, which changes
+# every page key: a page of an earlier version is never served, requests
+# arriving while the first one renders the new page render it too.
+PAGE_CACHE_TIMEOUT = getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 5)
+PAGE_CACHE_STALE = getattr(settings, 'PAGE_CACHE_STALE', 60 * 60)
+# Lifetime of pages marked public for shared caches and front proxies.
+SHARED_CACHE_MAX_AGE = getattr(settings, 'SHARED_CACHE_MAX_AGE', 60)
+
+# Seconds a request rendering a page holds its lock at most.
+PAGE_CACHE_LOCK_TIMEOUT = 10
+
+
+def get_version(key):
+    """Current value of the version counter ``key``, started when missing."""
+    version = cache.get(key)
+    if version is None:
+        # A clock based start value never reuses the generation of a
+        # version key that was evicted.
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def bump_version(key):
+    """
+    Bump the version counter ``key`` right away and again once the
+    transaction commits, so anything computed from the pre-commit data in
+    between is never used under the new version.
+    """
+    _incr(key)
+    transaction.on_commit(partial(_incr, key))
+
+
+def get_catalog_version():
+    return get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    """Invalidate every cached catalog page (see ``bump_version``)."""
+    bump_version(CATALOG_VERSION_KEY)
+    # Pages for the new version are not rendered from a lagging replica.
+    hold_replicas()
+    transaction.on_commit(hold_replicas)
+
+
+def page_digest(request, params=None):
+    if params is None:
+        params = sorted(request.GET.lists())
+    else:
+        params = [(name, request.GET.getlist(name)) for name in params]
+    return hashlib.md5(f'{request.path}?{params}'.encode()).hexdigest()
+
+
+def page_cache_key(version, digest):
+    return f'item:page:{version}:{digest}'
+
+
+def _cacheable(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    # Without a session cookie the visitor is anonymous; checking the cookie
+    # instead of request.user leaves the session untouched, so the response
+    # does not get Vary: Cookie.
+    return settings.SESSION_COOKIE_NAME not in request.COOKIES or not request.user.is_authenticated
+
+
+def _render(view, request, args, kwargs, version, digest):
+    response = view(request, *args, **kwargs)
+    if response.status_code == 200 and not response.streaming and not response.cookies:
+        entry = {
+            'created': time.time(),
+            'content': response.content,
+            'content_type': response['Content-Type'],
+        }
+        cache.set(page_cache_key(version, digest), entry, PAGE_CACHE_TIMEOUT + PAGE_CACHE_STALE)
+    return response
+
+
+def _from_entry(entry):
+    response = HttpResponse(entry['content'], content_type=entry['content_type'])
+    response['X-Page-Cache'] = 'hit'
+    return response
+
+
+def cache_catalog_page(view=None, params=None, shared=False):
+    """
+    Cache the full response of a catalog view for anonymous visitors,
+    keyed on the URL, the query parameters (only ``params`` when given) and
+    the catalog version. ``shared`` also marks those responses public for
+    SHARED_CACHE_MAX_AGE seconds, for views whose HTML is the same for
+    every visitor.
+    """
+    if view is None:
+        return partial(cache_catalog_page, params=params, shared=shared)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not _cacheable(request):
+            return view(request, *args, **kwargs)
+        response = cached(request, *args, **kwargs)
+        if shared and response.status_code == 200 and not response.cookies:
+            patch_cache_control(response, public=True, max_age=SHARED_CACHE_MAX_AGE)
+        return response
+
+    def cached(request, *args, **kwargs):
+        version = get_catalog_version()
+        digest = page_digest(request, params)
+        key = page_cache_key(version, digest)
+        lock_key = f'{key}:lock'
+        entry = cache.get(key)
+
+        if entry is not None:
+            if time.time() - entry['created'] > PAGE_CACHE_TIMEOUT and cache.add(lock_key, 1, PAGE_CACHE_LOCK_TIMEOUT):
+                # Stale: this request refreshes the page, the others keep
+                # getting the stale copy until it is replaced.
+                try:
+                    return _render(view, request, args, kwargs, version, digest)
+                finally:
+                    cache.delete(lock_key)
+            return _from_entry(entry)
+
+        if not cache.add(lock_key, 1, PAGE_CACHE_LOCK_TIMEOUT):
+            # Another request is rendering the page for this version; this
+            # one renders it too rather than wait, and leaves caching it to
+            # the lock holder.
+            return view(request, *args, **kwargs)
+
+        try:
+            return _render(view, request, args, kwargs, version, digest)
+        finally:
+            cache.delete(lock_key)
+
+    return wrapper
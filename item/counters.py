@@ -0,0 +1,102 @@
+"""
+Denormalized counters read by the listing and detail pages:
+
+- ``Item.available_colors_count``: colors that are not sold out.
+- ``Item.images_count``: images of all the item's colors.
+- ``Category.items_count``: unsold items.
+
+The signals in item.signals keep them current with F() updates inside the
+saving transaction. Bulk writes (``bulk_create``, ``update()``, fixtures)
+bypass the signals and call ``recount()`` instead, which is also what the
+``recount`` command runs to repair drift.
+
+Category counts change with every item sale, so they are read with the
+categories of item.refdata (``with_items_count``) instead of being part of
+that rarely reloaded cache.
+"""
+from collections import namedtuple
+
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from base.utils import stored_values
+
+from .models import Category, Item
+
+CategoryCount = namedtuple('CategoryCount', 'id name items_count')
+
+# Field values whose change moves a counter, per model.
+TRACKED_FIELDS = {
+    'Item': ('category_id', 'is_sold'),
+    'ItemColor': ('item_id', 'is_sold_out'),
+    'ItemColorImage': ('color_id',),
+}
+
+
+def previous_state(instance):
+    """Stored values of the tracked fields of ``instance``, None for new rows."""
+    return stored_values(instance, TRACKED_FIELDS[type(instance).__name__])
+
+
+def _add(queryset, field, delta):
+    if delta > 0:
+        queryset.update(**{field: F(field) + delta})
+    elif delta < 0:
+        # Never below zero, even if the counter drifted.
+        queryset.filter(**{f'{field}__gte': -delta}).update(**{field: F(field) + delta})
+
+
+def add_available_colors(item_id, delta):
+    _add(Item.objects.filter(pk=item_id), 'available_colors_count', delta)
+
+
+def add_images(color_id, delta):
+    _add(Item.objects.filter(colors=color_id), 'images_count', delta)
+
+
+def add_images_to_item(item_id, delta):
+    _add(Item.objects.filter(pk=item_id), 'images_count', delta)
+
+
+def add_items(category_id, delta):
+    _add(Category.objects.filter(pk=category_id), 'items_count', delta)
+
+
+def with_items_count(categories):
+    """The refdata ``categories`` with their current item counts, in one query."""
+    counts = dict(Category.objects.values_list('id', 'items_count'))
+    return [CategoryCount(category.id, category.name, counts.get(category.id, 0)) for category in categories]
+
+
+def _count(model, group, **filters):
+    return Coalesce(
+        Subquery(
+            model._default_manager.filter(**filters).order_by()
+            .values(group).annotate(total=Count('pk')).values('total')
+        ),
+        Value(0),
+    )
+
+
+def recount_items(queryset):
+    """Recompute the counters of the items in ``queryset`` in one UPDATE."""
+    # Models are taken from the queryset so migrations can pass historical ones.
+    color_model = queryset.model._meta.get_field('colors').related_model
+    image_model = color_model._meta.get_field('images').related_model
+    return queryset.update(
+        available_colors_count=_count(color_model, 'item', item=OuterRef('pk'), is_sold_out=False),
+        images_count=_count(image_model, 'color__item', color__item=OuterRef('pk')),
+    )
+
+
+def recount_categories(queryset):
+    item_model = queryset.model._meta.get_field('items').related_model
+    return queryset.update(items_count=_count(item_model, 'category', category=OuterRef('pk'), is_sold=False))
+
+
+def recount(items=None):
+    """
+    Recompute the item counters (of ``items``, default all) and every
+    category count. Returns (items, categories) updated.
+    """
+    return recount_items(Item.objects.all() if items is None else items), recount_categories(Category.objects.all())
@@ -0,0 +1,108 @@
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from .models import ItemRequest
+
+EXPORT_FIELDS = (
+    'id', 'created_at', 'customer_name', 'customer_phone', 'item', 'item_price',
+    'color', 'city', 'place', 'is_contacted',
+)
+
+
+def _start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def filter_requests(queryset=None, date_from=None, date_to=None, is_contacted=None, city=None):
+    """
+    Apply the export filters. ``date_from``/``date_to`` are inclusive dates
+    of the current time zone, compared as a created_at range the index can
+    serve rather than with ``__date``.
+    """
+    if queryset is None:
+        queryset = ItemRequest.objects.all()
+    if date_from:
+        queryset = queryset.filter(created_at__gte=_start_of_day(date_from))
+    if date_to:
+        queryset = queryset.filter(created_at__lt=_start_of_day(date_to + timedelta(days=1)))
+    if is_contacted is not None:
+        queryset = queryset.filter(is_contacted=is_contacted)
+    if city:
+        queryset = queryset.filter(city__name=city) if not str(city).isdigit() else queryset.filter(city_id=city)
+    return queryset
+
+
+def iter_requests(queryset, chunk_size=2000):
+    """
+    Yield the requests of ``queryset`` in primary key order, one keyset
+    chunk at a time. Each chunk is its own short query in autocommit mode,
+    so memory stays flat and no transaction or snapshot is held open while
+    the consumer (a slow HTTP client, a file) drains the rows; order intake
+    keeps writing in the meantime.
+    """
+    queryset = queryset.select_related('item', 'color', 'city', 'place').order_by('pk')
+    last_pk = 0
+    while True:
+        count = 0
+        for request in queryset.filter(pk__gt=last_pk)[:chunk_size].iterator(chunk_size=chunk_size):
+            count += 1
+            last_pk = request.pk
+            yield request
+        if count < chunk_size:
+            return
+
+
+def to_row(request):
+    return {
+        'id': request.pk,
+        'created_at': request.created_at.isoformat(),
+        'customer_name': request.customer_name,
+        'customer_phone': request.customer_phone,
+        'item': request.item.name,
+        'item_price': request.item.price,
+        'color': request.color.name if request.color else '',
+        'city': request.city.name if request.city else '',
+        'place': request.place.name if request.place else '',
+        'is_contacted': request.is_contacted,
+    }
+
+
+# Spreadsheets run cells starting with these as formulas; customers type
+# the names and phone numbers.
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def csv_cell(value):
+    """Quote ``value`` with a leading ' when a spreadsheet would run it as a formula."""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return f"'{value}"
+    return value
+
+
+class Echo:
+    """File-like object whose write() returns the written value, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(queryset, chunk_size=2000):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for request in iter_requests(queryset, chunk_size):
+        row = to_row(request)
+        yield writer.writerow([csv_cell(row[field]) for field in EXPORT_FIELDS])
+
+
+def iter_jsonl(queryset, chunk_size=2000):
+    for request in iter_requests(queryset, chunk_size):
+        yield json.dumps(to_row(request), ensure_ascii=False) + '\n'
+
+
+FORMATS = {
+    'csv': (iter_csv, 'text/csv; charset=utf-8'),
+    'jsonl': (iter_jsonl, 'application/x-ndjson; charset=utf-8'),
+}
@@ -0,0 +1,278 @@
+"""
+Faceted filtering of the catalog: category, price range, available color
+and "has photos", with the number of items behind each option.
+
+Counts come from an in-memory bitmap index of the unsold items, built with
+two queries once per facets version and worker: each item gets a bit
+position, and every facet option is an int whose bits mark its items, so a
+count is ``(option & selection).bit_count()``. Counts of one facet apply
+the filters of the *other* facets, so choosing a category still shows how
+many items the other categories have.
+
+The facets version is bumped by the edits that can change a facet (see
+``FACET_FIELDS`` and item.signals), not by every catalog edit, so new
+photo variants or description changes leave the index alone. A worker
+keeps answering from its previous index while one thread rebuilds it.
+
+Counts for the unfiltered and single-filter states are also kept in the
+shared cache under the facets version, so most requests never need the
+index at all.
+"""
+import hashlib
+import threading
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Q
+
+from base.utils import stored_values
+
+from . import refdata
+from .caching import bump_version, get_version
+from .models import Item, ItemColor
+
+# (key, label, low, high): low <= price < high, None for open ends.
+PRICE_RANGES = (
+    ('0-25', 'Under 25', None, 25),
+    ('25-50', '25 to 50', 25, 50),
+    ('50-100', '50 to 100', 50, 100),
+    ('100-250', '100 to 250', 100, 250),
+    ('250-', '250 and above', 250, None),
+)
+PRICE_LABELS = {key: label for key, label, _low, _high in PRICE_RANGES}
+
+MAX_COLOR_OPTIONS = 20
+FACETS_CACHE_TIMEOUT = 60 * 60
+FACETS_VERSION_KEY = 'item:facets:version'
+
+# Item fields whose change can move the item between facet options.
+FACET_FIELDS = ('category_id', 'price', 'is_sold', 'image')
+
+Filters = namedtuple('Filters', 'category price color photos')
+Facet = namedtuple('Facet', 'name label options')
+Option = namedtuple('Option', 'value label count selected url')
+
+FacetIndex = namedtuple('FacetIndex', 'version positions all category price color photos')
+
+_lock = threading.Lock()
+_index = None
+
+
+def get_facets_version():
+    return get_version(FACETS_VERSION_KEY)
+
+
+def bump_facets_version():
+    """Rebuild the facet index and counts on their next use."""
+    bump_version(FACETS_VERSION_KEY)
+
+
+def facet_state(item):
+    """Stored values of the FACET_FIELDS of ``item``, None for new rows."""
+    return stored_values(item, FACET_FIELDS)
+
+
+def facets_changed(item, previous):
+    """Whether saving ``item`` over the ``previous`` facet_state moved it."""
+    # FieldFile compares equal to its name.
+    return previous is None or tuple(getattr(item, field) for field in FACET_FIELDS) != previous
+
+
+def get_filters(params, category_id=None):
+    """Read and validate the facet filters from GET ``params``."""
+    category = category_id if category_id is not None else params.get('category')
+    try:
+        category = int(category) or None
+    except (TypeError, ValueError):
+        category = None
+    price = params.get('price')
+    if price not in PRICE_LABELS:
+        price = None
+    color = (params.get('color') or '').strip()[:100] or None
+    photos = params.get('photos') == '1'
+    return Filters(category, price, color, photos)
+
+
+def filter_queryset(queryset, filters):
+    """Apply ``filters`` to an Item queryset."""
+    if filters.category:
+        queryset = queryset.filter(category_id=filters.category)
+    if filters.price:
+        _key, _label, low, high = next(r for r in PRICE_RANGES if r[0] == filters.price)
+        if low is not None:
+            queryset = queryset.filter(price__gte=low)
+        if high is not None:
+            queryset = queryset.filter(price__lt=high)
+    if filters.color:
+        queryset = queryset.filter(Exists(ItemColor.objects.filter(
+            item=OuterRef('pk'), name=filters.color, is_sold_out=False,
+        )))
+    if filters.photos:
+        queryset = queryset.filter((Q(image__isnull=False) & ~Q(image='')) | Q(images_count__gt=0))
+    return queryset
+
+
+def _price_key(price):
+    for key, _label, low, high in PRICE_RANGES:
+        if (low is None or price >= low) and (high is None or price < high):
+            return key
+    return None
+
+
+def _mask(positions, size):
+    """Int with the bits at ``positions`` set, built in one pass."""
+    bits = bytearray((size + 7) // 8)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def _load(version):
+    positions = {}
+    category, price, color = {}, {}, {}
+    photos = []
+    rows = Item.objects.filter(is_sold=False).order_by('id').values_list('id', 'category_id', 'price', 'image', 'images_count')
+    for position, (item_id, category_id, item_price, image, images_count) in enumerate(rows.iterator(chunk_size=2000)):
+        positions[item_id] = position
+        category.setdefault(category_id, []).append(position)
+        price.setdefault(_price_key(item_price), []).append(position)
+        if image or images_count:
+            photos.append(position)
+    colors = ItemColor.objects.filter(item__is_sold=False, is_sold_out=False).values_list('item_id', 'name')
+    for item_id, name in colors.iterator(chunk_size=2000):
+        if item_id in positions:
+            color.setdefault(name, []).append(positions[item_id])
+
+    size = len(positions)
+    return FacetIndex(
+        version,
+        positions,
+        (1 << size) - 1,
+        {key: _mask(members, size) for key, members in category.items()},
+        {key: _mask(members, size) for key, members in price.items()},
+        {key: _mask(members, size) for key, members in color.items()},
+        _mask(photos, size),
+    )
+
+
+def get_index(version=None):
+    global _index
+    if version is None:
+        version = get_facets_version()
+    index = _index
+    if index is not None and index.version == version:
+        return index
+    # Other threads keep using the previous index while one rebuilds it.
+    if not _lock.acquire(blocking=index is None):
+        return index
+    try:
+        if _index is None or _index.version != version:
+            _index = _load(version)
+        return _index
+    finally:
+        _lock.release()
+
+
+def ids_mask(index, ids):
+    """Mask of the items in ``ids``, any iterable of item ids."""
+    positions = index.positions
+    return _mask((positions[item_id] for item_id in ids if item_id in positions), len(positions))
+
+
+def _selection(index, filters, skip):
+    mask = index.all
+    if filters.category and skip != 'category':
+        mask &= index.category.get(filters.category, 0)
+    if filters.price and skip != 'price':
+        mask &= index.price.get(filters.price, 0)
+    if filters.color and skip != 'color':
+        mask &= index.color.get(filters.color, 0)
+    if filters.photos and skip != 'photos':
+        mask &= index.photos
+    return mask
+
+
+def compute_counts(index, filters, within=None):
+    """
+    Return ``{'category': {id: n}, 'price': {key: n}, 'color': {name: n},
+    'photos': n}`` for ``filters``, restricted to the ``within`` mask (the
+    items matching a text query) when given.
+    """
+    base = index.all if within is None else within
+
+    def count(option, skip):
+        return (option & base & _selection(index, filters, skip)).bit_count()
+
+    return {
+        'category': {key: count(mask, 'category') for key, mask in index.category.items()},
+        'price': {key: count(mask, 'price') for key, mask in index.price.items() if key},
+        'color': {key: count(mask, 'color') for key, mask in index.color.items()},
+        'photos': count(index.photos, 'photos'),
+    }
+
+
+def _counts_key(version, filters):
+    return f'item:facets:{version}:{hashlib.md5(repr(tuple(filters)).encode()).hexdigest()}'
+
+
+def get_counts(filters, query_ids=None):
+    """
+    Facet counts for ``filters`` and, with a text query, the ids of the
+    items matching it (an iterable, consumed once). Unfiltered and
+    single-filter states are cached.
+    """
+    version = get_facets_version()
+    cacheable = query_ids is None and sum(bool(value) for value in filters) <= 1
+    if cacheable:
+        counts = cache.get(_counts_key(version, filters))
+        if counts is not None:
+            return counts
+    index = get_index(version)
+    within = None if query_ids is None else ids_mask(index, query_ids)
+    counts = compute_counts(index, filters, within)
+    if cacheable:
+        # Under the version of the index, which is older while it is rebuilt.
+        cache.set(_counts_key(index.version, filters), counts, FACETS_CACHE_TIMEOUT)
+    return counts
+
+
+def _url(params, name, value):
+    params = params.copy()
+    params.pop('cursor', None)
+    if value is None:
+        params.pop(name, None)
+    else:
+        params[name] = value
+    return f'?{params.urlencode()}'
+
+
+def build_facets(params, filters, counts):
+    """Facets with their options, counts and toggle links for the templates."""
+    def option(name, value, label, count, selected):
+        return Option(value, label, count, selected, _url(params, name, None if selected else value))
+
+    categories = [
+        option('category', category.id, category.name, counts['category'].get(category.id, 0), category.id == filters.category)
+        for category in refdata.categories()
+    ]
+    prices = [
+        option('price', key, label, counts['price'].get(key, 0), key == filters.price)
+        for key, label, _low, _high in PRICE_RANGES
+    ]
+    top_colors = sorted(counts['color'].items(), key=lambda pair: (-pair[1], pair[0]))[:MAX_COLOR_OPTIONS]
+    if filters.color and filters.color not in dict(top_colors):
+        top_colors.append((filters.color, counts['color'].get(filters.color, 0)))
+    colors = [option('color', name, name, count, name == filters.color) for name, count in top_colors]
+    photos = [option('photos', '1', 'With photos', counts['photos'], filters.photos)]
+
+    facets = [
+        Facet('category', 'Categories', categories),
+        Facet('price', 'Price', prices),
+        Facet('color', 'Available colors', colors),
+        Facet('photos', 'Photos', photos),
+    ]
+    # Options without items are hidden unless they are the current choice.
+    return [
+        Facet(facet.name, facet.label, [o for o in facet.options if o.count or o.selected])
+        for facet in facets
+    ]
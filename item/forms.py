@@ -1,5 +1,6 @@
 from django import forms
 
+from . import refdata
 from .models import Item, ItemRequest, City, Place, ItemColor
 
 INPUT_CLASSES = 'w-full py-4 px-6 rounded-xl border'
@@ -82,6 +83,8 @@ class ItemRequestForm(forms.ModelForm):
     
     def __init__(self, *args, **kwargs):
         self.item = kwargs.pop('item', None)
+        # Colors of the item's gallery manifest (item.gallery), if loaded
+        colors = kwargs.pop('colors', None)
         super().__init__(*args, **kwargs)
         
         # Set color queryset based on item
@@ -89,8 +92,14 @@ class ItemRequestForm(forms.ModelForm):
             self.fields['color'].queryset = ItemColor.objects.filter(
                 item=self.item, 
                 is_sold_out=False
-            ).order_by('name')
-            if self.fields['color'].queryset.exists():
+            ).select_related('item').order_by('name')
+            if colors is not None:
+                # Like cities below, the options come from the cache.
+                self.fields['color'].choices = [('', '---------')] + [
+                    (color['id'], f"{self.item.name} - {color['name']}")
+                    for color in colors if not color['is_sold_out']
+                ]
+            if self.item.available_colors_count:
                 self.fields['color'].required = True
             else:
                 self.fields['color'].required = False
@@ -99,20 +108,28 @@ class ItemRequestForm(forms.ModelForm):
             self.fields['color'].queryset = ItemColor.objects.none()
             self.fields['color'].required = False
         
+        # City and place options come from the reference data cache; the
+        # querysets are only hit to look up the submitted values.
         self.fields['city'].required = True
         self.fields['place'].required = True
-        self.fields['city'].queryset = City.objects.all().order_by('name')
+        self.fields['city'].queryset = City.objects.all()
+        self.fields['city'].choices = [('', '---------')] + [(city.id, city.name) for city in refdata.cities()]
         self.fields['place'].queryset = Place.objects.none()
+        self.fields['place'].choices = [('', '---------')]
         
+        city_id = None
         if 'city' in self.data:
             try:
                 city_id = int(self.data.get('city'))
-                self.fields['place'].queryset = Place.objects.filter(city_id=city_id).order_by('name')
             except (ValueError, TypeError):
                 pass
         elif self.instance.pk:
-            if self.instance.city:
-                self.fields['place'].queryset = self.instance.city.places.order_by('name')
+            city_id = self.instance.city_id
+        if city_id:
+            self.fields['place'].queryset = Place.objects.filter(city_id=city_id)
+            self.fields['place'].choices = [('', '---------')] + [
+                (place.id, place.name) for place in refdata.places_for_city(city_id)
+            ]
     
     def clean(self):
         cleaned_data = super().clean()
@@ -121,13 +138,13 @@ class ItemRequestForm(forms.ModelForm):
         color = cleaned_data.get('color')
         
         if city and place:
-            if place.city != city:
+            if place.city_id != city.id:
                 raise forms.ValidationError({
                     'place': 'Selected place does not belong to the selected city.'
                 })
         
         if color and self.item:
-            if color.item != self.item:
+            if color.item_id != self.item.id:
                 raise forms.ValidationError({
                     'color': 'Selected color does not belong to this item.'
                 })
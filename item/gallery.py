@@ -0,0 +1,99 @@
+from django.core.cache import cache
+
+from .models import ItemColor, ItemColorImage
+
+GALLERY_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def gallery_cache_key(item_id):
+    return f'item:gallery:{item_id}'
+
+
+def build_manifest(item):
+    """
+    Build the gallery manifest of an item: its colors, and its images in
+    display order (main image first, then each in-stock color's images in
+    color name order). Uses two ``values()`` queries and no model instances.
+    """
+    colors = list(
+        ItemColor.objects.filter(item_id=item.id)
+        .order_by('name')
+        .values('id', 'name', 'is_sold_out')
+    )
+    color_names = {color['id']: color['name'] for color in colors if not color['is_sold_out']}
+
+    images = []
+    if item.image:
+        images.append({
+            'name': item.image.name,
+            'url': item.image.url,
+            'type': 'main',
+            'color_id': None,
+            'color_name': None,
+            'alt': f"{item.name} - Main Image",
+        })
+
+    # values_list() gives names; their URLs come from the field's storage.
+    storage = ItemColorImage._meta.get_field('image').storage
+    color_images = (
+        ItemColorImage.objects.filter(color_id__in=color_names)
+        .order_by('color__name', 'created_at', 'id')
+        .values_list('color_id', 'image')
+    )
+    for color_id, image in color_images:
+        images.append({
+            'name': image,
+            'url': storage.url(image),
+            'type': 'color',
+            'color_id': color_id,
+            'color_name': color_names[color_id],
+            'alt': f"{item.name} - {color_names[color_id]}",
+        })
+
+    return {'colors': colors, 'images': images}
+
+
+def get_manifest(item):
+    key = gallery_cache_key(item.id)
+    manifest = cache.get(key)
+    if manifest is None:
+        manifest = build_manifest(item)
+        cache.set(key, manifest, GALLERY_CACHE_TIMEOUT)
+    return manifest
+
+
+def invalidate(item_id):
+    cache.delete(gallery_cache_key(item_id))
+
+
+def find_color(manifest, color_id):
+    """Return the manifest entry of ``color_id``, or None."""
+    try:
+        color_id = int(color_id)
+    except (TypeError, ValueError):
+        return None
+    for color in manifest['colors']:
+        if color['id'] == color_id:
+            return color
+    return None
+
+
+def order_images(manifest, selected_color=None):
+    """
+    Return the gallery images with the selected color's images first. The
+    main image is only kept when the selected color has no images of its
+    own. Runs in a single pass over the manifest.
+    """
+    images = manifest['images']
+    if not selected_color:
+        return list(images)
+
+    selected, others = [], []
+    for image in images:
+        if image['color_id'] == selected_color['id']:
+            selected.append(image)
+        else:
+            others.append(image)
+    if not selected:
+        return others
+    return selected + [image for image in others if image['type'] != 'main']
@@ -0,0 +1,155 @@
+import hashlib
+import logging
+import os
+from io import BytesIO
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from ghandyStore.storage import blob_storage
+
+from .models import ImageVariant
+
+logger = logging.getLogger(__name__)
+
+# Derivatives generated for every uploaded image. ``crop`` variants are
+# cut to the exact size, the others are scaled down to fit ``size``.
+VARIANTS = {
+    'thumb': {'size': (192, 192), 'crop': True},
+    'card': {'size': (480, 480), 'crop': False},
+    'full': {'size': (1200, 1200), 'crop': False},
+}
+
+VARIANT_DIR = 'variants'
+WEBP_QUALITY = 80
+VARIANTS_CACHE_TIMEOUT = 60 * 60 * 24
+# Images without variants yet are cached too (generate_variants deletes the
+# key), for less time in case a page read them just before the job's commit.
+VARIANTS_MISSING_TIMEOUT = 60
+
+
+def variants_cache_key(source):
+    return f'item:variants:{hashlib.md5(source.encode()).hexdigest()}'
+
+
+def variant_name(source, variant):
+    stem = os.path.splitext(source)[0]
+    return f'{VARIANT_DIR}/{stem}-{variant}.webp'
+
+
+def render_variant(image, size, crop):
+    if crop:
+        resized = ImageOps.fit(image, size, Image.LANCZOS)
+    else:
+        resized = image.copy()
+        resized.thumbnail(size, Image.LANCZOS)
+    buffer = BytesIO()
+    # No exif/icc data is passed to save(), so metadata is stripped.
+    resized.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+    return resized.size, buffer.getvalue()
+
+
+def generate_variants(source, force=False):
+    """
+    Generate and record all derivatives of the stored image ``source``.
+    Returns the number of variants written; failures are logged, never
+    raised, so a broken upload cannot break the save that triggered it.
+    """
+    if not source:
+        return 0
+    if not force and ImageVariant.objects.filter(source=source).count() == len(VARIANTS):
+        return 0
+
+    try:
+        # Sources are the image fields' blobs; the variants are plain files.
+        with blob_storage().open(source, 'rb') as fh:
+            image = Image.open(fh)
+            # Apply the EXIF orientation before the metadata is dropped.
+            image = ImageOps.exif_transpose(image)
+            image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    except (OSError, UnidentifiedImageError, ValueError, Image.DecompressionBombError) as exc:
+        logger.warning('Cannot generate variants for %s: %s', source, exc)
+        return 0
+
+    # Previous derivatives are removed first: the storage may add a content
+    # hash to the names, so new files do not simply overwrite them.
+    for name in ImageVariant.objects.filter(source=source).values_list('image', flat=True):
+        default_storage.delete(name)
+
+    rendered = []
+    for variant, spec in VARIANTS.items():
+        (width, height), data = render_variant(image, spec['size'], spec['crop'])
+        name = default_storage.save(variant_name(source, variant), ContentFile(data))
+        rendered.append(ImageVariant(
+            source=source, variant=variant, image=name, width=width, height=height,
+        ))
+
+    with transaction.atomic():
+        ImageVariant.objects.filter(source=source).delete()
+        ImageVariant.objects.bulk_create(rendered)
+    cache.delete(variants_cache_key(source))
+    return len(rendered)
+
+
+def _cache_timeout(variants):
+    return VARIANTS_CACHE_TIMEOUT if variants else VARIANTS_MISSING_TIMEOUT
+
+
+def get_variants(source):
+    """
+    Return ``{variant: (url, width, height)}`` for ``source``, cached
+    (empty while the variants job has not run yet).
+    """
+    if not source:
+        return {}
+    key = variants_cache_key(source)
+    variants = cache.get(key)
+    if variants is None:
+        variants = {
+            variant: (default_storage.url(name), width, height)
+            for variant, name, width, height in ImageVariant.objects
+            .filter(source=source)
+            .values_list('variant', 'image', 'width', 'height')
+        }
+        cache.set(key, variants, _cache_timeout(variants))
+    return variants
+
+
+def get_variants_many(sources):
+    """``get_variants`` for many sources: one cache round trip and at most one query."""
+    sources = {source for source in sources if source}
+    keys = {variants_cache_key(source): source for source in sources}
+    found = {keys[key]: variants for key, variants in cache.get_many(keys).items()}
+    missing = sources - found.keys()
+    if missing:
+        loaded = {source: {} for source in missing}
+        rows = ImageVariant.objects.filter(source__in=missing).values_list('source', 'variant', 'image', 'width', 'height')
+        for source, variant, name, width, height in rows:
+            loaded[source][variant] = (default_storage.url(name), width, height)
+        for found_any in (True, False):
+            entries = {variants_cache_key(source): variants for source, variants in loaded.items() if bool(variants) == found_any}
+            if entries:
+                cache.set_many(entries, _cache_timeout(found_any))
+        found.update(loaded)
+    return found
+
+
+def variant_url(source, variant, variants=None):
+    """
+    URL of one derivative, falling back to the original upload. ``variants``
+    are those of ``source`` when the caller already has them.
+    """
+    if not source:
+        return ''
+    found = (get_variants(source) if variants is None else variants).get(variant)
+    return found[0] if found else blob_storage().url(source)
+
+
+def with_thumbnails(queryset, field='image'):
+    """Annotate ``queryset`` with ``thumb_name``, the storage name of each row's thumbnail."""
+    thumbs = ImageVariant.objects.filter(source=OuterRef(field), variant='thumb').values('image')[:1]
+    return queryset.annotate(thumb_name=Subquery(thumbs))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from item.images import generate_variants
+from item.models import Item, ItemColorImage
+
+
+class Command(BaseCommand):
+    help = 'Generate thumbnail/card/full WebP variants for existing item images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate variants that already exist')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        sources = 0
+        written = 0
+        querysets = (
+            Item.objects.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True),
+            ItemColorImage.objects.exclude(image='').values_list('image', flat=True),
+        )
+        for queryset in querysets:
+            for source in queryset.iterator(chunk_size=500):
+                written += generate_variants(source, force=options['force'])
+                sources += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {sources} images, wrote {written} variants in {time.monotonic() - started:.2f}s'
+        ))
@@ -0,0 +1,111 @@
+import hashlib
+import os
+import time
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, CharField, F, Value, When
+
+from base import blobs
+from base.utils import batched
+from ghandyStore.storage import blob_digest, blob_name, blob_storage
+from item.caching import bump_catalog_version
+from item.images import variants_cache_key
+from item.models import ImageVariant
+
+UPDATE_BATCH = 500
+
+
+class Command(BaseCommand):
+    help = (
+        'Move the uploaded files referenced by the catalog into the content-addressed blob storage, '
+        'so identical files are stored once, and recount the blob references'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be moved and freed')
+        parser.add_argument('--keep', action='store_true', help='Keep the original files')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        storage = blob_storage()
+        fields = blobs.all_blob_fields()
+
+        names = set()
+        for model, field in fields:
+            rows = model._base_manager.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+            names.update(
+                name for name in rows.order_by().values_list(field, flat=True).distinct().iterator()
+                if not blob_digest(name)
+            )
+
+        moved = {}
+        missing = 0
+        stored_size = {}
+        original_size = 0
+        for name in sorted(names):
+            if not storage.exists(name):
+                self.stderr.write(f'Missing file {name}, left as is')
+                missing += 1
+                continue
+            with storage.open(name, 'rb') as fh:
+                if options['dry_run']:
+                    new = blob_name(hashlib.file_digest(fh, 'sha256').hexdigest(), os.path.splitext(name)[1])
+                else:
+                    new = storage.save(name, fh)
+            moved[name] = new
+            size = storage.size(name)
+            original_size += size
+            stored_size[new] = size
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{name} -> {new}')
+
+        freed = original_size - sum(stored_size.values())
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Would move {len(moved)} files into {len(stored_size)} blobs and free {freed / 1024 / 1024:.1f} MB '
+                f'({missing} missing)'
+            ))
+            return
+
+        with transaction.atomic():
+            for model, field in fields:
+                for batch in batched(list(moved.items()), UPDATE_BATCH):
+                    model._base_manager.filter(**{f'{field}__in': [old for old, _ in batch]}).update(**{
+                        field: Case(
+                            *[When(**{field: old}, then=Value(new)) for old, new in batch],
+                            default=F(field), output_field=CharField(),
+                        ),
+                    })
+            self.move_variants(moved)
+            changed = blobs.recount()
+            bump_catalog_version()
+        cache.delete_many([variants_cache_key(name) for name in moved.keys() | stored_size.keys()])
+
+        if not options['keep']:
+            for name in moved:
+                storage.delete(name)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {len(moved)} files into {len(stored_size)} blobs, freed {freed / 1024 / 1024:.1f} MB '
+            f'({missing} missing, {changed} counts updated) in {time.monotonic() - started:.2f}s'
+        ))
+
+    def move_variants(self, moved):
+        """Keep the derivatives of the first original of every blob; drop the duplicates'."""
+        covered = set(ImageVariant.objects.filter(source__in=set(moved.values())).values_list('source', flat=True))
+        stale = []
+        for old, new in moved.items():
+            variants = ImageVariant.objects.filter(source=old)
+            if new in covered:
+                stale.extend(variants.values_list('image', flat=True))
+                variants.delete()
+            elif variants.update(source=new):
+                covered.add(new)
+
+        def delete_stale():
+            for name in stale:
+                default_storage.delete(name)
+        transaction.on_commit(delete_stale)
@@ -0,0 +1,50 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from item.exports import FORMATS, filter_requests
+
+
+def parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'Invalid date "{value}", expected YYYY-MM-DD')
+
+
+class Command(BaseCommand):
+    help = 'Stream item requests (orders) as CSV or JSONL for fulfillment'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=tuple(FORMATS), default='csv')
+        parser.add_argument('--output', help='File to write (default: stdout)')
+        parser.add_argument('--from', dest='date_from', type=parse_date, help='First day, YYYY-MM-DD')
+        parser.add_argument('--to', dest='date_to', type=parse_date, help='Last day, YYYY-MM-DD')
+        parser.add_argument('--contacted', choices=('yes', 'no'), help='Only contacted / not contacted requests')
+        parser.add_argument('--city', help='City name or id')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        is_contacted = {'yes': True, 'no': False}.get(options['contacted'])
+        queryset = filter_requests(
+            date_from=options['date_from'],
+            date_to=options['date_to'],
+            is_contacted=is_contacted,
+            city=options['city'],
+        )
+        rows, _content_type = FORMATS[options['format']]
+
+        count = 0
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                for line in rows(queryset, options['chunk_size']):
+                    output.write(line)
+                    count += 1
+        else:
+            for line in rows(queryset, options['chunk_size']):
+                self.stdout.write(line, ending='')
+                count += 1
+
+        if options['format'] == 'csv':
+            count -= 1  # header
+        self.stderr.write(f'Exported {count} requests')
@@ -0,0 +1,71 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from base.utils import batched
+from item import orphans
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete the files in MEDIA_ROOT that no row references any more '
+        '(images of deleted or edited items, their variants, abandoned uploads)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the orphaned files')
+        parser.add_argument(
+            '--grace', type=int, default=orphans.MEDIA_GC_GRACE,
+            help='Leave files modified within this many seconds (uploads in progress)',
+        )
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Paths checked per query')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        root = str(settings.MEDIA_ROOT)
+        cutoff = time.time() - options['grace']
+        dry_run = options['dry_run']
+
+        stale = orphans.stale_variants()
+        stale_count = stale.count()
+        if stale_count and not dry_run:
+            # Their files are collected below with the other orphans.
+            with transaction.atomic():
+                stale.delete()
+
+        scanned = recent = found = found_size = 0
+        files = orphans.walk(root) if os.path.isdir(root) else iter(())
+        for batch in batched(files, options['batch_size']):
+            scanned += len(batch)
+            candidates = {}
+            for name, st in batch:
+                if st.st_mtime >= cutoff:
+                    recent += 1
+                else:
+                    candidates[name] = st.st_size
+            if not candidates:
+                continue
+            names = list(candidates)
+            orphaned = sorted(candidates.keys() - orphans.referenced(names) - orphans.stored_since(names, cutoff))
+            if not dry_run:
+                # Checked again under the blob's lock: stored again or
+                # referenced since the walk read it.
+                orphaned = [name for name in orphaned if orphans.delete_orphan(name, cutoff)]
+            found += len(orphaned)
+            found_size += sum(candidates[name] for name in orphaned)
+            if options['verbosity'] > 1:
+                for name in orphaned:
+                    self.stdout.write(name)
+
+        action = 'would be deleted' if dry_run else 'deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'Scanned {scanned} files: {found} orphaned ({found_size / 1024 / 1024:.1f} MB) {action}, '
+            f'{recent} within the grace period, {stale_count} stale variant rows {action} '
+            f'in {time.monotonic() - started:.2f}s'
+        ))
+
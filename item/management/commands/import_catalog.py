@@ -0,0 +1,223 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from base import blobs
+from base.utils import batched
+from ghandyStore.storage import blob_storage
+from item import refdata
+from item.caching import bump_catalog_version
+from item.counters import recount_categories, recount_items
+from item.facets import bump_facets_version
+from item.models import Category, Item, ItemColor, ItemColorImage, ItemSearchToken
+from item.search import build_tokens
+
+
+def clean_record(record, where):
+    """Check the required fields of ``record`` and convert them; ``where`` names it in errors."""
+    if not isinstance(record, dict):
+        raise CommandError(f'{where}: expected an object')
+    for field in ('external_id', 'category', 'name', 'price'):
+        if record.get(field) is None or not str(record[field]).strip():
+            raise CommandError(f'{where}: missing {field}')
+    record['external_id'] = str(record['external_id'])
+    try:
+        record['price'] = float(record['price'])
+    except (TypeError, ValueError):
+        raise CommandError(f'{where}: invalid price {record["price"]!r}')
+    colors = record.get('colors') or []
+    if not isinstance(colors, list) or not all(isinstance(color, dict) and color.get('name') for color in colors):
+        raise CommandError(f'{where}: every color needs a name')
+    return record
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as fh:
+        for line_number, line in enumerate(fh, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as exc:
+                raise CommandError(f'{path}:{line_number}: {exc}')
+            yield clean_record(record, f'{path}:{line_number}')
+
+
+def parse_colors(value):
+    """Parse the CSV colors column: ``red=a.jpg|b.jpg;blue=c.jpg;green``."""
+    colors = []
+    for chunk in filter(None, (part.strip() for part in (value or '').split(';'))):
+        name, _, images = chunk.partition('=')
+        sold_out = name.endswith('!')
+        colors.append({
+            'name': name.rstrip('!').strip(),
+            'is_sold_out': sold_out,
+            'images': [image.strip() for image in images.split('|') if image.strip()],
+        })
+    return colors
+
+
+def read_csv(path):
+    with open(path, encoding='utf-8', newline='') as fh:
+        reader = csv.DictReader(fh)
+        for row in reader:
+            row['colors'] = parse_colors(row.get('colors'))
+            yield clean_record(row, f'{path}:{reader.line_num}')
+
+
+class Command(BaseCommand):
+    help = (
+        'Import items, colors and color images from a JSONL or CSV file. '
+        'Each record needs external_id, category, name and price, and may have '
+        'description, image and colors ([{name, is_sold_out, images}] in JSONL, '
+        '"red=a.jpg|b.jpg;blue!=c.jpg" in CSV, "!" marking a sold out color). '
+        'Items whose external_id already exists are skipped, so re-runs are safe.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('jsonl', 'csv'), help='Defaults to the file extension')
+        parser.add_argument('--images-dir', default='.', help='Directory that image paths are relative to')
+        parser.add_argument('--user', help='Username recorded as created_by (default: first superuser)')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=4, help='Threads used to copy image files')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        records = read_csv(path) if file_format == 'csv' else read_jsonl(path)
+
+        self.user = self.get_user(options['user'])
+        self.images_dir = options['images_dir']
+        self.categories = dict(Category.objects.values_list('name', 'id'))
+
+        started = time.monotonic()
+        imported = skipped = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            self.pool = pool
+            for batch in batched(records, options['batch_size']):
+                created, existing = self.import_batch(batch)
+                imported += created
+                skipped += existing
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'{imported} imported, {skipped} skipped, {imported / elapsed if elapsed else 0:.0f} items/s'
+                )
+
+        if imported:
+            # bulk_create skips the signals that maintain the counters.
+            recount_categories(Category.objects.all())
+            refdata.invalidate()
+            bump_catalog_version()
+            bump_facets_version()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} items ({skipped} already present) in {elapsed:.2f}s'
+            f' ({imported / elapsed if elapsed else 0:.0f} items/s). '
+            'Run build_image_variants to generate image derivatives.'
+        ))
+
+    def get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'User "{username}" does not exist')
+        user = User.objects.filter(is_superuser=True).order_by('id').first()
+        if user is None:
+            raise CommandError('No superuser found; pass --user')
+        return user
+
+    def category_id(self, name):
+        name = name.strip()
+        if name not in self.categories:
+            self.categories[name] = Category.objects.create(name=name).id
+        return self.categories[name]
+
+    def copy_image(self, source, upload_to):
+        """Copy one image into the blob storage and return its storage name."""
+        try:
+            with open(os.path.join(self.images_dir, source), 'rb') as fh:
+                return blob_storage().save(f'{upload_to}/{os.path.basename(source)}', File(fh))
+        except OSError as exc:
+            raise CommandError(f'Cannot copy image {source}: {exc}')
+
+    def copy_images(self, sources, upload_to):
+        return list(self.pool.map(lambda source: self.copy_image(source, upload_to), sources))
+
+    def import_batch(self, batch):
+        ids = [record['external_id'] for record in batch]
+        existing = set(Item.objects.filter(external_id__in=ids).values_list('external_id', flat=True))
+        records = {}
+        for record in batch:
+            if record['external_id'] not in existing:
+                records.setdefault(record['external_id'], record)
+        if not records:
+            return 0, len(batch)
+
+        # Files are copied before the transaction so it stays short.
+        main_images = dict(zip(
+            [key for key, record in records.items() if record.get('image')],
+            self.copy_images([record['image'] for record in records.values() if record.get('image')], 'item_images'),
+        ))
+        color_image_sources = [
+            (key, color['name'], image)
+            for key, record in records.items()
+            for color in record.get('colors') or []
+            for image in color.get('images') or []
+        ]
+        color_image_names = self.copy_images([source for _, _, source in color_image_sources], 'item_color_images')
+
+        with transaction.atomic():
+            items = [
+                Item(
+                    external_id=key,
+                    category_id=self.category_id(record['category']),
+                    name=record['name'],
+                    description=record.get('description') or None,
+                    price=record['price'],
+                    image=main_images.get(key),
+                    is_sold=str(record.get('is_sold', '')).lower() in ('1', 'true', 'yes'),
+                    created_by=self.user,
+                )
+                for key, record in records.items()
+            ]
+            Item.objects.bulk_create(items)
+            # Primary keys are re-read because MySQL does not return them from bulk_create.
+            item_ids = dict(Item.objects.filter(external_id__in=records).values_list('external_id', 'id'))
+
+            ItemSearchToken.objects.bulk_create([
+                ItemSearchToken(item_id=item_ids[item.external_id], token=token, weight=weight)
+                for item in items
+                for token, weight in build_tokens(item).items()
+            ])
+
+            ItemColor.objects.bulk_create([
+                ItemColor(item_id=item_ids[key], name=color['name'], is_sold_out=bool(color.get('is_sold_out')))
+                for key, record in records.items()
+                for color in {c['name']: c for c in record.get('colors') or []}.values()
+            ])
+            color_ids = {
+                (item_id, name): color_id
+                for color_id, item_id, name in ItemColor.objects
+                .filter(item_id__in=item_ids.values())
+                .values_list('id', 'item_id', 'name')
+            }
+            ItemColorImage.objects.bulk_create([
+                ItemColorImage(color_id=color_ids[(item_ids[key], color_name)], image=image)
+                for (key, color_name, _), image in zip(color_image_sources, color_image_names)
+            ])
+            recount_items(Item.objects.filter(pk__in=item_ids.values()))
+            # bulk_create skips the signals that count blob references too.
+            blobs.recount({*main_images.values(), *color_image_names})
+
+        return len(records), len(batch) - len(records)
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from item.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the item search index from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {count} items in {time.monotonic() - started:.2f}s'
+        ))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from item.caching import bump_catalog_version
+from item.counters import recount
+from item.facets import bump_facets_version
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the denormalized counters (available colors and images per item, '
+        'unsold items per category) from the rows'
+    )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        items, categories = recount()
+        bump_catalog_version()
+        bump_facets_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'Recounted {items} items and {categories} categories in {time.monotonic() - started:.2f}s'
+        ))
@@ -0,0 +1,162 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from item.caching import bump_catalog_version
+from item.counters import recount
+from item.facets import bump_facets_version
+from item.models import Category, City, Item, ItemColor, ItemColorImage, ItemRequest, ItemSearchToken, Place
+from item.search import build_tokens
+
+SEED_PREFIX = 'seed-'
+
+WORDS = (
+    'classic', 'summer', 'winter', 'cotton', 'linen', 'leather', 'silk', 'denim', 'wool', 'casual',
+    'formal', 'sport', 'vintage', 'slim', 'oversized', 'striped', 'printed', 'plain', 'hooded', 'light',
+    'فستان', 'قميص', 'حذاء', 'حقيبة', 'بنطال', 'جاكيت', 'صيفي', 'شتوي', 'قطن', 'جلد',
+)
+NOUNS = ('shirt', 'dress', 'jacket', 'bag', 'shoes', 'scarf', 'skirt', 'coat', 'hoodie', 'trousers')
+COLORS = ('black', 'white', 'red', 'blue', 'green', 'beige', 'brown', 'grey', 'pink', 'navy', 'olive', 'yellow')
+
+
+def chunks(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a deterministic synthetic catalog for benchmarks: categories, items, '
+        'colors, color images, cities, places and historical item requests. '
+        'The same --seed and sizes always produce the same rows. Image names are '
+        'recorded without files.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=10)
+        parser.add_argument('--items', type=int, default=1000)
+        parser.add_argument('--colors', type=int, default=3, help='Colors per item')
+        parser.add_argument('--images', type=int, default=2, help='Images per color')
+        parser.add_argument('--cities', type=int, default=14)
+        parser.add_argument('--places', type=int, default=10, help='Places per city')
+        parser.add_argument('--requests', type=int, default=5000, help='Historical item requests')
+        parser.add_argument('--sold-ratio', type=float, default=0.1)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--flush', action='store_true', help='Delete previously seeded rows first')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        started = time.monotonic()
+
+        if Item.objects.filter(external_id__startswith=SEED_PREFIX).exists():
+            if not options['flush']:
+                raise CommandError('The catalog is already seeded; pass --flush to replace it')
+            self.flush()
+
+        user, _ = User.objects.get_or_create(username='seed', defaults={'is_staff': True, 'is_superuser': True})
+
+        with transaction.atomic():
+            Category.objects.bulk_create(
+                [Category(name=f'{SEED_PREFIX}category-{n}') for n in range(options['categories'])],
+                batch_size=batch_size,
+            )
+            category_ids = list(Category.objects.filter(name__startswith=SEED_PREFIX).order_by('id').values_list('id', flat=True))
+            if not category_ids:
+                raise CommandError('--categories must be at least 1')
+
+            City.objects.bulk_create(
+                [City(name=f'{SEED_PREFIX}city-{n}') for n in range(options['cities'])],
+                batch_size=batch_size,
+            )
+            city_ids = list(City.objects.filter(name__startswith=SEED_PREFIX).order_by('id').values_list('id', flat=True))
+            Place.objects.bulk_create(
+                [
+                    Place(city_id=city_id, name=f'{SEED_PREFIX}place-{city_id}-{n}')
+                    for city_id in city_ids
+                    for n in range(options['places'])
+                ],
+                batch_size=batch_size,
+            )
+            places = list(Place.objects.filter(city_id__in=city_ids).order_by('id').values_list('id', 'city_id'))
+
+        item_count = 0
+        for numbers in chunks(range(options['items']), batch_size):
+            with transaction.atomic():
+                items = [self.make_item(rng, n, category_ids, user, options['sold_ratio']) for n in numbers]
+                Item.objects.bulk_create(items)
+                # Primary keys are re-read because MySQL does not return them from bulk_create.
+                item_ids = dict(Item.objects.filter(external_id__in=[item.external_id for item in items]).values_list('external_id', 'id'))
+                ItemSearchToken.objects.bulk_create([
+                    ItemSearchToken(item_id=item_ids[item.external_id], token=token, weight=weight)
+                    for item in items
+                    for token, weight in build_tokens(item).items()
+                ], batch_size=batch_size)
+                ItemColor.objects.bulk_create([
+                    ItemColor(item_id=item_id, name=name, is_sold_out=rng.random() < 0.15)
+                    for item_id in item_ids.values()
+                    for name in rng.sample(COLORS, min(options['colors'], len(COLORS)))
+                ], batch_size=batch_size)
+                ItemColorImage.objects.bulk_create([
+                    ItemColorImage(color_id=color_id, image=f'item_color_images/{SEED_PREFIX}{color_id}-{n}.jpg')
+                    for color_id in ItemColor.objects.filter(item_id__in=item_ids.values()).values_list('id', flat=True)
+                    for n in range(options['images'])
+                ], batch_size=batch_size)
+            item_count += len(items)
+
+        request_count = self.seed_requests(rng, options['requests'], places, batch_size)
+
+        # bulk_create skips the signals that maintain the counters.
+        recount(Item.objects.filter(external_id__startswith=SEED_PREFIX))
+        bump_catalog_version()
+        bump_facets_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {item_count} items, {len(category_ids)} categories, {len(city_ids)} cities, '
+            f'{len(places)} places and {request_count} requests in {time.monotonic() - started:.2f}s'
+        ))
+
+    def make_item(self, rng, n, category_ids, user, sold_ratio):
+        words = rng.sample(WORDS, 2)
+        return Item(
+            external_id=f'{SEED_PREFIX}{n}',
+            category_id=category_ids[n % len(category_ids)],
+            name=f'{words[0]} {words[1]} {rng.choice(NOUNS)} {n}',
+            description=' '.join(rng.choices(WORDS, k=12)),
+            price=round(rng.uniform(5, 500), 2),
+            image=f'item_images/{SEED_PREFIX}{n}.jpg',
+            is_sold=rng.random() < sold_ratio,
+            created_by=user,
+        )
+
+    def seed_requests(self, rng, count, places, batch_size):
+        if not count or not places:
+            return 0
+        colors = list(ItemColor.objects.filter(item__external_id__startswith=SEED_PREFIX).order_by('id').values_list('id', 'item_id'))
+        if not colors:
+            return 0
+        created = 0
+        for numbers in chunks(range(count), batch_size):
+            rows = []
+            for n in numbers:
+                color_id, item_id = rng.choice(colors)
+                place_id, city_id = rng.choice(places)
+                rows.append(ItemRequest(
+                    item_id=item_id, color_id=color_id, city_id=city_id, place_id=place_id,
+                    customer_name=f'{SEED_PREFIX}customer-{n}', customer_phone=f'09{rng.randrange(10 ** 8):08d}',
+                    is_contacted=rng.random() < 0.5,
+                ))
+            ItemRequest.objects.bulk_create(rows)
+            created += len(rows)
+        return created
+
+    def flush(self):
+        with transaction.atomic():
+            ItemRequest.objects.filter(customer_name__startswith=SEED_PREFIX).delete()
+            Item.objects.filter(external_id__startswith=SEED_PREFIX).delete()
+            Place.objects.filter(name__startswith=SEED_PREFIX).delete()
+            City.objects.filter(name__startswith=SEED_PREFIX).delete()
+            Category.objects.filter(name__startswith=SEED_PREFIX).delete()
@@ -0,0 +1,53 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from item import uploads
+from item.models import ItemColor
+
+
+class Command(BaseCommand):
+    help = (
+        'Add many image files to an item color at once: files are validated and stored '
+        'by a pool of threads and the rows created with one query'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('color', type=int, help='Id of the ItemColor')
+        parser.add_argument('paths', nargs='+', help='Image files, or directories of image files')
+        parser.add_argument('--workers', type=int, default=uploads.BULK_UPLOAD_WORKERS, help='Files processed at the same time')
+
+    def handle(self, *args, **options):
+        try:
+            color = ItemColor.objects.select_related('item').get(pk=options['color'])
+        except ItemColor.DoesNotExist:
+            raise CommandError(f"Color {options['color']} does not exist")
+
+        files = []
+        for path in options['paths']:
+            if os.path.isdir(path):
+                files.extend(
+                    (entry.name, entry.path)
+                    for entry in sorted(os.scandir(path), key=lambda entry: entry.name)
+                    if entry.is_file()
+                )
+            else:
+                files.append((os.path.basename(path), path))
+
+        started = time.monotonic()
+        done = 0
+
+        def progress(result):
+            nonlocal done
+            done += 1
+            if result.image:
+                self.stdout.write(f'[{done}/{len(files)}] {result.name} -> {result.image}')
+            else:
+                self.stderr.write(f'[{done}/{len(files)}] {result.name}: {result.error}')
+
+        results = uploads.upload_color_images(color, files, options['workers'], progress)
+        added = sum(1 for result in results if result.image)
+        self.stdout.write(self.style.SUCCESS(
+            f'Added {added} images to {color} ({len(results) - added} failed) in {time.monotonic() - started:.2f}s'
+        ))
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:16
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# A frozen copy of the tokenizer of item.search at the time of this
+# migration; later changes are applied with rebuild_search_index.
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+ARABIC_FOLDING = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ة': 'ه', 'ى': 'ي', 'ؤ': 'و', 'ئ': 'ي', 'ـ': None,
+})
+
+
+def tokenize(text):
+    if not text:
+        return []
+    decomposed = unicodedata.normalize('NFKD', text.translate(ARABIC_FOLDING).lower())
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return [token[:64] for token in TOKEN_RE.findall(unicodedata.normalize('NFC', stripped).translate(ARABIC_FOLDING))]
+
+
+def build_tokens(item):
+    weights = {}
+    for token in tokenize(item.name):
+        weights[token] = weights.get(token, 0) + 3
+    for token in tokenize(item.description):
+        weights[token] = weights.get(token, 0) + 1
+    return weights
+
+
+def build_index(apps, schema_editor):
+    Item = apps.get_model('item', 'Item')
+    ItemSearchToken = apps.get_model('item', 'ItemSearchToken')
+    rows = []
+    for item in Item.objects.only('id', 'name', 'description').iterator():
+        for token, weight in build_tokens(item).items():
+            rows.append(ItemSearchToken(item_id=item.id, token=token, weight=weight))
+    ItemSearchToken.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0004_itemcolor_itemrequest_color_itemcolorimage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField(default=1)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='item.item')),
+            ],
+            options={
+                'unique_together': {('token', 'item')},
+            },
+        ),
+        migrations.RunPython(build_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0007_imagevariant'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='external_id',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+    ]
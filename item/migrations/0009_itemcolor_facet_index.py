@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0008_item_external_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='itemcolor',
+            index=models.Index(fields=['name', 'is_sold_out', 'item'], name='itemcolor_name_avail_idx'),
+        ),
+    ]
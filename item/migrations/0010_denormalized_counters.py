@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:35
+
+from django.db import migrations, models
+
+
+def count(apps, schema_editor):
+    from item.counters import recount_categories, recount_items
+
+    recount_items(apps.get_model('item', 'Item').objects.all())
+    recount_categories(apps.get_model('item', 'Category').objects.all())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0009_itemcolor_facet_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='available_colors_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='images_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0010_denormalized_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='stock_quantity',
+            field=models.PositiveIntegerField(blank=True, help_text='Units in stock for items without colors. Leave empty to not track stock.', null=True),
+        ),
+        migrations.AddField(
+            model_name='itemcolor',
+            name='stock_quantity',
+            field=models.PositiveIntegerField(blank=True, help_text='Units in stock. Leave empty to not track stock.', null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:55
+
+import ghandyStore.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0011_stock_quantity'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=ghandyStore.storage.blob_storage, upload_to='item_images'),
+        ),
+        migrations.AlterField(
+            model_name='itemcolorimage',
+            name='image',
+            field=models.ImageField(storage=ghandyStore.storage.blob_storage, upload_to='item_color_images'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0012_blob_storage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='itemrequest',
+            index=models.Index(fields=['created_at'], name='itemrequest_created_idx'),
+        ),
+    ]
@@ -1,8 +1,28 @@
 from django.contrib.auth.models import User
 from django.db import models
 
-class Category(models.Model):
+from ghandyStore.storage import blob_storage
+
+class CounterFieldsMixin:
+    """
+    Leave the denormalized counters (see item.counters) out of the UPDATE of
+    plain saves: they are maintained with F() updates, and writing back the
+    values loaded with the instance would undo concurrent changes. Saves
+    naming them in ``update_fields`` still write them.
+    """
+    counter_fields = ()
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        if update_fields is None:
+            values = [value for value in values if value[0].name not in self.counter_fields]
+        return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+
+class Category(CounterFieldsMixin, models.Model):
     name = models.CharField(max_length=255)
+    # Unsold items, maintained by item.counters
+    items_count = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('items_count',)
 
     class Meta:
         ordering = ('name',)
@@ -11,19 +31,57 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
-class Item(models.Model):
+class Item(CounterFieldsMixin, models.Model):
     category = models.ForeignKey(Category, related_name='items', on_delete=models.CASCADE)
+    # Supplier reference used by import_catalog to recognise already imported items
+    external_id = models.CharField(max_length=100, unique=True, blank=True, null=True)
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
     price = models.FloatField()
-    image = models.ImageField(upload_to='item_images', blank=True, null=True)
+    image = models.ImageField(upload_to='item_images', storage=blob_storage, blank=True, null=True)
     is_sold = models.BooleanField(default=False)
+    # Units left of an item without colors; empty means stock is not tracked
+    stock_quantity = models.PositiveIntegerField(
+        blank=True, null=True,
+        help_text='Units in stock for items without colors. Leave empty to not track stock.',
+    )
     created_by = models.ForeignKey(User, related_name='items', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Maintained by item.counters
+    available_colors_count = models.PositiveIntegerField(default=0, editable=False)
+    images_count = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('available_colors_count', 'images_count')
+
+    class Meta:
+        # Keyset pagination indexes, one per catalog sort order.
+        indexes = [
+            models.Index(fields=['is_sold', 'created_at', 'id'], name='item_sold_created_idx'),
+            models.Index(fields=['is_sold', 'price', 'id'], name='item_sold_price_idx'),
+            models.Index(fields=['is_sold', 'name', 'id'], name='item_sold_name_idx'),
+            models.Index(fields=['category', 'is_sold', 'created_at', 'id'], name='item_cat_sold_created_idx'),
+        ]
     
     def __str__(self):
         return self.name
 
+    def save(self, **kwargs):
+        if self.stock_quantity is not None:
+            self.is_sold = self.stock_quantity == 0
+        super().save(**kwargs)
+
+class ItemSearchToken(models.Model):
+    item = models.ForeignKey(Item, related_name='search_tokens', on_delete=models.CASCADE)
+    token = models.CharField(max_length=64)
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        # (token, item) doubles as the index used for prefix lookups.
+        unique_together = ('token', 'item')
+
+    def __str__(self):
+        return f"{self.token} -> {self.item_id}"
+
 class City(models.Model):
     name = models.CharField(max_length=255)
 
@@ -49,18 +107,32 @@ class ItemColor(models.Model):
     item = models.ForeignKey(Item, related_name='colors', on_delete=models.CASCADE)
     name = models.CharField(max_length=100)
     is_sold_out = models.BooleanField(default=False)
+    # Units left; empty means stock is not tracked and is_sold_out is set by hand
+    stock_quantity = models.PositiveIntegerField(
+        blank=True, null=True,
+        help_text='Units in stock. Leave empty to not track stock.',
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ('name',)
         unique_together = ('item', 'name')  # Prevent duplicate colors for same item
+        indexes = [
+            # Color facet: items with an available color of a given name.
+            models.Index(fields=['name', 'is_sold_out', 'item'], name='itemcolor_name_avail_idx'),
+        ]
     
     def __str__(self):
         return f"{self.item.name} - {self.name}"
 
+    def save(self, **kwargs):
+        if self.stock_quantity is not None:
+            self.is_sold_out = self.stock_quantity == 0
+        super().save(**kwargs)
+
 class ItemColorImage(models.Model):
     color = models.ForeignKey(ItemColor, related_name='images', on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='item_color_images')
+    image = models.ImageField(upload_to='item_color_images', storage=blob_storage)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -69,6 +141,20 @@ class ItemColorImage(models.Model):
     def __str__(self):
         return f"{self.color.item.name} - {self.color.name} - Image"
 
+class ImageVariant(models.Model):
+    source = models.CharField(max_length=255)
+    variant = models.CharField(max_length=20)
+    image = models.CharField(max_length=255)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('source', 'variant')
+
+    def __str__(self):
+        return f"{self.source} ({self.variant})"
+
 class ItemRequest(models.Model):
     item = models.ForeignKey(Item, related_name='requests', on_delete=models.CASCADE)
     color = models.ForeignKey(ItemColor, related_name='requests', on_delete=models.SET_NULL, null=True, blank=True)
@@ -82,6 +168,10 @@ class ItemRequest(models.Model):
     
     class Meta:
         ordering = ('-created_at',)
+        indexes = [
+            # Date ranges of item.exports
+            models.Index(fields=['created_at'], name='itemrequest_created_idx'),
+        ]
     
     def __str__(self):
         color_info = f" - {self.color.name}" if self.color else ""
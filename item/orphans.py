@@ -0,0 +1,140 @@
+"""
+Media files that no row references any more: images of deleted or edited
+catalog rows, their variants and abandoned uploads. Used by the
+``gc_media`` command and the ``item.delete_image`` job.
+
+A file is referenced when a file field of any model names it, or when it
+is an ImageVariant of a referenced image. Paths are checked in batches
+with one ``values_list()`` query per field, so memory stays bounded by the
+batch size whatever the number of files.
+"""
+import os
+import time
+from datetime import datetime, timezone
+from functools import reduce
+from operator import or_
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Exists, FileField, OuterRef
+
+from base.models import MediaBlob
+from ghandyStore.storage import blob_digest, blob_storage
+
+from .images import variants_cache_key
+from .models import ImageVariant
+
+MEDIA_GC_GRACE = getattr(settings, 'MEDIA_GC_GRACE', 60 * 60 * 24)
+MEDIA_DELETE_DELAY = getattr(settings, 'MEDIA_DELETE_DELAY', 60 * 10)
+
+
+def file_fields():
+    return [
+        (model, field.attname)
+        for model in apps.get_models()
+        for field in model._meta.concrete_fields
+        if isinstance(field, FileField)
+    ]
+
+
+def _source_is_referenced():
+    return reduce(or_, (
+        Exists(model._base_manager.filter(**{field: OuterRef('source')})) for model, field in file_fields()
+    ))
+
+
+def referenced(names):
+    """The subset of ``names`` that rows reference."""
+    found = set()
+    for model, field in file_fields():
+        found.update(model._base_manager.filter(**{f'{field}__in': names}).values_list(field, flat=True).iterator())
+    found.update(
+        ImageVariant.objects.filter(image__in=names).filter(_source_is_referenced())
+        .values_list('image', flat=True).iterator()
+    )
+    return found
+
+
+def stored_since(names, cutoff):
+    """The blobs of ``names`` an upload stored again after ``cutoff`` (a timestamp)."""
+    since = datetime.fromtimestamp(cutoff, tz=timezone.utc)
+    return set(MediaBlob.objects.filter(name__in=names, stored_at__gte=since).values_list('name', flat=True))
+
+
+def stale_variants():
+    """Variants of images that are no longer referenced."""
+    return ImageVariant.objects.exclude(_source_is_referenced())
+
+
+def walk(root, path=''):
+    """Yield ``(name, stat)`` for every file under ``root``, depth first."""
+    with os.scandir(os.path.join(root, path)) as entries:
+        for entry in entries:
+            name = f'{path}/{entry.name}' if path else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk(root, name)
+            elif entry.is_file(follow_symlinks=False):
+                yield name, entry.stat(follow_symlinks=False)
+
+
+def _modified_since(path, cutoff):
+    try:
+        return os.path.getmtime(path) >= cutoff
+    except FileNotFoundError:
+        return False
+
+
+def delete_orphan(name, cutoff):
+    """
+    Delete the file ``name``, with its variants and blob row, unless a row
+    references it or it was stored or modified after ``cutoff`` (a
+    timestamp). Returns True if it was deleted.
+
+    For blobs the checks run under the lock of the MediaBlob row, which
+    new references (base.blobs.add_reference) and uploads of the same bytes
+    (base.blobs.mark_stored) wait for: a reference added before the lock is
+    seen by the checks, and an upload after it finds the file gone and
+    writes it again.
+    """
+    digest = blob_digest(name)
+    storage = blob_storage() if digest else default_storage
+    path = storage.path(name)
+    with transaction.atomic():
+        if digest:
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                size = 0
+            blob, _created = MediaBlob.objects.select_for_update().get_or_create(
+                name=name, defaults={'digest': digest, 'size': size},
+            )
+            in_use = blob.refcount > 0
+        else:
+            in_use = False
+        if in_use or referenced([name]) or stored_since([name], cutoff) or _modified_since(path, cutoff):
+            # Drops the row created only to hold the lock.
+            transaction.set_rollback(True)
+            return False
+        variants = ImageVariant.objects.filter(source=name)
+        variant_names = list(variants.values_list('image', flat=True))
+        variants.delete()
+        MediaBlob.objects.filter(name=name).delete()
+        # Removed while the lock is held, see above.
+        storage.delete(name)
+    for variant_name in variant_names:
+        default_storage.delete(variant_name)
+    cache.delete(variants_cache_key(name))
+    return True
+
+
+def delete_if_orphaned(name, recent=MEDIA_DELETE_DELAY):
+    """
+    Delete the released image ``name`` unless it is in use again or was
+    stored in the last ``recent`` seconds. Returns True if it was deleted.
+    """
+    # An upload released and stored again is left to gc_media, which
+    # collects it later if that upload was abandoned.
+    return delete_orphan(name, time.time() - recent)
@@ -0,0 +1,118 @@
+from dataclasses import dataclass
+
+from django.core import signing
+from django.db.models import F, Q
+
+# Each sort order is a tuple of (field, descending) pairs. The last pair is
+# always the primary key so that every row has a unique position and the
+# cursor never skips or repeats rows that share a value.
+SORT_ORDERS = {
+    'newest': (('created_at', True), ('id', True)),
+    'price_asc': (('price', False), ('id', False)),
+    'price_desc': (('price', True), ('id', True)),
+    'name': (('name', False), ('id', False)),
+    # Only valid on querysets annotated by item.search.search().
+    'relevance': (('search_rank', True), ('created_at', True), ('id', True)),
+}
+
+SORT_LABELS = {
+    'newest': 'Newest',
+    'price_asc': 'Price: low to high',
+    'price_desc': 'Price: high to low',
+    'name': 'Name',
+}
+
+DEFAULT_SORT = 'newest'
+
+CURSOR_SALT = 'item.pagination'
+
+
+@dataclass
+class Page:
+    items: list
+    sort: str
+    next_cursor: str = None
+    page_size: int = 0
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def get_sort(value, allow_relevance=False):
+    if value in SORT_ORDERS and (value != 'relevance' or allow_relevance):
+        return value
+    return 'relevance' if allow_relevance else DEFAULT_SORT
+
+
+def _order_by(sort):
+    return [F(name).desc() if desc else F(name).asc() for name, desc in SORT_ORDERS[sort]]
+
+
+def _after(sort, values):
+    """
+    Build the keyset condition selecting rows strictly after ``values``,
+    e.g. for newest: created_at < v0 OR (created_at = v0 AND id < v1).
+    """
+    condition = Q()
+    equal = {}
+    for (name, desc), value in zip(SORT_ORDERS[sort], values):
+        lookup = f'{name}__lt' if desc else f'{name}__gt'
+        condition |= Q(**equal, **{lookup: value})
+        equal[name] = value
+    return condition
+
+
+def encode_cursor(sort, obj):
+    values = []
+    for name, _desc in SORT_ORDERS[sort]:
+        # Rows may be model instances or values() dicts.
+        value = obj[name] if isinstance(obj, dict) else getattr(obj, name)
+        values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+    return signing.dumps([sort, values], salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor, sort, model):
+    """Return the decoded key values, or None for a missing/foreign cursor."""
+    if not cursor:
+        return None
+    try:
+        cursor_sort, values = signing.loads(cursor, salt=CURSOR_SALT)
+    except (signing.BadSignature, ValueError, TypeError):
+        return None
+    if cursor_sort != sort or len(values) != len(SORT_ORDERS[sort]):
+        return None
+    decoded = []
+    for (name, _desc), value in zip(SORT_ORDERS[sort], values):
+        if name == 'search_rank':
+            decoded.append(int(value))
+        else:
+            decoded.append(model._meta.get_field(name).to_python(value))
+    return decoded
+
+
+def paginate(queryset, sort=DEFAULT_SORT, cursor=None, page_size=12):
+    """
+    Return one page of ``queryset`` in ``sort`` order, starting after
+    ``cursor``. Only ``page_size + 1`` rows are fetched, and the start
+    position is an indexed range condition rather than an OFFSET, so every
+    page costs the same as the first.
+    """
+    queryset = queryset.order_by(*_order_by(sort))
+    values = decode_cursor(cursor, sort, queryset.model)
+    if values is not None:
+        queryset = queryset.filter(_after(sort, values))
+
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(sort, rows[-1])
+
+    return Page(items=rows, sort=sort, next_cursor=next_cursor, page_size=page_size)
@@ -0,0 +1,136 @@
+"""
+In-process cache of the small reference tables (Category, City, Place).
+
+Each worker keeps the rows as tuples and reloads them only when the shared
+version stored in the cache moves, which any worker does through
+``invalidate()`` when an admin edits one of the tables. The item counts of
+the categories change too often for it and are read by
+item.counters.with_items_count.
+
+The version lives in the default cache, which production settings always
+share between the workers (CACHE_LOCATION, see ghandyStore.settings).
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Category, City, Place
+
+REFDATA_VERSION_KEY = 'item:refdata:version'
+REFDATA_CHANGED_KEY = 'item:refdata:changed'
+
+CategoryRef = namedtuple('CategoryRef', 'id name')
+CityRef = namedtuple('CityRef', 'id name')
+PlaceRef = namedtuple('PlaceRef', 'id city_id name')
+
+RefData = namedtuple('RefData', 'version changed categories cities places places_by_city')
+
+# Serialized city -> places bundle with its content digest.
+PlacesBundle = namedtuple('PlacesBundle', 'digest content')
+
+_lock = threading.Lock()
+_refdata = None
+_bundle = (None, None)
+
+
+def get_version():
+    version = cache.get(REFDATA_VERSION_KEY)
+    if version is None:
+        cache.add(REFDATA_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(REFDATA_VERSION_KEY)
+    return version
+
+
+def get_changed():
+    """Unix time of the last reference data change known to the cache."""
+    changed = cache.get(REFDATA_CHANGED_KEY)
+    if changed is None:
+        cache.add(REFDATA_CHANGED_KEY, int(time.time()), timeout=None)
+        changed = cache.get(REFDATA_CHANGED_KEY)
+    return changed
+
+
+def _load(version):
+    categories = tuple(CategoryRef(*row) for row in Category.objects.order_by('name').values_list('id', 'name'))
+    cities = tuple(CityRef(*row) for row in City.objects.order_by('name').values_list('id', 'name'))
+    places = tuple(PlaceRef(*row) for row in Place.objects.order_by('name').values_list('id', 'city_id', 'name'))
+    places_by_city = {}
+    for place in places:
+        places_by_city.setdefault(place.city_id, []).append(place)
+    places_by_city = {city_id: tuple(rows) for city_id, rows in places_by_city.items()}
+    return RefData(version, get_changed(), categories, cities, places, places_by_city)
+
+
+def get_refdata():
+    global _refdata
+    version = get_version()
+    refdata = _refdata
+    if refdata is None or refdata.version != version:
+        with _lock:
+            if _refdata is None or _refdata.version != version:
+                _refdata = _load(version)
+            refdata = _refdata
+    return refdata
+
+
+def _bump():
+    cache.set(REFDATA_CHANGED_KEY, int(time.time()), timeout=None)
+    try:
+        cache.incr(REFDATA_VERSION_KEY)
+    except ValueError:
+        cache.set(REFDATA_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate():
+    """Make every worker reload the reference data on its next access."""
+    _bump()
+    transaction.on_commit(_bump)
+
+
+def categories():
+    return get_refdata().categories
+
+
+def get_category(category_id):
+    for category in get_refdata().categories:
+        if category.id == category_id:
+            return category
+    return None
+
+
+def cities():
+    return get_refdata().cities
+
+
+def places_for_city(city_id):
+    return get_refdata().places_by_city.get(city_id, ())
+
+
+def places_bundle():
+    """
+    Return every city with its places as one JSON document, built once per
+    reference data version. The digest changes whenever the content does,
+    so the bundle can be served from a content-addressed URL.
+    """
+    global _bundle
+    refdata = get_refdata()
+    version, bundle = _bundle
+    if version != refdata.version:
+        content = json.dumps({
+            'cities': [
+                {
+                    'id': city.id,
+                    'name': city.name,
+                    'places': [{'id': place.id, 'name': place.name} for place in refdata.places_by_city.get(city.id, ())],
+                }
+                for city in refdata.cities
+            ],
+        }, ensure_ascii=False, separators=(',', ':')).encode()
+        bundle = PlacesBundle(hashlib.sha256(content).hexdigest()[:16], content)
+        _bundle = (refdata.version, bundle)
+    return bundle
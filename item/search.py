@@ -0,0 +1,140 @@
+import re
+import unicodedata
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Item, ItemSearchToken
+
+# Field weights used when ranking results: a hit in the name counts
+# more than a hit in the description.
+NAME_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+
+# Exact token matches rank above prefix matches.
+EXACT_MATCH_BONUS = 2
+
+MAX_TOKEN_LENGTH = 64
+MAX_QUERY_TOKENS = 8
+
+# Shorter terms match whole tokens only, so a one-letter query does not
+# expand into a range over most of the index.
+MIN_PREFIX_LENGTH = 2
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Arabic letter variants folded to a single base letter so that
+# "أحمر", "احمر" and "إحمر" all index to the same token.
+ARABIC_FOLDING = str.maketrans({
+    'أ': 'ا',
+    'إ': 'ا',
+    'آ': 'ا',
+    'ٱ': 'ا',
+    'ة': 'ه',
+    'ى': 'ي',
+    'ؤ': 'و',
+    'ئ': 'ي',
+    'ـ': None,  # tatweel
+})
+
+
+def normalize(text):
+    """Lowercase, fold Arabic letter variants and strip diacritics."""
+    if not text:
+        return ''
+    text = text.translate(ARABIC_FOLDING).lower()
+    # NFKD splits accented Latin letters and Arabic harakat into base
+    # letters plus combining marks, which are then dropped.
+    decomposed = unicodedata.normalize('NFKD', text)
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    # Re-fold in case decomposition exposed a bare variant letter.
+    return unicodedata.normalize('NFC', stripped).translate(ARABIC_FOLDING)
+
+
+def tokenize(text):
+    return [token[:MAX_TOKEN_LENGTH] for token in TOKEN_RE.findall(normalize(text))]
+
+
+def build_tokens(item):
+    """Return a {token: weight} mapping for an item's name and description."""
+    weights = {}
+    for token in tokenize(item.name):
+        weights[token] = weights.get(token, 0) + NAME_WEIGHT
+    for token in tokenize(item.description):
+        weights[token] = weights.get(token, 0) + DESCRIPTION_WEIGHT
+    return weights
+
+
+def index_item(item):
+    """Replace the indexed tokens of a single item."""
+    tokens = build_tokens(item)
+    with transaction.atomic():
+        ItemSearchToken.objects.filter(item=item).delete()
+        ItemSearchToken.objects.bulk_create([
+            ItemSearchToken(item=item, token=token, weight=weight)
+            for token, weight in tokens.items()
+        ])
+
+
+def rebuild_index(batch_size=500):
+    """Rebuild the whole index. Returns the number of items indexed."""
+    count = 0
+    with transaction.atomic():
+        ItemSearchToken.objects.all().delete()
+        rows = []
+        for item in Item.objects.only('id', 'name', 'description').iterator(chunk_size=batch_size):
+            for token, weight in build_tokens(item).items():
+                rows.append(ItemSearchToken(item_id=item.id, token=token, weight=weight))
+            count += 1
+            if len(rows) >= batch_size:
+                ItemSearchToken.objects.bulk_create(rows, batch_size=batch_size)
+                rows = []
+        ItemSearchToken.objects.bulk_create(rows, batch_size=batch_size)
+    return count
+
+
+def _term_match(term):
+    # Tokens are lowercased, and istartswith compiles to a plain LIKE that
+    # uses the index of the case-insensitive column on MySQL.
+    if len(term) < MIN_PREFIX_LENGTH:
+        return Q(token=term)
+    return Q(token__istartswith=term)
+
+
+def search(queryset, query):
+    """
+    Filter ``queryset`` down to items matching every term of ``query`` and
+    annotate each with a ``search_rank`` relevance score.
+
+    Every term is matched as a prefix of an indexed token (terms shorter
+    than MIN_PREFIX_LENGTH as a whole token), so the lookups are index
+    range scans on ``ItemSearchToken.token`` instead of ``LIKE '%...%'``
+    scans over the item table. A query without terms matches nothing.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TOKENS]
+    if not terms:
+        # Still sortable by relevance, like any other search result.
+        return queryset.none().annotate(search_rank=Value(0, output_field=IntegerField()))
+
+    any_term = Q()
+    for term in terms:
+        queryset = queryset.filter(
+            id__in=ItemSearchToken.objects.filter(_term_match(term)).values('item_id')
+        )
+        any_term |= _term_match(term)
+
+    rank = (
+        ItemSearchToken.objects
+        .filter(any_term, item_id=OuterRef('pk'))
+        .values('item_id')
+        .annotate(score=Sum(Case(
+            When(token__in=terms, then=F('weight') * EXACT_MATCH_BONUS),
+            default=F('weight'),
+            output_field=IntegerField(),
+        )))
+        .values('score')
+    )
+    return queryset.annotate(
+        search_rank=Coalesce(Subquery(rank, output_field=IntegerField()), Value(0))
+    )
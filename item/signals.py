@@ -0,0 +1,213 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import counters, facets, gallery, refdata
+from .caching import bump_catalog_version
+from .models import Category, City, Item, ItemColor, ItemColorImage, Place
+from .search import index_item
+from .tasks import queue_delete_image, queue_variants, queue_warm_catalog
+
+
+@receiver(post_save, sender=Item)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    # Tokens are removed together with the item by the CASCADE on
+    # ItemSearchToken.item, so only saves need handling here.
+    if raw:
+        return
+    index_item(instance)
+
+
+# Variants are rendered by a background job; pages link the original
+# upload until they exist.
+@receiver(post_save, sender=Item)
+def generate_item_image_variants(sender, instance, raw=False, **kwargs):
+    if raw or not instance.image:
+        return
+    queue_variants(instance.image.name)
+
+
+@receiver(post_save, sender=ItemColorImage)
+def generate_color_image_variants(sender, instance, raw=False, **kwargs):
+    if raw or not instance.image:
+        return
+    queue_variants(instance.image.name)
+
+
+# Images of deleted rows and replaced images are left to gc_media, or
+# removed by a job once nothing references them with MEDIA_DELETE_ON_RELEASE.
+@receiver(post_save, sender=Item)
+@receiver(post_save, sender=ItemColorImage)
+def delete_replaced_image(sender, instance, raw=False, **kwargs):
+    # Set by base.signals before the save: the stored image names.
+    previous = getattr(instance, '_stored_blob_names', None)
+    if raw or not previous or not getattr(settings, 'MEDIA_DELETE_ON_RELEASE', False):
+        return
+    for name in previous:
+        if name != instance.image.name:
+            queue_delete_image(name)
+
+
+@receiver(post_delete, sender=Item)
+@receiver(post_delete, sender=ItemColorImage)
+def delete_released_image(sender, instance, **kwargs):
+    if instance.image and getattr(settings, 'MEDIA_DELETE_ON_RELEASE', False):
+        queue_delete_image(instance.image.name)
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def invalidate_item_gallery(sender, instance, **kwargs):
+    gallery.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=ItemColor)
+@receiver(post_delete, sender=ItemColor)
+def invalidate_color_gallery(sender, instance, **kwargs):
+    gallery.invalidate(instance.item_id)
+
+
+@receiver(post_save, sender=ItemColorImage)
+@receiver(post_delete, sender=ItemColorImage)
+def invalidate_color_image_gallery(sender, instance, **kwargs):
+    # The color may already be gone when the image is deleted by a cascade;
+    # the color's own post_delete invalidates the gallery in that case.
+    item_id = ItemColor.objects.filter(pk=instance.color_id).values_list('item_id', flat=True).first()
+    if item_id:
+        gallery.invalidate(item_id)
+
+
+# Cities and places are in the order form of the cached detail page.
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+@receiver(post_save, sender=Place)
+@receiver(post_delete, sender=Place)
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+@receiver(post_save, sender=ItemColor)
+@receiver(post_delete, sender=ItemColor)
+@receiver(post_save, sender=ItemColorImage)
+@receiver(post_delete, sender=ItemColorImage)
+def invalidate_catalog_pages(sender, raw=False, **kwargs):
+    bump_catalog_version()
+    if not raw:
+        queue_warm_catalog()
+
+
+@receiver(pre_save, sender=Item)
+def remember_facet_state(sender, instance, raw=False, **kwargs):
+    instance._facet_state = None if raw else facets.facet_state(instance)
+
+
+# Only edits that can move an item between facet options rebuild the facet
+# index; images count for the "has photos" facet.
+@receiver(post_save, sender=Item)
+def invalidate_item_facets(sender, instance, **kwargs):
+    if facets.facets_changed(instance, getattr(instance, '_facet_state', None)):
+        facets.bump_facets_version()
+
+
+@receiver(post_delete, sender=Item)
+@receiver(post_save, sender=ItemColor)
+@receiver(post_delete, sender=ItemColor)
+@receiver(post_delete, sender=ItemColorImage)
+def invalidate_facets(sender, **kwargs):
+    facets.bump_facets_version()
+
+
+@receiver(post_save, sender=ItemColorImage)
+def invalidate_color_image_facets(sender, created, **kwargs):
+    if created:
+        facets.bump_facets_version()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+@receiver(post_save, sender=Place)
+@receiver(post_delete, sender=Place)
+def invalidate_refdata(sender, **kwargs):
+    refdata.invalidate()
+
+
+@receiver(pre_save, sender=Item)
+@receiver(pre_save, sender=ItemColor)
+@receiver(pre_save, sender=ItemColorImage)
+def remember_counted_state(sender, instance, raw=False, **kwargs):
+    instance._counted_state = None if raw else counters.previous_state(instance)
+
+
+def _move(add, previous, current):
+    """
+    Move one row between counters. States are (key, counted) pairs, e.g.
+    (category_id, not is_sold) for an item; ``previous`` is None for a new row.
+    """
+    before = previous[0] if previous and previous[1] else None
+    after = current[0] if current[1] else None
+    if before != after:
+        if before:
+            add(before, -1)
+        if after:
+            add(after, 1)
+
+
+@receiver(post_save, sender=Item)
+def count_item(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_counted_state', None)
+    _move(
+        counters.add_items,
+        previous and (previous[0], not previous[1]),
+        (instance.category_id, not instance.is_sold),
+    )
+
+
+@receiver(post_delete, sender=Item)
+def uncount_item(sender, instance, **kwargs):
+    if not instance.is_sold:
+        counters.add_items(instance.category_id, -1)
+
+
+@receiver(post_save, sender=ItemColor)
+def count_color(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_counted_state', None)
+    _move(
+        counters.add_available_colors,
+        previous and (previous[0], not previous[1]),
+        (instance.item_id, not instance.is_sold_out),
+    )
+    if previous and previous[0] != instance.item_id:
+        # The color's images move to the other item with it.
+        images = instance.images.count()
+        counters.add_images_to_item(previous[0], -images)
+        counters.add_images_to_item(instance.item_id, images)
+
+
+@receiver(post_delete, sender=ItemColor)
+def uncount_color(sender, instance, **kwargs):
+    # Its images were deleted (and uncounted) first by the cascade.
+    if not instance.is_sold_out:
+        counters.add_available_colors(instance.item_id, -1)
+
+
+@receiver(post_save, sender=ItemColorImage)
+def count_color_image(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_counted_state', None)
+    if previous is None:
+        counters.add_images(instance.color_id, 1)
+    elif previous[0] != instance.color_id:
+        counters.add_images(previous[0], -1)
+        counters.add_images(instance.color_id, 1)
+
+
+@receiver(post_delete, sender=ItemColorImage)
+def uncount_color_image(sender, instance, **kwargs):
+    counters.add_images(instance.color_id, -1)
@@ -0,0 +1,60 @@
+"""
+Stock reservation for orders.
+
+A reservation is one conditional UPDATE (``SET stock_quantity =
+stock_quantity - 1 ... WHERE stock_quantity >= 1``) run inside the
+transaction that saves the ItemRequest: the database serializes concurrent
+buyers on the row lock, so the last unit can only be sold once and no table
+is locked. Rows whose stock is not tracked (NULL) only need to be available.
+"""
+from django.db.models import Case, F, Q, Value, When
+
+from . import counters, gallery
+from .caching import bump_catalog_version
+from .facets import bump_facets_version
+from .models import Item, ItemColor
+
+
+class OutOfStock(Exception):
+    pass
+
+
+def _take(queryset, flag, quantity):
+    """
+    Decrement ``stock_quantity`` of the one row in ``queryset`` and set
+    ``flag`` when it reaches zero. Returns True when the row had the units.
+    """
+    available = queryset.filter(**{flag: False}).filter(
+        Q(stock_quantity__isnull=True) | Q(stock_quantity__gte=quantity)
+    )
+    # The flag is assigned first: MySQL evaluates SET assignments left to
+    # right, so it must still see the quantity from before the decrement.
+    # NULL - quantity stays NULL, leaving untracked rows unchanged.
+    return bool(available.update(**{
+        flag: Case(When(stock_quantity=quantity, then=Value(True)), default=Value(False)),
+        'stock_quantity': F('stock_quantity') - quantity,
+    }))
+
+
+def reserve(item, color=None, quantity=1):
+    """
+    Take ``quantity`` units of ``color`` (or of ``item`` when it has no
+    colors). Must run in the transaction that records the order; raises
+    OutOfStock when the units are gone.
+    """
+    if color is not None:
+        if not _take(ItemColor.objects.filter(pk=color.pk, item_id=item.pk), 'is_sold_out', quantity):
+            raise OutOfStock(color)
+        if ItemColor.objects.filter(pk=color.pk, is_sold_out=True).exists():
+            # update() skips the signals that react to a color selling out.
+            counters.add_available_colors(item.pk, -1)
+            gallery.invalidate(item.pk)
+            bump_catalog_version()
+            bump_facets_version()
+    else:
+        if not _take(Item.objects.filter(pk=item.pk), 'is_sold', quantity):
+            raise OutOfStock(item)
+        if Item.objects.filter(pk=item.pk, is_sold=True).exists():
+            counters.add_items(item.category_id, -1)
+            bump_catalog_version()
+            bump_facets_version()
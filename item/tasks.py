@@ -0,0 +1,67 @@
+"""
+Background jobs of the catalog (see base.jobs), queued by item.signals
+after catalog edits and run by ``manage.py run_worker``.
+"""
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+
+from base import jobs
+
+from . import refdata
+from .caching import bump_catalog_version
+from .images import generate_variants
+from .orphans import MEDIA_DELETE_DELAY, delete_if_orphaned
+
+# Edits within this many seconds are warmed by the same job.
+WARM_DELAY = 5
+
+
+def queue_variants(source):
+    jobs.enqueue('item.generate_variants', {'source': source}, dedup_key=f'item.variants:{source}')
+
+
+def queue_warm_catalog():
+    jobs.enqueue('item.warm_catalog', dedup_key='item.warm_catalog', delay=WARM_DELAY)
+
+
+def queue_delete_image(name):
+    jobs.enqueue('item.delete_image', {'name': name}, dedup_key=f'item.delete_image:{name}', delay=MEDIA_DELETE_DELAY)
+
+
+@jobs.register('item.generate_variants')
+def generate_image_variants(source):
+    if generate_variants(source):
+        # Pages rendered since the upload link the original image.
+        bump_catalog_version()
+        queue_warm_catalog()
+
+
+def warm_paths():
+    return [reverse('base:index'), reverse('item:items')] + [
+        reverse('item:category', args=[category.id]) for category in refdata.categories()
+    ]
+
+
+@jobs.register('item.warm_catalog')
+def warm_catalog():
+    """
+    Render the main catalog pages for an anonymous visitor, so the page
+    cache is filled for the new catalog version before visitors ask.
+    """
+    # The views are called directly; their cache_catalog_page decorator
+    # stores the pages, the middleware adds nothing the cache keeps.
+    factory = RequestFactory(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+    for path in warm_paths():
+        request = factory.get(path, secure=not settings.DEBUG)
+        request.user = AnonymousUser()
+        match = resolve(path)
+        response = match.func(request, *match.args, **match.kwargs)
+        if response.status_code != 200:
+            raise RuntimeError(f'Warming {path} returned {response.status_code}')
+
+
+@jobs.register('item.delete_image')
+def delete_image(name):
+    delete_if_orphaned(name)
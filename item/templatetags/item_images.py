@@ -0,0 +1,67 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from item.images import get_variants, variant_url
+
+register = template.Library()
+
+# Default ``sizes`` for product cards in the catalog grids.
+CARD_SIZES = '(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw'
+
+
+def _source(image):
+    # Accept an ImageFieldFile or a plain storage name (gallery manifest).
+    return getattr(image, 'name', image) or ''
+
+
+def _variants(context, source):
+    # Views load the variants of every image on the page at once into
+    # ``image_variants`` (see item.images.get_variants_many).
+    loaded = context.get('image_variants') or {}
+    return loaded[source] if source in loaded else get_variants(source)
+
+
+@register.simple_tag(takes_context=True)
+def image_url(context, image, variant='full'):
+    """URL of a derivative of ``image``, or of the original upload."""
+    source = _source(image)
+    return variant_url(source, variant, _variants(context, source)) if source else ''
+
+
+@register.simple_tag(takes_context=True)
+def responsive_image(context, image, variant='card', alt='', css_class='', sizes=CARD_SIZES, lazy=True, **attrs):
+    """
+    Render an <img> for ``image``. ``thumb`` renders the fixed-size
+    thumbnail; ``card`` and ``full`` render a card/full ``srcset`` so the
+    browser picks the smallest file that fits. Falls back to the original
+    upload while derivatives have not been generated yet.
+    """
+    source = _source(image)
+    if not source:
+        return ''
+
+    variants = _variants(context, source)
+    extra = flatatt({name.replace('_', '-'): value for name, value in attrs.items()})
+    loading = 'lazy' if lazy else 'eager'
+
+    if variant == 'thumb' and 'thumb' in variants:
+        url, width, height = variants['thumb']
+        return format_html(
+            '<img src="{}" width="{}" height="{}" alt="{}" class="{}" loading="{}" decoding="async"{}>',
+            url, width, height, alt, css_class, loading, extra,
+        )
+
+    if 'card' in variants and 'full' in variants:
+        card_url, card_width, _ = variants['card']
+        full_url, full_width, _ = variants['full']
+        src = card_url if variant == 'card' else full_url
+        return format_html(
+            '<img src="{}" srcset="{} {}w, {} {}w" sizes="{}" alt="{}" class="{}" loading="{}" decoding="async"{}>',
+            src, card_url, card_width, full_url, full_width, sizes, alt, css_class, loading, extra,
+        )
+
+    return format_html(
+        '<img src="{}" alt="{}" class="{}" loading="{}" decoding="async"{}>',
+        variant_url(source, variant, variants), alt, css_class, loading, extra,
+    )
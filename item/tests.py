@@ -1,3 +1,1180 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from base import jobs
+from base.models import Job, MediaBlob
+from . import orphans
+from .models import Category, City, ImageVariant, Item, ItemColor, ItemColorImage, ItemRequest, ItemSearchToken, Place
+
+
+class RefDataTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.damascus = City.objects.create(name='Damascus')
+        cls.aleppo = City.objects.create(name='Aleppo')
+        cls.center = Place.objects.create(city=cls.damascus, name='Center')
+        Place.objects.create(city=cls.aleppo, name='Old city')
+        Category.objects.create(name='Shirts')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_loaded_once_per_version(self):
+        from . import refdata
+
+        with self.assertNumQueries(3):
+            self.assertEqual([city.name for city in refdata.cities()], ['Aleppo', 'Damascus'])
+        with self.assertNumQueries(0):
+            refdata.categories()
+            self.assertEqual(refdata.places_for_city(self.damascus.id), (refdata.PlaceRef(self.center.id, self.damascus.id, 'Center'),))
+
+        # Another worker edited the tables.
+        Category.objects.update(name='Tops')
+        refdata._bump()
+        with self.assertNumQueries(3):
+            self.assertEqual([category.name for category in refdata.categories()], ['Tops'])
+
+    def test_admin_edits_invalidate(self):
+        from . import refdata
+
+        refdata.cities()
+        City.objects.create(name='Homs')
+        self.assertEqual([city.name for city in refdata.cities()], ['Aleppo', 'Damascus', 'Homs'])
+        self.center.delete()
+        self.assertEqual(refdata.places_for_city(self.damascus.id), ())
+
+    def test_request_form_choices(self):
+        from .forms import ItemRequestForm
+
+        item = Item.objects.create(category=Category.objects.get(), name='Shirt', price=10, created_by=User.objects.create_user('seller'))
+        form = ItemRequestForm(item=item)
+        self.assertEqual(list(form.fields['city'].choices)[1:], [(self.aleppo.id, 'Aleppo'), (self.damascus.id, 'Damascus')])
+        self.assertEqual(list(form.fields['place'].choices), [('', '---------')])
+
+        data = {'customer_name': 'Buyer', 'customer_phone': '0999', 'city': self.damascus.id, 'place': self.center.id}
+        form = ItemRequestForm(data, item=item)
+        self.assertEqual(list(form.fields['place'].choices)[1:], [(self.center.id, 'Center')])
+        self.assertTrue(form.is_valid(), form.errors)
+
+
+class PlacesAPITests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.damascus = City.objects.create(name='Damascus')
+        cls.center = Place.objects.create(city=cls.damascus, name='Center')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_city_places_revalidate(self):
+        url = f'/items/api/places/{self.damascus.id}/'
+        response = self.client.get(url)
+        self.assertEqual(json.loads(response.content), {'places': [{'id': self.center.id, 'name': 'Center'}]})
+        self.assertIn('no-cache', response['Cache-Control'])
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.center.name = 'Downtown'
+        self.center.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Downtown')
+
+    def test_bundle_is_immutable(self):
+        from . import refdata
+
+        digest = refdata.places_bundle().digest
+        url = f'/items/api/places/bundle/{digest}.json'
+        response = self.client.get(url)
+        self.assertEqual(json.loads(response.content)['cities'][0]['places'], [{'id': self.center.id, 'name': 'Center'}])
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        self.assertEqual(response['ETag'], f'"{digest}"')
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=f'"{digest}"')
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_outdated_bundle_redirects(self):
+        from . import refdata
+
+        old = refdata.places_bundle().digest
+        Place.objects.create(city=self.damascus, name='Airport')
+        current = refdata.places_bundle().digest
+        self.assertNotEqual(old, current)
+
+        response = self.client.get(f'/items/api/places/bundle/{old}.json')
+        self.assertRedirects(response, f'/items/api/places/bundle/{current}.json')
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+
+class AdminQueryCountTests(TestCase):
+    """Admin pages must issue the same number of queries however many rows they show."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.category = Category.objects.create(name='Shirts')
+        cls.city = City.objects.create(name='Damascus')
+        cls.item = cls.make_item('Main')
+
+    @classmethod
+    def make_item(cls, name):
+        return Item.objects.create(category=cls.category, name=name, price=10, created_by=cls.admin)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+        self.rows = 0
+
+    def add_rows(self, count):
+        for _ in range(count):
+            self.rows += 1
+            n = self.rows
+            other = self.make_item(f'Item {n}')
+            color = ItemColor.objects.create(item=self.item, name=f'Color {n}')
+            ItemColor.objects.create(item=other, name=f'Color {n}')
+            for i in range(2):
+                ItemColorImage.objects.create(color=color, image=f'item_color_images/{n}-{i}.jpg')
+            place = Place.objects.create(city=City.objects.create(name=f'City {n}'), name=f'Place {n}')
+            Place.objects.create(city=self.city, name=f'Place {n}')
+            ItemRequest.objects.create(
+                item=other, color=color, customer_name=f'Customer {n}', customer_phone='0999',
+                city=place.city, place=place,
+            )
+
+    def count_queries(self, url):
+        # Warm up per-process caches (content types, permissions) first
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, url):
+        self.add_rows(2)
+        few = self.count_queries(url)
+        self.add_rows(8)
+        self.assertEqual(self.count_queries(url), few)
+
+    def test_item_changelist(self):
+        self.assertConstantQueries('/admin/item/item/')
+
+    def test_item_change_view(self):
+        self.assertConstantQueries(f'/admin/item/item/{self.item.pk}/change/')
+
+    def test_itemcolor_changelist(self):
+        self.assertConstantQueries('/admin/item/itemcolor/')
+
+    def test_itemcolor_change_view(self):
+        color = ItemColor.objects.create(item=self.item, name='Base')
+        ItemColorImage.objects.create(color=color, image='item_color_images/base.jpg')
+        self.assertConstantQueries(f'/admin/item/itemcolor/{color.pk}/change/')
+
+    def test_itemcolorimage_changelist(self):
+        self.assertConstantQueries('/admin/item/itemcolorimage/')
+
+    def test_itemcolorimage_change_view(self):
+        color = ItemColor.objects.create(item=self.item, name='Base')
+        image = ItemColorImage.objects.create(color=color, image='item_color_images/base.jpg')
+        self.assertConstantQueries(f'/admin/item/itemcolorimage/{image.pk}/change/')
+
+    def test_city_changelist(self):
+        self.assertConstantQueries('/admin/item/city/')
+
+    def test_place_changelist(self):
+        self.assertConstantQueries('/admin/item/place/')
+
+    def test_itemrequest_changelist(self):
+        self.assertConstantQueries('/admin/item/itemrequest/')
+
+    def test_itemrequest_change_view(self):
+        request = ItemRequest.objects.create(item=self.item, customer_name='Customer', customer_phone='0999')
+        self.assertConstantQueries(f'/admin/item/itemrequest/{request.pk}/change/')
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('seller')
+        category = Category.objects.create(name='Shirts')
+        Item.objects.create(category=category, name='Red shirt', description='Cotton', price=10, created_by=user)
+        Item.objects.create(category=category, name='Blue shirt', description='Red stripes', price=20, created_by=user)
+        Item.objects.create(category=category, name='أحمر', price=30, created_by=user)
+        Item.objects.create(category=category, name='A B', price=40, created_by=user)
+
+    def setUp(self):
+        cache.clear()
+
+    def names(self, query):
+        from .search import search
+        return list(search(Item.objects.all(), query).order_by('-search_rank', 'id').values_list('name', flat=True))
+
+    def test_prefix_terms_ranked_by_field(self):
+        self.assertEqual(self.names('RED'), ['Red shirt', 'Blue shirt'])
+        self.assertEqual(self.names('shi str'), ['Blue shirt'])
+        self.assertEqual(self.names('احمر'), ['أحمر'])
+
+    def test_short_terms_match_whole_tokens(self):
+        self.assertEqual(self.names('a'), ['A B'])
+        self.assertEqual(self.names('r'), [])
+
+    def test_query_without_terms(self):
+        self.assertEqual(self.names('!!'), [])
+        for query in ('!!', '%', '-'):
+            self.assertEqual(self.client.get('/items/', {'query': query}).status_code, 200)
+            response = self.client.get('/items/api/items/', {'query': query})
+            self.assertEqual((response.status_code, response.json()['results']), (200, []))
+
+
+class SeedCatalogTests(TestCase):
+    def seed(self, **options):
+        call_command(
+            'seed_catalog', items=20, categories=3, cities=2, places=2, requests=10,
+            batch_size=7, stdout=StringIO(), **options,
+        )
+        return list(Item.objects.order_by('external_id').values_list('external_id', 'name', 'price', 'category__name'))
+
+    def test_same_seed_same_catalog(self):
+        first = self.seed()
+        self.assertEqual(len(first), 20)
+        self.assertEqual(ItemColor.objects.count(), 60)
+        self.assertEqual(ItemColorImage.objects.count(), 120)
+        self.assertEqual(ItemRequest.objects.count(), 10)
+        self.assertEqual(self.seed(flush=True), first)
+        self.assertEqual(ItemRequest.objects.count(), 10)
+
+
+class PaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('seller')
+        category = Category.objects.create(name='Shirts')
+        # Five items share a price, so pages break inside the tie.
+        Item.objects.bulk_create([
+            Item(category=category, name=f'Shirt {n}', price=10 if n < 5 else n, created_by=user)
+            for n in range(7)
+        ])
+
+    def pages(self, sort, page_size):
+        from .pagination import paginate
+
+        pages, cursor = [], None
+        while True:
+            page = paginate(Item.objects.all(), sort, cursor, page_size)
+            pages.append([item.id for item in page])
+            if not page.has_next:
+                return pages
+            cursor = page.next_cursor
+
+    def test_ties_are_neither_skipped_nor_repeated(self):
+        expected = list(Item.objects.order_by('price', 'id').values_list('id', flat=True))
+        for page_size in (1, 2, 3, 4):
+            pages = self.pages('price_asc', page_size)
+            self.assertEqual([item_id for page in pages for item_id in page], expected)
+        expected = list(Item.objects.order_by('-price', '-id').values_list('id', flat=True))
+        self.assertEqual(sum(self.pages('price_desc', 2), []), expected)
+
+    def test_end_of_results(self):
+        from .pagination import encode_cursor, paginate
+
+        # No empty trailing page when the items fill the last page exactly.
+        self.assertEqual([len(page) for page in self.pages('name', 7)], [7])
+        self.assertEqual([len(page) for page in self.pages('name', 3)], [3, 3, 1])
+
+        last = Item.objects.order_by('-created_at', '-id').last()
+        page = paginate(Item.objects.all(), 'newest', encode_cursor('newest', last), 3)
+        self.assertEqual(list(page), [])
+        self.assertFalse(page.has_next)
+
+    def test_tampered_cursor_starts_over(self):
+        from .pagination import paginate
+
+        first = paginate(Item.objects.all(), 'price_asc', None, 2)
+        cursor = first.next_cursor
+        tampered = cursor[:-2] + ('AA' if cursor[-2:] != 'AA' else 'BB')
+        for bad in (tampered, 'garbage', cursor.split(':')[0]):
+            self.assertEqual(list(paginate(Item.objects.all(), 'price_asc', bad, 2)), list(first))
+        # A cursor of another sort order is ignored as well.
+        self.assertEqual(
+            list(paginate(Item.objects.all(), 'price_desc', cursor, 2)),
+            list(paginate(Item.objects.all(), 'price_desc', None, 2)),
+        )
+
+        response = self.client.get('/items/', {'sort': 'price_asc', 'cursor': tampered})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(response.context['items']),
+            list(self.client.get('/items/', {'sort': 'price_asc'}).context['items']),
+        )
+
+
+class FacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('seller')
+        cls.shirts = Category.objects.create(name='Shirts')
+        cls.shoes = Category.objects.create(name='Shoes')
+        cheap = Item.objects.create(category=cls.shirts, name='Cheap shirt', price=10, created_by=user)
+        Item.objects.create(category=cls.shirts, name='Dear shirt', price=300, created_by=user, image='item_images/a.jpg')
+        boots = Item.objects.create(category=cls.shoes, name='Boots', price=60, created_by=user)
+        Item.objects.create(category=cls.shoes, name='Sold boots', price=60, created_by=user, is_sold=True)
+        ItemColor.objects.create(item=cheap, name='red')
+        ItemColor.objects.create(item=boots, name='red', is_sold_out=True)
+        ItemColorImage.objects.create(color=ItemColor.objects.create(item=boots, name='black'), image='x.jpg')
+
+    def setUp(self):
+        cache.clear()
+
+    def counts(self, **params):
+        from .facets import get_counts, get_filters
+        return get_counts(get_filters(params))
+
+    def test_counts_apply_other_facets(self):
+        counts = self.counts(category=str(self.shirts.id))
+        self.assertEqual(counts['category'], {self.shirts.id: 2, self.shoes.id: 1})
+        self.assertEqual(counts['price'], {'0-25': 1, '50-100': 0, '250-': 1})
+        self.assertEqual(counts['color'], {'red': 1, 'black': 0})
+        self.assertEqual(counts['photos'], 1)
+
+        counts = self.counts(color='red', photos='1')
+        self.assertEqual(counts['color'], {'red': 0, 'black': 1})
+        self.assertEqual(counts['photos'], 0)
+
+    def test_items_page_filters(self):
+        response = self.client.get('/items/', {'price': '50-100', 'photos': '1'})
+        self.assertEqual([item.name for item in response.context['items']], ['Boots'])
+
+        response = self.client.get('/items/', {'color': 'red'})
+        self.assertEqual([item.name for item in response.context['items']], ['Cheap shirt'])
+
+    def test_single_filter_counts_are_cached(self):
+        self.counts(category=str(self.shirts.id))
+        with self.assertNumQueries(0):
+            self.counts(category=str(self.shirts.id))
+
+    def test_index_is_kept_across_unrelated_edits(self):
+        from . import facets
+
+        index = facets.get_index()
+        item = Item.objects.get(name='Boots')
+        item.description = 'Leather'
+        item.save()
+        ItemColor.objects.filter(item=item).update(stock_quantity=3)
+        self.assertIs(facets.get_index(), index)
+
+        item.price = 20
+        item.save()
+        self.assertEqual(self.counts(price='0-25')['price']['0-25'], 2)
+
+    def test_previous_index_is_used_while_rebuilding(self):
+        from . import facets
+
+        index = facets.get_index()
+        facets.bump_facets_version()
+        with facets._lock:
+            self.assertIs(facets.get_index(), index)
+        self.assertIsNot(facets.get_index(), index)
+
+    def test_counts_within_query(self):
+        response = self.client.get('/items/', {'query': 'shirt'})
+        categories = {option.value: option.count for option in response.context['facets'][0].options}
+        self.assertEqual(categories, {self.shirts.id: 2})
+
+
+class CounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('seller')
+        cls.shirts = Category.objects.create(name='Shirts')
+        cls.shoes = Category.objects.create(name='Shoes')
+
+    def assertCounts(self, item, colors, images):
+        item.refresh_from_db()
+        self.assertEqual((item.available_colors_count, item.images_count), (colors, images))
+
+    def test_signals_keep_counters(self):
+        item = Item.objects.create(category=self.shirts, name='Shirt', price=10, created_by=self.user)
+        red = ItemColor.objects.create(item=item, name='red')
+        blue = ItemColor.objects.create(item=item, name='blue', is_sold_out=True)
+        ItemColorImage.objects.create(color=red, image='a.jpg')
+        ItemColorImage.objects.create(color=blue, image='b.jpg')
+        self.assertCounts(item, 1, 2)
+
+        blue.is_sold_out = False
+        blue.save()
+        self.assertCounts(item, 2, 2)
+        red.delete()
+        self.assertCounts(item, 1, 1)
+
+        self.shirts.refresh_from_db()
+        self.assertEqual(self.shirts.items_count, 1)
+        item.category = self.shoes
+        item.save()
+        item.is_sold = True
+        item.save()
+        self.shirts.refresh_from_db()
+        self.shoes.refresh_from_db()
+        self.assertEqual((self.shirts.items_count, self.shoes.items_count), (0, 0))
+
+    def test_category_counts_leave_refdata_cached(self):
+        from . import refdata
+
+        version = refdata.get_version()
+        item = Item.objects.create(category=self.shirts, name='Shirt', price=10, created_by=self.user)
+        self.assertEqual(refdata.get_version(), version)
+        response = self.client.get('/items/api/categories/')
+        self.assertEqual({row['name']: row['items_count'] for row in response.json()['results']}, {'Shirts': 1, 'Shoes': 0})
+
+        item.is_sold = True
+        item.save()
+        self.assertEqual(refdata.get_version(), version)
+        self.assertContains(self.client.get('/'), '0 items', count=2)
+
+    def test_save_keeps_concurrent_counter_changes(self):
+        item = Item.objects.create(category=self.shirts, name='Shirt', price=10, created_by=self.user)
+        stale = Item.objects.get(pk=item.pk)
+        ItemColor.objects.create(item=item, name='red')
+        stale.price = 12
+        stale.save()
+        self.assertCounts(item, 1, 0)
+
+    def test_saves_keep_django_semantics(self):
+        item = Item.objects.create(category=self.shirts, name='Shirt', price=10, created_by=self.user)
+        ItemColor.objects.create(item=item, name='red')
+
+        partial = Item.objects.only('name').get(pk=item.pk)
+        partial.name = 'Blouse'
+        with CaptureQueriesContext(connection) as queries:
+            partial.save()
+        item_reads = [query for query in queries if query['sql'].startswith('SELECT') and 'FROM "item_item"' in query['sql']]
+        # The stock check of Item.save, then the one row the receivers share.
+        self.assertEqual(len(item_reads), 2)
+        self.assertCounts(item, 1, 0)
+        self.assertEqual(Item.objects.get(pk=item.pk).name, 'Blouse')
+
+        # A row deleted behind the instance's back is inserted again.
+        stale = Item.objects.get(pk=item.pk)
+        Item.objects.filter(pk=item.pk).delete()
+        stale.save()
+        self.assertTrue(Item.objects.filter(pk=item.pk, name='Blouse').exists())
+
+    def test_one_read_of_the_stored_row_per_save(self):
+        item = Item.objects.create(category=self.shirts, name='Shirt', price=10, created_by=self.user)
+        item.price = 30
+        with CaptureQueriesContext(connection) as queries:
+            item.save()
+        item_reads = [query for query in queries if query['sql'].startswith('SELECT') and 'FROM "item_item"' in query['sql']]
+        self.assertEqual(len(item_reads), 1)
+
+    def test_recount_repairs_drift(self):
+        item = Item.objects.create(category=self.shirts, name='Shirt', price=10, created_by=self.user)
+        ItemColorImage.objects.create(color=ItemColor.objects.create(item=item, name='red'), image='a.jpg')
+        Item.objects.update(available_colors_count=7, images_count=0)
+        Category.objects.update(items_count=0)
+        call_command('recount', stdout=StringIO())
+        self.assertCounts(item, 1, 1)
+        self.shirts.refresh_from_db()
+        self.assertEqual(self.shirts.items_count, 1)
+
+
+class StockTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('seller')
+        category = Category.objects.create(name='Shirts')
+        cls.item = Item.objects.create(category=category, name='Shirt', price=10, created_by=user)
+        cls.plain = Item.objects.create(category=category, name='Cap', price=5, created_by=user, stock_quantity=1)
+        cls.place = Place.objects.create(city=City.objects.create(name='Damascus'), name='Center')
+
+    def order(self, item, color=None):
+        return self.client.post(f'/items/{item.pk}/', {
+            'color': color.pk if color else '', 'customer_name': 'Buyer', 'customer_phone': '0999',
+            'city': self.place.city_id, 'place': self.place.pk,
+        })
+
+    def test_last_unit_sells_once(self):
+        color = ItemColor.objects.create(item=self.item, name='red', stock_quantity=1)
+        self.assertEqual(self.order(self.item, color).status_code, 302)
+        color.refresh_from_db()
+        self.item.refresh_from_db()
+        self.assertEqual((color.stock_quantity, color.is_sold_out), (0, True))
+        self.assertEqual(self.item.available_colors_count, 0)
+
+        self.assertEqual(self.order(self.item, color).status_code, 200)
+        self.assertEqual(ItemRequest.objects.count(), 1)
+
+    def test_reserve_is_conditional(self):
+        from .stock import OutOfStock, reserve
+
+        color = ItemColor.objects.create(item=self.item, name='red', stock_quantity=1)
+        stale = ItemColor.objects.get(pk=color.pk)
+        reserve(self.item, color)
+        with self.assertRaises(OutOfStock):
+            reserve(self.item, stale)
+
+    def test_untracked_stock_is_unlimited(self):
+        color = ItemColor.objects.create(item=self.item, name='red')
+        for _ in range(3):
+            self.assertEqual(self.order(self.item, color).status_code, 302)
+        color.refresh_from_db()
+        self.assertEqual((color.stock_quantity, color.is_sold_out), (None, False))
+
+    def test_item_without_colors(self):
+        self.assertEqual(self.order(self.plain).status_code, 302)
+        self.plain.refresh_from_db()
+        self.assertTrue(self.plain.is_sold)
+        self.assertEqual(self.order(self.plain).status_code, 200)
+
+
+class ImportCatalogTests(TransactionTestCase):
+    # Images are copied by threads with their own connections.
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dir = directory.name
+        with open(os.path.join(self.dir, 'red.jpg'), 'wb') as fh:
+            fh.write(b'red')
+        User.objects.create_superuser('admin')
+
+    def write(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w', encoding='utf-8') as fh:
+            fh.write(content)
+        return path
+
+    def run_import(self, path, **options):
+        out = StringIO()
+        call_command('import_catalog', path, images_dir=self.dir, batch_size=2, workers=2, stdout=out, **options)
+        return out.getvalue()
+
+    def test_jsonl_and_csv(self):
+        path = self.write('items.jsonl', '\n'.join(json.dumps(record) for record in [
+            {'external_id': 1, 'category': 'Shirts', 'name': 'Red shirt', 'price': '10.5', 'image': 'red.jpg',
+             'colors': [{'name': 'red', 'images': ['red.jpg']}, {'name': 'blue', 'is_sold_out': True}]},
+            {'external_id': 2, 'category': 'Shirts', 'name': 'Plain shirt', 'price': 8},
+            {'external_id': 3, 'category': 'Shoes', 'name': 'Boots', 'price': 60},
+        ]))
+        self.assertIn('Imported 3 items (0 already present)', self.run_import(path))
+        self.assertIn('Imported 0 items (3 already present)', self.run_import(path))
+
+        shirt = Item.objects.get(external_id='1')
+        self.assertEqual((shirt.price, shirt.category.items_count, shirt.available_colors_count, shirt.images_count), (10.5, 2, 1, 1))
+        self.assertEqual(MediaBlob.objects.get().refcount, 2)
+        self.assertTrue(ItemSearchToken.objects.filter(item=shirt, token='shirt').exists())
+
+        path = self.write('items.csv', 'external_id,category,name,price,colors\n4,Shoes,Sandals,20,black=red.jpg;white!\n')
+        self.run_import(path)
+        sandals = Item.objects.get(external_id='4')
+        self.assertEqual(list(sandals.colors.order_by('name').values_list('name', 'is_sold_out')), [('black', False), ('white', True)])
+
+    def test_invalid_records_name_their_line(self):
+        from django.core.management.base import CommandError
+
+        for records, error in (
+            ('{"external_id": 1, "category": "Shirts", "price": 1}', ':1: missing name'),
+            ('\n{"external_id": 1, "category": "Shirts", "name": "Shirt", "price": "cheap"}', ":2: invalid price 'cheap'"),
+            ('{"category": "Shirts", "name": "Shirt", "price": 1}', ':1: missing external_id'),
+            ('[1]', ':1: expected an object'),
+        ):
+            with self.subTest(error=error), self.assertRaisesMessage(CommandError, error):
+                self.run_import(self.write('bad.jsonl', records))
+        with self.assertRaisesMessage(CommandError, 'bad.csv:3: missing category'):
+            self.run_import(self.write('bad.csv', 'external_id,category,name,price\n1,Shirts,Shirt,1\n2,,Cap,1\n'))
+        self.assertFalse(Item.objects.exists())
+
+
+class ExportRequestsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('seller')
+        item = Item.objects.create(category=Category.objects.create(name='Shirts'), name='Shirt', price=10, created_by=user)
+        cls.city = City.objects.create(name='Damascus')
+        ItemRequest.objects.create(item=item, customer_name='=HYPERLINK("http://x")', customer_phone='+963 999', city=cls.city)
+        ItemRequest.objects.create(item=item, customer_name='Buyer', customer_phone='0999', is_contacted=True)
+
+    def test_command_filters_and_escapes_formulas(self):
+        import csv
+
+        out, err = StringIO(), StringIO()
+        call_command('export_requests', city='Damascus', stdout=out, stderr=err)
+        rows = list(csv.DictReader(StringIO(out.getvalue())))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['customer_name'], rows[0]['customer_phone']), ('\'=HYPERLINK("http://x")', "'+963 999"))
+        self.assertIn('Exported 1 requests', err.getvalue())
+
+        out = StringIO()
+        call_command('export_requests', format='jsonl', contacted='yes', chunk_size=1, stdout=out, stderr=StringIO())
+        self.assertEqual([json.loads(line)['customer_name'] for line in out.getvalue().splitlines()], ['Buyer'])
+
+    def test_date_range_is_an_indexable_range(self):
+        from datetime import date, datetime, timezone as dt_timezone
+        from .exports import filter_requests
+
+        first, second = ItemRequest.objects.order_by('pk')
+        ItemRequest.objects.filter(pk=first.pk).update(created_at=datetime(2026, 3, 1, 23, 59, 59, tzinfo=dt_timezone.utc))
+        ItemRequest.objects.filter(pk=second.pk).update(created_at=datetime(2026, 3, 2, 0, 0, tzinfo=dt_timezone.utc))
+
+        queryset = filter_requests(date_from=date(2026, 3, 1), date_to=date(2026, 3, 1))
+        self.assertEqual(list(queryset), [first])
+        self.assertEqual(list(filter_requests(date_from=date(2026, 3, 2))), [second])
+        sql = str(queryset.query).lower()
+        self.assertNotIn('date(', sql)
+        self.assertNotIn('django_datetime_cast_date', sql)
+
+    def test_admin_action_streams_selection(self):
+        self.client.force_login(User.objects.create_superuser('admin'))
+        response = self.client.post('/admin/item/itemrequest/', {
+            'action': 'export_jsonl', '_selected_action': list(ItemRequest.objects.values_list('pk', flat=True)),
+        })
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="requests-', response['Content-Disposition'])
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(sorted(row['customer_phone'] for row in rows), ['+963 999', '0999'])
+
+
+class CatalogPageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('seller')
+        cls.category = Category.objects.create(name='Shirts')
+        Item.objects.create(category=cls.category, name='First shirt', price=10, created_by=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def key(self):
+        from django.test import RequestFactory
+        from .caching import get_catalog_version, page_cache_key, page_digest
+        return page_cache_key(get_catalog_version(), page_digest(RequestFactory().get('/items/')))
+
+    def add_item(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            Item.objects.create(category=self.category, name=name, price=10, created_by=self.user)
+
+    def test_stale_page_is_refreshed_by_one_request(self):
+        from .caching import PAGE_CACHE_TIMEOUT
+
+        self.assertFalse(self.client.get('/items/').has_header('X-Page-Cache'))
+        entry = cache.get(self.key())
+        entry['created'] -= PAGE_CACHE_TIMEOUT + 1
+        entry['content'] = b'stale copy'
+        cache.set(self.key(), entry)
+
+        # While one request refreshes it, the others get the stale copy.
+        cache.add(f'{self.key()}:lock', 1)
+        self.assertEqual(self.client.get('/items/').content, b'stale copy')
+        cache.delete(f'{self.key()}:lock')
+        response = self.client.get('/items/')
+        self.assertFalse(response.has_header('X-Page-Cache'))
+        self.assertContains(response, 'First shirt')
+        self.assertEqual(self.client.get('/items/')['X-Page-Cache'], 'hit')
+
+    def test_burst_after_edit_never_gets_previous_page(self):
+        self.client.get('/items/')
+        self.add_item('Second shirt')
+        # Another request is rendering the new version: no waiting, and no
+        # page of the previous version.
+        cache.add(f'{self.key()}:lock', 1)
+        response = self.client.get('/items/')
+        self.assertFalse(response.has_header('X-Page-Cache'))
+        self.assertContains(response, 'Second shirt')
+        self.assertIsNone(cache.get(self.key()))
+
+        cache.delete(f'{self.key()}:lock')
+        self.client.get('/items/')
+        self.assertEqual(self.client.get('/items/')['X-Page-Cache'], 'hit')
+
+    def test_shared_pages_after_edit_are_current(self):
+        item = Item.objects.get()
+        self.client.get(f'/items/{item.pk}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            item.name = 'Renamed shirt'
+            item.save()
+        response = self.client.get(f'/items/{item.pk}/')
+        self.assertContains(response, 'Renamed shirt')
+        self.assertIn('public', response['Cache-Control'])
+
+    def test_city_edits_refresh_detail_pages(self):
+        from . import refdata
+
+        item = Item.objects.get()
+        self.client.get(f'/items/{item.pk}/')
+        self.assertEqual(self.client.get(f'/items/{item.pk}/')['X-Page-Cache'], 'hit')
+        with self.captureOnCommitCallbacks(execute=True):
+            city = City.objects.create(name='Homs')
+            Place.objects.create(city=city, name='Clock tower')
+        response = self.client.get(f'/items/{item.pk}/')
+        self.assertFalse(response.has_header('X-Page-Cache'))
+        self.assertContains(response, 'Homs')
+        self.assertContains(response, refdata.places_bundle().digest)
+
+    def test_version_is_bumped_again_on_commit(self):
+        from django.db import transaction
+        from .caching import bump_catalog_version, get_catalog_version
+
+        before = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                bump_catalog_version()
+                during = get_catalog_version()
+                # Rendered from data the commit is about to change.
+                self.client.get('/items/')
+        self.assertNotIn(get_catalog_version(), (before, during))
+        self.assertFalse(self.client.get('/items/').has_header('X-Page-Cache'))
+
+
+class GalleryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('seller')
+        category = Category.objects.create(name='Shirts')
+        cls.item = Item.objects.create(category=category, name='Shirt', price=10, created_by=user, image='item_images/a.jpg')
+        cls.red = ItemColor.objects.create(item=cls.item, name='red')
+        cls.image = ItemColorImage.objects.create(color=cls.red, image='item_color_images/b.jpg')
+
+    def setUp(self):
+        cache.clear()
+
+    def manifest(self):
+        from .gallery import get_manifest
+        return get_manifest(Item.objects.get(pk=self.item.pk))
+
+    def test_urls_come_from_the_field_storage(self):
+        with self.settings(STORAGES={**settings.STORAGES, 'default': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+            'OPTIONS': {'base_url': '/elsewhere/'},
+        }}):
+            images = self.manifest()['images']
+        self.assertEqual([image['url'] for image in images], [self.item.image.url, self.image.image.url])
+
+    def test_manifest_is_cached_until_invalidated(self):
+        self.manifest()
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.manifest()['images']), 2)
+
+        ItemColorImage.objects.create(color=self.red, image='item_color_images/c.jpg')
+        self.assertEqual(len(self.manifest()['images']), 3)
+
+        self.red.is_sold_out = True
+        self.red.save()
+        self.assertEqual([image['type'] for image in self.manifest()['images']], ['main'])
+
+        item = Item.objects.get(pk=self.item.pk)
+        item.image = None
+        item.save()
+        self.assertEqual(self.manifest()['images'], [])
+
+    def test_deleted_images_leave_the_manifest(self):
+        self.manifest()
+        self.image.delete()
+        self.assertEqual([image['type'] for image in self.manifest()['images']], ['main'])
+        self.red.delete()
+        self.assertEqual(self.manifest()['colors'], [])
+
+
+class DetailPageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('seller')
+        cls.item = Item.objects.create(category=Category.objects.create(name='Shirts'), name='Shirt', price=10, created_by=user)
+        cls.color = ItemColor.objects.create(item=cls.item, name='red')
+        cls.place = Place.objects.create(city=City.objects.create(name='Damascus'), name='Center')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_page_is_shared(self):
+        url = f'/items/{self.item.pk}/'
+        first = self.client.get(url, {'color': self.color.pk})
+        self.assertNotIn('csrftoken', first.cookies)
+        self.assertFalse(first.has_header('Vary') and 'Cookie' in first['Vary'])
+        self.assertIn('public', first['Cache-Control'])
+
+        # Other parameters share the entry of the (item, color) pair.
+        again = self.client.get(url, {'color': self.color.pk, 'utm_source': 'ad'})
+        self.assertEqual(again['X-Page-Cache'], 'hit')
+        self.assertEqual(again.content, first.content)
+        self.assertFalse(self.client.get(url).has_header('X-Page-Cache'))
+
+    def test_color_options_come_from_the_manifest(self):
+        ItemColor.objects.create(item=self.item, name='blue')
+        ItemColor.objects.create(item=self.item, name='green', is_sold_out=True)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/items/{self.item.pk}/')
+        self.assertContains(response, 'Shirt - blue')
+        self.assertContains(response, 'Shirt - red')
+        self.assertNotContains(response, 'Shirt - green')
+        item_reads = [query for query in queries if 'FROM "item_item"' in query['sql'] and 'WHERE "item_item"."id" =' in query['sql']]
+        self.assertEqual(len(item_reads), 1)
+
+    def test_order_uses_token_from_form_state(self):
+        client = Client(enforce_csrf_checks=True)
+        url = f'/items/{self.item.pk}/'
+        data = {
+            'color': self.color.pk, 'customer_name': 'Buyer', 'customer_phone': '0999',
+            'city': self.place.city_id, 'place': self.place.pk,
+        }
+        client.get(url)
+        self.assertEqual(client.post(url, data).status_code, 403)
+
+        state = client.get('/items/form-state/')
+        self.assertIn('no-cache', state['Cache-Control'])
+        self.assertEqual(state.json()['messages'], [])
+        data['csrfmiddlewaretoken'] = state.json()['csrf_token']
+        self.assertEqual(client.post(url, data).status_code, 302)
+        self.assertEqual(ItemRequest.objects.count(), 1)
+
+
+class CatalogAPITests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('seller')
+        cls.category = Category.objects.create(name='Shirts')
+        for n in range(5):
+            Item.objects.create(category=cls.category, name=f'Shirt {n}', description='Long text ' * 50, price=10 + n, created_by=user)
+        cls.item = Item.objects.order_by('id').first()
+        ItemColor.objects.create(item=cls.item, name='red')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_list_pages_and_sparse_fields(self):
+        response = self.client.get('/items/api/items/', {'page_size': 2, 'sort': 'price_asc', 'fields': 'name,price'})
+        data = response.json()
+        self.assertEqual(data['results'], [{'id': self.item.id, 'name': 'Shirt 0', 'price': 10.0}, {'id': self.item.id + 1, 'name': 'Shirt 1', 'price': 11.0}])
+        names = [row['name'] for row in self.client.get(data['next']).json()['results']]
+        self.assertEqual(names, ['Shirt 2', 'Shirt 3'])
+        self.assertNotIn('description', self.client.get('/items/api/items/').json()['results'][0])
+        self.assertEqual(self.client.get('/items/api/items/', {'fields': 'nope'}).status_code, 400)
+
+    def test_detail_conditional_and_compressed(self):
+        url = f'/items/api/items/{self.item.id}/'
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        data = self.client.get(url).json()
+        self.assertEqual([color['name'] for color in data['colors']], ['red'])
+        self.assertEqual(data['available_colors'], 1)
+
+        ItemColor.objects.create(item=self.item, name='blue')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get('/items/api/items/0/').status_code, 404)
+
+
+class DedupeMediaTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.media_root = media_root.name
+        for name, content in (('item_images/a.jpg', b'photo'), ('item_color_images/b.jpg', b'photo'), ('item_color_images/c.jpg', b'other')):
+            os.makedirs(os.path.join(self.media_root, os.path.dirname(name)), exist_ok=True)
+            with open(os.path.join(self.media_root, name), 'wb') as fh:
+                fh.write(content)
+        user = User.objects.create_user('staff')
+        self.item = Item.objects.create(
+            category=Category.objects.create(name='Shirts'), name='Shirt', price=10, created_by=user, image='item_images/a.jpg',
+        )
+        color = ItemColor.objects.create(item=self.item, name='red')
+        ItemColorImage.objects.create(color=color, image='item_color_images/b.jpg')
+        ItemColorImage.objects.create(color=color, image='item_color_images/c.jpg')
+        for source in ('item_images/a.jpg', 'item_color_images/b.jpg'):
+            ImageVariant.objects.create(source=source, variant='thumb', image=f'variants/{source}', width=1, height=1)
+
+    def test_dry_run_changes_nothing(self):
+        out = StringIO()
+        call_command('dedupe_media', dry_run=True, stdout=out)
+        self.assertIn('Would move 3 files into 2 blobs', out.getvalue())
+        self.assertEqual(Item.objects.get().image.name, 'item_images/a.jpg')
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_moves_files_into_shared_blobs(self):
+        call_command('dedupe_media', stdout=StringIO())
+        self.item.refresh_from_db()
+        photo = self.item.image.name
+        self.assertTrue(photo.startswith('blobs/'))
+        self.assertEqual(
+            sorted(ItemColorImage.objects.values_list('image', flat=True)),
+            sorted([photo, MediaBlob.objects.exclude(name=photo).get().name]),
+        )
+        self.assertEqual(MediaBlob.objects.get(name=photo).refcount, 2)
+        # The duplicate's derivatives are dropped, the first original's kept.
+        self.assertEqual(list(ImageVariant.objects.values_list('source', 'image')), [(photo, 'variants/item_color_images/b.jpg')])
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'item_images/a.jpg')))
+
+
+class GCMediaTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.media_root = media_root.name
+        user = User.objects.create_user('staff')
+        self.item = Item.objects.create(
+            category=Category.objects.create(name='Shirts'), name='Shirt', price=10, created_by=user,
+            image=SimpleUploadedFile('shirt.jpg', b'shirt'),
+        )
+        self.color_image = ItemColorImage.objects.create(
+            color=ItemColor.objects.create(item=self.item, name='red'), image=SimpleUploadedFile('red.jpg', b'red'),
+        )
+        ImageVariant.objects.create(source=self.item.image.name, variant='thumb', image='variants/shirt.webp', width=1, height=1)
+        ImageVariant.objects.create(source='item_images/gone.jpg', variant='thumb', image='variants/gone.webp', width=1, height=1)
+        for name in ('variants/shirt.webp', 'variants/gone.webp', 'item_images/gone.jpg', 'blobs/tmp/upload.part'):
+            self.write(name)
+        self.age(self.media_root)
+        self.write('item_images/uploading.jpg')
+
+    def write(self, name):
+        os.makedirs(os.path.join(self.media_root, os.path.dirname(name)), exist_ok=True)
+        with open(os.path.join(self.media_root, name), 'wb') as fh:
+            fh.write(b'x' * 10)
+
+    def age(self, path):
+        old = time.time() - 2 * 60 * 60 * 24
+        for directory, _, names in os.walk(path):
+            for name in names:
+                os.utime(os.path.join(directory, name), (old, old))
+        MediaBlob.objects.update(stored_at=timezone.now() - timedelta(days=2))
+
+    def files(self):
+        return sorted(
+            os.path.relpath(os.path.join(directory, name), self.media_root)
+            for directory, _, names in os.walk(self.media_root) for name in names
+        )
+
+    def test_deletes_unreferenced_files_after_grace_period(self):
+        before = self.files()
+        out = StringIO()
+        call_command('gc_media', dry_run=True, batch_size=2, stdout=out)
+        self.assertIn('Scanned 7 files: 3 orphaned (0.0 MB) would be deleted, 1 within the grace period, 1 stale', out.getvalue())
+        self.assertEqual(self.files(), before)
+
+        call_command('gc_media', batch_size=2, stdout=StringIO())
+        self.assertEqual(self.files(), sorted([
+            self.item.image.name, self.color_image.image.name, 'item_images/uploading.jpg', 'variants/shirt.webp',
+        ]))
+        self.assertEqual(list(ImageVariant.objects.values_list('image', flat=True)), ['variants/shirt.webp'])
+
+    def test_released_images_are_deleted_by_a_job(self):
+        red = self.color_image.image.name
+        self.color_image.delete()
+        # Disabled by default.
+        self.assertFalse(Job.objects.filter(name='item.delete_image').exists())
+
+        shirt = self.item.image.name
+        with override_settings(MEDIA_DELETE_ON_RELEASE=True):
+            self.item.image = SimpleUploadedFile('new.jpg', b'new')
+            self.item.save()
+            new = self.item.image.name
+            self.item.delete()
+        self.assertEqual(
+            sorted(payload['name'] for payload in Job.objects.filter(name='item.delete_image').values_list('payload', flat=True)),
+            sorted([shirt, new]),
+        )
+        # Stored moments ago, maybe by an upload that is about to use it.
+        self.assertFalse(orphans.delete_if_orphaned(new))
+
+        self.age(os.path.join(self.media_root, 'blobs'))
+        Job.objects.update(run_at=timezone.now())
+        self.assertEqual(jobs.run_pending(['item.delete_image']), (2, 0))
+        files = self.files()
+        self.assertEqual([name for name in (shirt, new, 'variants/shirt.webp', red) if name in files], [red])
+        self.assertEqual(list(MediaBlob.objects.values_list('name', flat=True)), [red])
+
+
+    def test_delete_checks_again_under_the_blob_lock(self):
+        from ghandyStore.storage import blob_storage
+
+        red = self.color_image.image.name
+        ItemColorImage.objects.filter(pk=self.color_image.pk).delete()
+        self.age(self.media_root)
+        # A reference counted by a save that had not committed when the
+        # checks before the lock ran.
+        MediaBlob.objects.filter(name=red).update(refcount=1)
+        self.assertFalse(orphans.delete_if_orphaned(red))
+        self.assertIn(red, self.files())
+
+        MediaBlob.objects.filter(name=red).update(refcount=0)
+        self.assertTrue(orphans.delete_if_orphaned(red))
+        self.assertNotIn(red, self.files())
+        self.assertFalse(MediaBlob.objects.filter(name=red).exists())
+
+        # An upload of the same bytes after the delete writes the file again.
+        self.assertEqual(blob_storage().save('item_color_images/red.jpg', SimpleUploadedFile('red.jpg', b'red')), red)
+        self.assertIn(red, self.files())
+        self.assertFalse(orphans.delete_if_orphaned(red))
+
+    def test_skipped_delete_leaves_no_blob_row(self):
+        name = 'blobs/' + 'ab/cd/' + 'abcd' * 16 + '.jpg'
+        self.write(name)
+        self.assertFalse(orphans.delete_if_orphaned(name))
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+
+
+def png(color='red', size=(8, 8)):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        cache.clear()
+
+    def save(self, content):
+        from django.core.files.base import ContentFile
+        from ghandyStore.storage import blob_storage
+        return blob_storage().save('item_images/photo.png', ContentFile(content))
+
+    def test_variants_are_generated_and_cached(self):
+        from .images import generate_variants, get_variants, get_variants_many
+
+        name = self.save(png(size=(800, 600)))
+        self.assertEqual(generate_variants(name), 3)
+        sizes = {variant: (width, height) for variant, (_url, width, height) in get_variants(name).items()}
+        self.assertEqual(sizes, {'thumb': (192, 192), 'card': (480, 360), 'full': (800, 600)})
+        with self.assertNumQueries(0):
+            get_variants(name)
+        self.assertEqual(generate_variants(name), 0)
+        with self.assertNumQueries(1):
+            found = get_variants_many([name, 'item_images/other.png'])
+        self.assertEqual((len(found[name]), found['item_images/other.png']), (3, {}))
+
+    def test_sources_go_through_the_blob_storage(self):
+        from ghandyStore.storage import blob_storage
+
+        from .images import generate_variants, variant_url
+
+        name = self.save(png(size=(800, 600)))
+        with self.settings(STORAGES={**settings.STORAGES, 'default': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+            'OPTIONS': {'location': self.enterContext(tempfile.TemporaryDirectory()), 'base_url': '/variants/'},
+        }}):
+            self.assertEqual(variant_url(name, 'full'), blob_storage().url(name))
+            cache.clear()
+            self.assertEqual(generate_variants(name), 3)
+            self.assertTrue(variant_url(name, 'full').startswith('/variants/'))
+
+    def test_missing_variants_are_cached_until_generated(self):
+        from .images import generate_variants, get_variants, get_variants_many
+
+        name = self.save(png())
+        self.assertEqual(get_variants(name), {})
+        with self.assertNumQueries(0):
+            self.assertEqual(get_variants(name), {})
+            self.assertEqual(get_variants_many([name]), {name: {}})
+        self.assertEqual(generate_variants(name), 3)
+        self.assertIn('thumb', get_variants(name))
+
+    def test_pages_look_variants_up_once(self):
+        user = User.objects.create_user('seller')
+        category = Category.objects.create(name='Shirts')
+        for n in range(6):
+            item = Item.objects.create(category=category, name=f'Shirt {n}', price=10, created_by=user, image=f'item_images/{n}.png')
+            ItemColorImage.objects.create(color=ItemColor.objects.create(item=item, name='red'), image=f'item_color_images/{n}.png')
+        for url in ('/', '/items/', f'/items/{item.pk}/', f'/items/category/{category.pk}'):
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            variant_queries = [query['sql'] for query in queries if 'item_imagevariant' in query['sql']]
+            self.assertEqual(len(variant_queries), 1, url)
+
+    def test_unreadable_images_are_skipped(self):
+        from .images import generate_variants
+
+        self.addCleanup(setattr, Image, 'MAX_IMAGE_PIXELS', Image.MAX_IMAGE_PIXELS)
+        Image.MAX_IMAGE_PIXELS = 1000
+        for content in (b'not an image', png(size=(100, 100))):
+            with self.assertLogs('item.images', 'WARNING'):
+                self.assertEqual(generate_variants(self.save(content)), 0)
+        self.assertFalse(ImageVariant.objects.exists())
+
+
+class BulkUploadTests(TransactionTestCase):
+    # The storage threads record reused blobs on their own connections.
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.media_root = media_root.name
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.item = Item.objects.create(category=Category.objects.create(name='Shirts'), name='Shirt', price=10, created_by=admin)
+        self.color = ItemColor.objects.create(item=self.item, name='red')
+        self.client.force_login(admin)
+        self.url = f'/admin/item/itemcolor/{self.color.pk}/upload/'
+
+    def send(self, upload, offset, data):
+        response = self.client.post(f'{self.url}?upload={upload}&offset={offset}', data, content_type='application/octet-stream')
+        return response.status_code, response.json()
+
+    def test_admin_chunked_upload(self):
+        self.assertContains(self.client.get(f'/admin/item/itemcolor/{self.color.pk}/change/'), 'bulkUploadFiles')
+        image, upload = png(), 'a' * 32
+        self.assertEqual(self.send(upload, 0, image[:40]), (200, {'offset': 40}))
+        # A chunk sent again after a lost response is refused; the client
+        # asks for the offset and resumes.
+        self.assertEqual(self.send(upload, 0, image[:40])[0], 409)
+        self.assertEqual(self.client.get(f'{self.url}?upload={upload}').json(), {'offset': 40})
+        self.assertEqual(self.send(upload, 40, image[40:]), (200, {'offset': len(image)}))
+        self.assertEqual(self.send('b' * 32, 0, b'not an image')[0], 200)
+        self.assertEqual(self.send('../etc', 0, b'x')[0], 400)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f'{self.url}finish/', json.dumps({'files': [
+                {'upload': upload, 'name': 'front.png'},
+                {'upload': 'b' * 32, 'name': 'notes.txt'},
+            ]}), content_type='application/json')
+        inserts = [query['sql'] for query in queries if query['sql'].startswith('INSERT INTO') and 'item_itemcolorimage' in query['sql']]
+        self.assertEqual(len(inserts), 1)
+        data = response.json()
+        self.assertEqual(data['created'], 1)
+        self.assertEqual([(result['name'], result['error']) for result in data['files']], [
+            ('front.png', None), ('notes.txt', 'Not a valid image'),
+        ])
+        name = data['files'][0]['image']
+        self.assertEqual(list(self.color.images.values_list('image', flat=True)), [name])
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 1)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.images_count, 1)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'blobs', 'tmp')), [])
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name, content in (('a.png', png()), ('b.png', png('blue')), ('copy.png', png()), ('c.png', b'')):
+                with open(os.path.join(directory, name), 'wb') as fh:
+                    fh.write(content)
+            out, err = StringIO(), StringIO()
+            call_command('upload_color_images', self.color.pk, directory, workers=2, stdout=out, stderr=err)
+        self.assertIn('Added 3 images to Shirt - red (1 failed)', out.getvalue())
+        self.assertEqual(out.getvalue().count('] '), 3)
+        self.assertIn('c.png: Empty file', err.getvalue())
+        self.assertEqual(self.color.images.values('image').distinct().count(), 2)
+        self.assertEqual(sorted(MediaBlob.objects.values_list('refcount', flat=True)), [1, 2])
@@ -0,0 +1,157 @@
+"""
+Bulk upload of color images, shared by the bulk upload of the ItemColor
+admin page and the ``upload_color_images`` command.
+
+Browsers send every file in chunks that are appended to a part file under
+BLOB_TMP_DIR, so a request holds one chunk at most whatever the size or
+number of files. An upload is resumable: the size of its part file is the
+offset the next chunk must start at. Finished files are validated and
+stored as blobs by a bounded thread pool, streaming from disk, and the rows
+are created with one bulk_create.
+"""
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connections, transaction
+from PIL import Image, UnidentifiedImageError
+
+from base import blobs
+from ghandyStore.storage import BLOB_TMP_DIR, blob_storage
+
+from . import counters, gallery
+from .caching import bump_catalog_version
+from .facets import bump_facets_version
+from .models import ItemColorImage
+from .tasks import queue_variants, queue_warm_catalog
+
+BULK_UPLOAD_WORKERS = getattr(settings, 'BULK_UPLOAD_WORKERS', 4)
+BULK_UPLOAD_MAX_SIZE = getattr(settings, 'BULK_UPLOAD_MAX_SIZE', 20 * 1024 * 1024)
+
+# Chunk size of browser uploads, and the buffer size of reads.
+CHUNK_SIZE = 1024 * 1024
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+# ``image`` is the stored name, or None when ``error`` says why not.
+Result = namedtuple('Result', 'name image error')
+
+
+class UploadError(Exception):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    def __init__(self, offset):
+        super().__init__(f'Upload continues at offset {offset}')
+        self.offset = offset
+
+
+def part_path(user_id, upload_id):
+    if not UPLOAD_ID_RE.match(upload_id or ''):
+        raise UploadError('Invalid upload id')
+    return blob_storage().path(f'{BLOB_TMP_DIR}/upload-{user_id}-{upload_id}.part')
+
+
+def received(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def append_chunk(path, offset, stream, length):
+    """
+    Append ``length`` bytes read from ``stream`` to the part file ``path``
+    and return its new size. ``offset`` must be the current size.
+    """
+    size = received(path)
+    if offset != size:
+        raise OffsetMismatch(size)
+    if size + length > BULK_UPLOAD_MAX_SIZE:
+        raise UploadError(f'File larger than {BULK_UPLOAD_MAX_SIZE // 1024 // 1024} MB')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'ab') as fh:
+        while length > 0:
+            chunk = stream.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            fh.write(chunk)
+            length -= len(chunk)
+    return received(path)
+
+
+def validate(path):
+    if not os.path.getsize(path):
+        raise UploadError('Empty file')
+    if os.path.getsize(path) > BULK_UPLOAD_MAX_SIZE:
+        raise UploadError(f'File larger than {BULK_UPLOAD_MAX_SIZE // 1024 // 1024} MB')
+    try:
+        # verify() checks the file without decoding the pixels.
+        with Image.open(path) as image:
+            image.verify()
+    except (OSError, SyntaxError, UnidentifiedImageError, Image.DecompressionBombError):
+        raise UploadError('Not a valid image')
+
+
+def store(name, path):
+    try:
+        validate(path)
+        with open(path, 'rb') as fh:
+            return Result(name, blob_storage().save(f'item_color_images/{os.path.basename(name)}', File(fh)), None)
+    except UploadError as exc:
+        return Result(name, None, str(exc))
+    except OSError as exc:
+        return Result(name, None, f'Cannot read file: {exc.strerror}')
+
+
+def _store_in_thread(name, path):
+    try:
+        return store(name, path)
+    finally:
+        # The storage records reused blobs on this thread's connection.
+        connections.close_all()
+
+
+def store_many(files, workers=BULK_UPLOAD_WORKERS, progress=None):
+    """
+    Validate and store ``files`` (``(name, path)`` pairs) with ``workers``
+    threads. Returns the results in the order of ``files``; ``progress`` is
+    called with each result as it completes.
+    """
+    files = list(files)
+    results = [None] * len(files)
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        futures = {pool.submit(_store_in_thread, name, path): index for index, (name, path) in enumerate(files)}
+        for future in as_completed(futures):
+            results[futures[future]] = result = future.result()
+            if progress:
+                progress(result)
+    return results
+
+
+def add_color_images(color, names):
+    """Create the image rows of ``color`` with one bulk_create."""
+    if not names:
+        return []
+    with transaction.atomic():
+        images = ItemColorImage.objects.bulk_create([ItemColorImage(color=color, image=name) for name in names])
+        # bulk_create skips the signals of single saves.
+        counters.add_images(color.pk, len(images))
+        blobs.recount(set(names))
+        for name in set(names):
+            queue_variants(name)
+        gallery.invalidate(color.item_id)
+        bump_catalog_version()
+        bump_facets_version()
+        queue_warm_catalog()
+    return images
+
+
+def upload_color_images(color, files, workers=BULK_UPLOAD_WORKERS, progress=None):
+    """Store ``files`` and add the valid ones to ``color``. Returns the results."""
+    results = store_many(files, workers, progress)
+    add_color_images(color, [result.image for result in results if result.image])
+    return results
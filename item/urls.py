@@ -1,15 +1,21 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 app_name = 'item'
 
 urlpatterns = [
     path('', views.items, name='items'),
+    path('more/', views.items_more, name='items_more'),
     path('new/', views.new, name='new'),
     path('<int:pk>/', views.detail, name='detail'),
+    path('form-state/', views.form_state, name='form_state'),
     path('<int:pk>/delete/', views.delete, name='delete'),
     path('<int:pk>/edit/', views.edit, name='edit'),
     path('category/<int:pk>', views.category, name='category'),
     path('api/places/<int:city_id>/', views.get_places_by_city, name='get_places_by_city'),
+    path('api/places/bundle/<str:digest>.json', views.places_bundle, name='places_bundle'),
+    path('api/categories/', api.categories, name='api_categories'),
+    path('api/items/', api.items, name='api_items'),
+    path('api/items/<int:pk>/', api.item, name='api_item'),
 ]
@@ -1,136 +1,119 @@
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, HttpResponseNotModified, JsonResponse
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.middleware.csrf import get_token
+from django.views.decorators.cache import cache_control, never_cache
+from django.views.decorators.http import condition, require_safe
+from django.db import transaction
+from datetime import datetime, timezone
 from urllib.parse import quote
+import hashlib
+import json
 
+from . import refdata
+from .caching import cache_catalog_page
+from .facets import build_facets, filter_queryset, get_counts, get_filters
 from .forms import NewItemForm, EditItemForm, ItemRequestForm
-from .models import Category, Item, City, Place, ItemColor
+from .models import Item
+from .gallery import find_color, get_manifest, order_images
+from .images import get_variants_many
+from .pagination import SORT_LABELS, get_sort, paginate
+from .search import search
+from .stock import OutOfStock, reserve
 
 
-def category(request, pk ):
-    category= Category.objects.get(pk=pk)
-    item = Item.objects.filter(category=category , is_sold=False).exclude(pk=pk)[0:9]
+CATALOG_PAGE_SIZE = 12
 
-    return render(request, 'item/category.html',{
-        'item': item,
+
+def catalog_page(request, category_id=None, page_size=CATALOG_PAGE_SIZE):
+    """
+    Return the requested page of unsold items, applying the ``query``,
+    facet filters (see item.facets), ``sort`` and ``cursor`` GET
+    parameters. Shared by the index, items and category pages and by the
+    load-more fragment.
+    """
+    query = request.GET.get('query', '')
+    filters = get_filters(request.GET, category_id)
+    items = filter_queryset(Item.objects.filter(is_sold=False), filters)
+
+    if query:
+        items = search(items, query)
+
+    sort = get_sort(request.GET.get('sort'), allow_relevance=bool(query))
+    return paginate(items, sort=sort, cursor=request.GET.get('cursor'), page_size=page_size)
+
+
+def page_variants(*images):
+    """Variants of every image on a page, for the item_images tags: one lookup instead of one per image."""
+    return get_variants_many(getattr(image, 'name', image) for image in images)
+
+
+def more_url(request, page, **extra):
+    """URL of the load-more fragment for the page following ``page``."""
+    if not page.has_next:
+        return None
+    params = request.GET.copy()
+    for key, value in extra.items():
+        params[key] = value
+    params['cursor'] = page.next_cursor
+    params['sort'] = page.sort
+    return f"{reverse('item:items_more')}?{params.urlencode()}"
+
+
+@cache_catalog_page
+def category(request, pk):
+    category = refdata.get_category(pk)
+    if category is None:
+        raise Http404('No Category matches the given query.')
+    page = catalog_page(request, category_id=category.id)
+
+    return render(request, 'item/category.html', {
+        'items': page,
         'category': category,
+        'image_variants': page_variants(*(item.image for item in page)),
+        'more_url': more_url(request, page, category=category.id),
     })
 
 
+# The page has no per-visitor content (see form_state), so anonymous GETs
+# are cached per item and selected color, also by shared caches.
+@cache_catalog_page(params=('color',), shared=True)
 def detail(request, pk):
     item = get_object_or_404(Item, pk=pk)
-    related_items = Item.objects.filter(category=item.category, is_sold=False).exclude(pk=pk)[0:3]
-    
-    # Get all colors for this item with their images
-    colors = ItemColor.objects.filter(item=item).prefetch_related('images').order_by('name')
-    
+    related_items = list(Item.objects.filter(category=item.category, is_sold=False).exclude(pk=pk)[0:3])
+
+    # Colors and images come from the cached gallery manifest
+    manifest = get_manifest(item)
+    colors = manifest['colors']
+
     # Get selected color from request (for displaying specific color images)
-    selected_color_id = request.GET.get('color', None)
-    selected_color = None
-    if selected_color_id:
-        try:
-            selected_color = ItemColor.objects.get(pk=selected_color_id, item=item)
-        except ItemColor.DoesNotExist:
-            selected_color = None
-    
-    # Collect all images: main item image first, then all color images
-    # If a color is selected, put that color's images first
-    all_images = []
-    selected_color_images = []
-    
-    # If color is selected, collect its images first
-    if selected_color and not selected_color.is_sold_out:
-        for color_image in selected_color.images.all():
-            selected_color_images.append({
-                'url': color_image.image.url,
-                'type': 'color',
-                'color': selected_color,
-                'color_id': selected_color.id,
-                'alt': f"{item.name} - {selected_color.name}"
-            })
-    
-    # Add main item image (only if no color selected or color has no images)
-    if item.image and (not selected_color or not selected_color_images):
-        all_images.append({
-            'url': item.image.url,
-            'type': 'main',
-            'color': None,
-            'color_id': None,
-            'alt': f"{item.name} - Main Image"
-        })
-    
-    # Add selected color images first if they exist
-    all_images.extend(selected_color_images)
-    
-    # Add other color images (excluding selected color if it was added above)
-    for color in colors:
-        if not color.is_sold_out and color != selected_color:
-            for color_image in color.images.all():
-                all_images.append({
-                    'url': color_image.image.url,
-                    'type': 'color',
-                    'color': color,
-                    'color_id': color.id,
-                    'alt': f"{item.name} - {color.name}"
-                })
-
-    form = ItemRequestForm(item=item)
+    selected_color = find_color(manifest, request.GET.get('color'))
+
+    form = ItemRequestForm(item=item, colors=colors)
     show_form = False
     
     if request.method == 'POST':
-        form = ItemRequestForm(request.POST, item=item)
-        # Check for color in POST data or GET parameter
-        color_id_from_post = form.data.get('color')
-        color_id_from_get = request.GET.get('color')
-        color_id_to_use = color_id_from_post or color_id_from_get
-        
-        # If form has a color selected (even if invalid), use it for display
-        if color_id_to_use:
-            try:
-                color_id = int(color_id_to_use)
-                selected_color = ItemColor.objects.filter(pk=color_id, item=item).first()
-                # Rebuild images list with selected color first
-                if selected_color:
-                    all_images = []
-                    selected_color_images = []
-                    if not selected_color.is_sold_out:
-                        for color_image in selected_color.images.all():
-                            selected_color_images.append({
-                                'url': color_image.image.url,
-                                'type': 'color',
-                                'color': selected_color,
-                                'color_id': selected_color.id,
-                                'alt': f"{item.name} - {selected_color.name}"
-                            })
-                    if item.image and not selected_color_images:
-                        all_images.append({
-                            'url': item.image.url,
-                            'type': 'main',
-                            'color': None,
-                            'color_id': None,
-                            'alt': f"{item.name} - Main Image"
-                        })
-                    all_images.extend(selected_color_images)
-                    for color in colors:
-                        if not color.is_sold_out and color != selected_color:
-                            for color_image in color.images.all():
-                                all_images.append({
-                                    'url': color_image.image.url,
-                                    'type': 'color',
-                                    'color': color,
-                                    'color_id': color.id,
-                                    'alt': f"{item.name} - {color.name}"
-                                })
-            except (ValueError, TypeError):
-                pass
+        form = ItemRequestForm(request.POST, item=item, colors=colors)
+        # A color chosen in the form (even if invalid) wins over the GET parameter
+        selected_color = find_color(manifest, form.data.get('color')) or selected_color
+
         if form.is_valid():
-            # Save the request to database
+            # Save the request to database, taking one unit of stock in the
+            # same transaction
             item_request = form.save(commit=False)
             item_request.item = item
-            item_request.save()
-            
+            try:
+                with transaction.atomic():
+                    reserve(item, form.cleaned_data.get('color'))
+                    item_request.save()
+            except OutOfStock:
+                # The last unit went to another buyer after validation
+                form.add_error('color' if form.cleaned_data.get('color') else None, 'Sorry, this just sold out.')
+
+        if form.is_valid():
             # Build WhatsApp message
             customer_name = form.cleaned_data['customer_name']
             customer_phone = form.cleaned_data['customer_phone']
@@ -162,68 +145,78 @@ def detail(request, pk):
         else:
             # Form has errors, show the form
             show_form = True
-            # Preserve selected color in form initial data and ensure it's in the context
+            # Preserve selected color in form initial data
             if selected_color:
-                form.fields['color'].initial = selected_color.id
-                # Also rebuild images list to show selected color first
-                all_images = []
-                selected_color_images = []
-                if not selected_color.is_sold_out:
-                    for color_image in selected_color.images.all():
-                        selected_color_images.append({
-                            'url': color_image.image.url,
-                            'type': 'color',
-                            'color': selected_color,
-                            'color_id': selected_color.id,
-                            'alt': f"{item.name} - {selected_color.name}"
-                        })
-                if item.image and not selected_color_images:
-                    all_images.append({
-                        'url': item.image.url,
-                        'type': 'main',
-                        'color': None,
-                        'color_id': None,
-                        'alt': f"{item.name} - Main Image"
-                    })
-                all_images.extend(selected_color_images)
-                for color in colors:
-                    if not color.is_sold_out and color != selected_color:
-                        for color_image in color.images.all():
-                            all_images.append({
-                                'url': color_image.image.url,
-                                'type': 'color',
-                                'color': color,
-                                'color_id': color.id,
-                                'alt': f"{item.name} - {color.name}"
-                            })
+                form.fields['color'].initial = selected_color['id']
 
     return render(request, 'item/detail.html', {
         'item': item,
         'related_items': related_items,
         'colors': colors,
         'selected_color': selected_color,
-        'all_images': all_images,
+        'all_images': order_images(manifest, selected_color),
+        'image_variants': page_variants(
+            item.image, *(image['name'] for image in manifest['images']), *(related.image for related in related_items),
+        ),
         'form': form,
-        'show_form': show_form
+        'show_form': show_form,
+        'places_bundle_url': reverse('item:places_bundle', kwargs={'digest': refdata.places_bundle().digest}),
+    })
+
+@require_safe
+@never_cache
+def form_state(request):
+    """
+    Per-visitor state of the order form on the cached detail page: a CSRF
+    token (which also sets the CSRF cookie) and pending messages.
+    """
+    return JsonResponse({
+        'csrf_token': get_token(request),
+        'messages': [{'text': str(message), 'tags': message.tags} for message in messages.get_messages(request)],
     })
 
+
+@cache_catalog_page
 def items(request):
     query = request.GET.get('query', '')
-    category_id = request.GET.get('category', 0)
-    categories = Category.objects.all()
-    items = Item.objects.filter(is_sold=False)
-
-    if category_id:
-        items = items.filter(category_id=category_id)
+    filters = get_filters(request.GET)
+    page = catalog_page(request)
 
+    query_ids = None
     if query:
-        items = items.filter(Q(name__icontains=query) | Q(description__icontains=query))
+        # Streamed into the facet index's bitmap instead of a list of ids.
+        query_ids = (
+            search(Item.objects.filter(is_sold=False), query)
+            .order_by().values_list('id', flat=True).iterator(chunk_size=2000)
+        )
+    facets = build_facets(request.GET, filters, get_counts(filters, query_ids))
+
+    # Current filters without the position, for the sort links
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    params.pop('sort', None)
 
     return render(request, 'item/items.html', {
-        'items': items,
+        'items': page,
         'query': query,
-        'categories': categories,
-        'category_id': int(category_id)
+        'facets': facets,
+        'filters': filters,
+        'filter_params': params.urlencode(),
+        'sort': page.sort,
+        'sort_labels': SORT_LABELS,
+        'image_variants': page_variants(*(item.image for item in page)),
+        'more_url': more_url(request, page),
+    })
+
+@cache_catalog_page
+def items_more(request):
+    """HTML fragment with the next page of item cards for "load more"."""
+    page = catalog_page(request)
+
+    return render(request, 'item/partials/item_page.html', {
+        'items': page,
+        'image_variants': page_variants(*(item.image for item in page)),
+        'more_url': more_url(request, page),
     })
 
 
@@ -272,8 +265,44 @@ def delete(request, pk):
 
     return redirect('base:index')
 
+def _places_content(city_id):
+    places = refdata.places_for_city(city_id)
+    return json.dumps({'places': [{'id': place.id, 'name': place.name} for place in places]}).encode()
+
+
+def _places_etag(request, city_id):
+    # Digest of the response body, like the digest of the places bundle.
+    return hashlib.sha256(_places_content(city_id)).hexdigest()[:16]
+
+
+def _places_last_modified(request, city_id):
+    return datetime.fromtimestamp(refdata.get_refdata().changed, tz=timezone.utc)
+
+
+@cache_control(no_cache=True)
+@condition(etag_func=_places_etag, last_modified_func=_places_last_modified)
 def get_places_by_city(request, city_id):
     """API endpoint to fetch places for a given city"""
-    places = Place.objects.filter(city_id=city_id).order_by('name')
-    places_data = [{'id': place.id, 'name': place.name} for place in places]
-    return JsonResponse({'places': places_data})
\ No newline at end of file
+    return HttpResponse(_places_content(city_id), content_type='application/json')
+
+
+def places_bundle(request, digest):
+    """
+    All cities and their places in one document. The URL contains the
+    content digest, so a matching request can be cached forever; requests
+    for an outdated digest are redirected to the current bundle.
+    """
+    bundle = refdata.places_bundle()
+    if digest != bundle.digest:
+        response = redirect('item:places_bundle', digest=bundle.digest)
+        patch_cache_control(response, no_cache=True)
+        return response
+
+    etag = f'"{bundle.digest}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(bundle.content, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=60 * 60 * 24 * 365, immutable=True)
+    return response